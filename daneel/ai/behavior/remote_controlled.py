@@ -16,4 +16,4 @@ class RemoteControlled(Behavior):
     def set_speed(self, agent, *arg):
         print(arg[0])
         acid, mode, throttle, vy, vx, w = arg[0].split(" ")
-        self.robot.communication.send_speed_command(-2*int(vx), -2*int(vy), -float(w)/100)
+        self.robot.communication.send_speed_command(-2*int(vx), -2*int(vy), -float(w)/100, wait=False)
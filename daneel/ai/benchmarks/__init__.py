@@ -0,0 +1,6 @@
+"""
+Micro benchmarks of the hot paths of the ai, to be run from the ai directory, eg.:
+    python3 -m benchmarks.codec
+or all the serialization and link benchmarks, saving their results to compare them across commits:
+    python3 -m benchmarks --json bench.json
+"""
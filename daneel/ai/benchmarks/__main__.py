@@ -0,0 +1,121 @@
+"""
+Suite of the serialization and link benchmarks, headless, whose results can be saved and compared across commits.
+
+From the ai directory:
+    python3 -m benchmarks --json bench_before.json                          # runs and saves every benchmark
+    python3 -m benchmarks --json bench_after.json --compare bench_before.json  # also prints the change of each result
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from benchmarks import codec, dispatch, link
+
+MSG_RATE_UNIT = 'msg/s'  # higher is better
+LATENCY_UNIT = 'us'  # lower is better
+NUMBERS = {'codec': 20000, 'dispatch': 100000, 'link': 500}  # iterations of each benchmark with --quick not set
+QUICK_DIVIDER = 10
+
+
+def _git(*args):
+    try:
+        return subprocess.run(('git',) + args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+                              universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """
+    :return: description of the code and the machine the benchmarks are run on
+    :rtype: dict
+    """
+    status = _git('status', '--porcelain', '--untracked-files=no')
+    return {'commit': _git('rev-parse', 'HEAD'),
+            'dirty': None if status is None else bool(status),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'platform': platform.platform()}
+
+
+def run(quick=False, latency=0.):
+    """
+    :param quick: run each benchmark QUICK_DIVIDER times less
+    :type quick: bool
+    :param latency: latency added by the emulated Teensy in the link benchmark (s)
+    :type latency: float
+    :return: {benchmark name: {'value': float, 'unit': str}}
+    :rtype: dict[str, dict]
+    """
+    numbers = {name: number // QUICK_DIVIDER if quick else number for name, number in NUMBERS.items()}
+    results = {}
+    for name, rate in codec.encode_rates(numbers['codec']).items():
+        results['encode.' + name] = {'value': rate, 'unit': MSG_RATE_UNIT}
+    for name, rate in codec.decode_rates(numbers['codec']).items():
+        results['decode.' + name] = {'value': rate, 'unit': MSG_RATE_UNIT}
+    for name, rate in dispatch.dispatch_rates(numbers['dispatch']).items():
+        results['dispatch.' + name] = {'value': rate, 'unit': MSG_RATE_UNIT}
+    for batching in (False, True):
+        prefix = 'ack_latency.v2.' if batching else 'ack_latency.v1.'
+        for name, summary in link.ack_latencies(numbers['link'], latency, batching).items():
+            for key in ('p50', 'p99'):
+                results[prefix + name + '.' + key] = {'value': summary[key], 'unit': LATENCY_UNIT}
+    return results
+
+
+def improvement(value, reference, unit):
+    """
+    :return: relative improvement of value over reference (positive when better)
+    :rtype: float
+    """
+    if unit == LATENCY_UNIT:
+        return reference / value - 1 if value > 0 else 0.
+    return value / reference - 1 if reference > 0 else 0.
+
+
+def print_results(results, reference=None):
+    """
+    :param reference: results of a previous run, to print the change of each result
+    :type reference: dict[str, dict]|None
+    """
+    for name, result in results.items():
+        line = "{:<40} {:>12.1f} {:<6}".format(name, result['value'], result['unit'])
+        if reference is not None and name in reference:
+            line += "  {:+7.1%}".format(improvement(result['value'], reference[name]['value'], result['unit']))
+        print(line.rstrip())
+
+
+def main():
+    parser = argparse.ArgumentParser("Serialization and link benchmark suite")
+    parser.add_argument('--json', type=str, default=None, help="Save the results and the environment in this file")
+    parser.add_argument('--compare', type=str, default=None,
+                        help="Results file of a previous run, to print the improvement of each result (positive when "
+                             "better)")
+    parser.add_argument('--quick', action='store_true', default=False,
+                        help="Run {} times less iterations".format(QUICK_DIVIDER))
+    parser.add_argument('--latency', type=float, default=0., help="Latency of the emulated link (s)")
+    args = parser.parse_args()
+
+    reference = None
+    if args.compare is not None:
+        with open(args.compare) as reference_file:
+            previous = json.load(reference_file)
+        reference = previous['results']
+        print("Compared to commit {} ({})".format(previous['environment']['commit'], previous['environment']['date']))
+    report = {'environment': environment(), 'arguments': vars(args)}
+    report['results'] = run(args.quick, args.latency)
+    print_results(report['results'], reference)
+    if args.json is not None:
+        with open(args.json, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    if report['environment']['dirty']:
+        print("Warning : uncommitted changes, the results are not those of commit {}".format(
+            report['environment']['commit']), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
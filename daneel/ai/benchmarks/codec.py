@@ -0,0 +1,257 @@
+"""
+Throughput of the Teensy message codec (communication.message_definition).
+
+Every message type is encoded with DownFrameEncoder and the up messages are decoded, then compared to the bitstring
+implementation used before the struct codecs (when bitstring is installed), to check that the frames on the wire are
+byte identical and measure the gain.
+"""
+import argparse
+import timeit
+
+from communication.message_definition import *
+
+try:
+    import bitstring
+except ImportError:
+    bitstring = None
+
+REPEAT = 5  # timings of each rate, the best one is kept (the others are slowed down by the rest of the system)
+
+
+def _speed(d):
+    return (round((d.vx + LINEAR_SPEED_TO_MSG_ADDER) * LINEAR_SPEED_TO_MSG_FACTOR),
+            round((d.vy + LINEAR_SPEED_TO_MSG_ADDER) * LINEAR_SPEED_TO_MSG_FACTOR),
+            round((d.vtheta + ANGULAR_SPEED_TO_MSG_ADDER) * ANGULAR_SPEED_TO_MSG_FACTOR))
+
+
+def _repositioning(d):
+    return (min(round((d.x_repositioning + LINEAR_POSITION_TO_MSG_ADDER) * LINEAR_POSITION_TO_MSG_FACTOR), 65535),
+            min(round((d.y_repositioning + LINEAR_POSITION_TO_MSG_ADDER) * LINEAR_POSITION_TO_MSG_FACTOR), 65535),
+            min(round((d.theta_repositioning + RADIAN_TO_MSG_ADDER) * RADIAN_TO_MSG_FACTOR), 65535))
+
+
+def _pid(d):
+    return tuple(round(value * 1000) for value in (d.kp_linear, d.ki_linear, d.kd_linear, d.kp_angular, d.ki_angular,
+                                                  d.kd_angular))
+
+
+# bitstring formats and conversions of the former implementation
+BITSTRING_FORMATS = {
+    sAckUp: ('uint:8', lambda d: (d.ack_up_id,)),
+    sSpeedCommand: ('uintle:16, uintle:16, uintle:16', _speed),
+    sActuatorCommand: ('uint:8, uintle:16', lambda d: (d.actuator_id, d.actuator_command)),
+    sHMICommand: ('uint:8', lambda d: (d.hmi_command,)),
+    sRepositioning: ('uintle:16, uintle:16, uintle:16', _repositioning),
+    sPIDTuning: ('uintle:16, uintle:16, uintle:16, uintle:16, uintle:16, uintle:16', _pid),
+    sSensorCommand: ('uint:8, uint:8', lambda d: (d.sensor_id, d.sensor_state)),
+}
+
+
+def bitstring_encode(msg):
+    """
+    Former serialization of a down message (sMessageDown.serialize with bitstring), with the start bytes.
+    """
+    payload = b''
+    checksum = 0
+    if msg.data is not None:
+        fmt, values = BITSTRING_FORMATS[type(msg.data)]
+        payload = bitstring.pack(fmt, *values(msg.data)).tobytes()
+        for octet in payload:
+            checksum ^= octet
+    checksum = checksum % 0xFF
+    header = bitstring.pack('uint:8, uint:8, uint:8, uint:8', msg.down_id, msg.type.value, len(payload), checksum)
+    return FRAME_START + header.tobytes() + payload
+
+
+def bitstring_decode_odometry(packed):
+    bitstring.Bits(packed[0:UP_HEADER_SIZE]).unpack('uint:8, uint:8, uint:8, uint:8')
+    return bitstring.Bits(packed[UP_HEADER_SIZE:]).unpack('uintle:16, uintle:16, uintle:16')
+
+
+def down_messages():
+    """
+    :return: one message of each down type
+    :rtype: list[sMessageDown]
+    """
+    messages = []
+
+    def new(msg_type, data):
+        msg = sMessageDown()
+        msg.down_id = len(messages) * 37 % 256
+        msg.type = msg_type
+        msg.data = data
+        messages.append(msg)
+        return data
+
+    new(eTypeDown.ACK_UP, sAckUp()).ack_up_id = 42
+    speed = new(eTypeDown.SPEED_COMMAND, sSpeedCommand())
+    speed.vx, speed.vy, speed.vtheta = 100, 0, -1
+    actuator = new(eTypeDown.ACTUATOR_COMMAND, sActuatorCommand())
+    actuator.actuator_id, actuator.actuator_command = 3, 1500
+    new(eTypeDown.HMI_COMMAND, sHMICommand()).hmi_command = 0b10110101
+    new(eTypeDown.RESET, None)
+    repositioning = new(eTypeDown.REPOSITIONING, sRepositioning())
+    repositioning.x_repositioning, repositioning.y_repositioning, repositioning.theta_repositioning = 1500, 250, 1.57
+    pid = new(eTypeDown.PID_TUNING, sPIDTuning())
+    pid.kp_linear, pid.ki_linear, pid.kd_linear = 1.5, 0.2, 0
+    pid.kp_angular, pid.ki_angular, pid.kd_angular = 3, 0.5, 0.01
+    sensor = new(eTypeDown.SENSOR_COMMAND, sSensorCommand())
+    sensor.sensor_id, sensor.sensor_state = 1, 1
+    return messages
+
+
+def protocol_2_messages():
+    """
+    :return: one message of each down type of the protocol version 2 (not in the bitstring implementation)
+    :rtype: list[sMessageDown]
+    """
+    version = sMessageDown()
+    version.down_id = 200
+    version.type = eTypeDown.PROTOCOL_VERSION
+    version.data = sProtocolVersion()
+    version.data.version = PROTOCOL_VERSION
+    batch = sMessageDown()
+    batch.down_id = 201
+    batch.type = eTypeDown.BATCH
+    # Every batchable message but the PID tuning, which does not fit with the others in BATCH_MAX_DATA_SIZE
+    batch.data = sBatch(msg for msg in down_messages() if msg.type in BATCHABLE_TYPES - {eTypeDown.PID_TUNING})
+    return [version, batch]
+
+
+def up_messages():
+    """
+    :return: one message of each up type
+    :rtype: list[sMessageUp]
+    """
+    messages = []
+
+    def new(msg_type, data):
+        msg = sMessageUp()
+        msg.up_id = len(messages) * 37 % 256
+        msg.type = msg_type
+        msg.data = data
+        messages.append(msg)
+        return data
+
+    new(eTypeUp.ACK_DOWN, sAckDown()).ack_down_id = 42
+    odometry = new(eTypeUp.ODOM_REPORT, sOdomReport())
+    odometry.x, odometry.y, odometry.theta = 1500, 250, 1.57
+    new(eTypeUp.HMI_STATE, sHMIState()).hmi_state = 0b10110100
+    sensor = new(eTypeUp.SENSOR_VALUE, sSensorValue())
+    sensor.sensor_id, sensor.sensor_value = 1, 612
+    speed = new(eTypeUp.SPEED_REPORT, sSpeedReport())
+    speed.vx, speed.vy, speed.vtheta, speed.drifting_flags = 250, 0, -0.5, 0b10
+    return messages
+
+
+def odometry_frame():
+    msg = sMessageUp()
+    msg.up_id = 12
+    msg.type = eTypeUp.ODOM_REPORT
+    msg.data = sOdomReport()
+    msg.data.x, msg.data.y, msg.data.theta = 1500, 250, 1.57
+    return msg.serialize()
+
+
+def check_frames():
+    """
+    Compare the frames of the struct codec with the former bitstring implementation.
+
+    :return: the number of compared messages
+    :rtype: int
+    """
+    encoder = DownFrameEncoder()
+    messages = down_messages()
+    for msg in messages:
+        frame = encoder.encode(msg)
+        reference = bitstring_encode(msg)
+        if frame != reference:
+            raise AssertionError("{} frames differ : {} (struct) != {} (bitstring)".format(msg.type, frame, reference))
+        if msg.serialize() != frame[len(FRAME_START):]:
+            raise AssertionError("{} : sMessageDown.serialize differs from the encoder".format(msg.type))
+    return len(messages)
+
+
+def decode_up_message(packed):
+    msg = sMessageUp()
+    msg.deserialize_header(packed)
+    msg.deserialize_data(packed[UP_HEADER_SIZE:])
+    return msg
+
+
+def best_rate(function, number):
+    """
+    :return: calls of function per second, in the best of REPEAT timings of number calls
+    :rtype: float
+    """
+    return number / min(timeit.repeat(function, number=number, repeat=REPEAT))
+
+
+def encode_rates(number):
+    """
+    :return: {down type name: frames encoded by DownFrameEncoder per second}
+    :rtype: dict[str, float]
+    """
+    encoder = DownFrameEncoder()
+    return {msg.type.name: best_rate(lambda: encoder.encode(msg), number)
+            for msg in down_messages() + protocol_2_messages()}
+
+
+def decode_rates(number):
+    """
+    :return: {up type name: frames decoded (header and data) per second}
+    :rtype: dict[str, float]
+    """
+    rates = {}
+    for msg in up_messages():
+        packed = msg.serialize()
+        rates[msg.type.name] = best_rate(lambda: decode_up_message(packed), number)
+    return rates
+
+
+def run(number):
+    """
+    :return: {benchmark name: (struct messages/s, bitstring messages/s or None)}
+    :rtype: dict[str, tuple[float, float|None]]
+    """
+    encoder = DownFrameEncoder()
+    messages = down_messages()
+    packed = odometry_frame()
+    results = {}
+
+    def rate(function, count):
+        return count * number / timeit.timeit(function, number=number)
+
+    results['encode'] = (rate(lambda: [encoder.encode(m) for m in messages], len(messages)),
+                         rate(lambda: [bitstring_encode(m) for m in messages], len(messages)) if bitstring else None)
+    results['decode odometry'] = (rate(lambda: decode_up_message(packed), 1),
+                                  rate(lambda: bitstring_decode_odometry(packed), 1) if bitstring else None)
+    stream = FRAME_START + packed
+    parser = FrameParser(UP_DATA_SIZES, buffer_size=len(stream) * 100)
+
+    def parse_stream():
+        parser.feed(stream * 100)
+        for frame in parser.frames():
+            pass
+    results['parse stream'] = (rate(parse_stream, 100), None)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser("Teensy message codec benchmark")
+    parser.add_argument('--number', type=int, default=20000, help="Number of iterations of each benchmark")
+    args = parser.parse_args()
+    if bitstring is None:
+        print("bitstring is not installed : no comparison with the former implementation")
+    else:
+        print("{} message types byte identical to the bitstring implementation".format(check_frames()))
+    for name, (struct_rate, bitstring_rate) in run(args.number).items():
+        if bitstring_rate is None:
+            print("{:<16} struct : {:>10.0f} msg/s".format(name, struct_rate))
+        else:
+            print("{:<16} struct : {:>10.0f} msg/s   bitstring : {:>8.0f} msg/s   x{:.1f}".format(
+                name, struct_rate, bitstring_rate, struct_rate / bitstring_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+"""
+Cost of the dispatch of the up messages to their callbacks (BaseCommunication.handle_message), with one callback
+doing nothing registered for each type, as in the main loop of the robot.
+"""
+import argparse
+
+from benchmarks.codec import best_rate, up_messages
+from communication import BaseCommunication
+
+
+def _callback(*_):
+    pass
+
+
+def dispatch_rates(number):
+    """
+    :return: {up type name: messages dispatched per second}
+    :rtype: dict[str, float]
+    """
+    communication = BaseCommunication()
+    for msg_type in communication.eTypeUp:
+        communication.register_callback(msg_type, _callback)
+    return {msg.type.name: best_rate(lambda: communication.handle_message(msg), number) for msg in up_messages()}
+
+
+def main():
+    parser = argparse.ArgumentParser("Teensy message dispatch benchmark")
+    parser.add_argument('--number', type=int, default=100000, help="Number of dispatches of each type")
+    args = parser.parse_args()
+    for name, rate in dispatch_rates(args.number).items():
+        print("{:<16} {:>10.0f} msg/s".format(name, rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+End to end latency of the down messages, from Communication.send_message to the reception of their acknowledgement,
+through a local pty with the Teensy emulator (communication.emulator) as responder. The emulator sends no report, so
+that only the sending path (sendbox, reader process, serial port and back) is measured.
+"""
+import argparse
+import math
+import time
+
+import communication
+from communication import Communication
+from communication.emulator import TeensyEmulator
+
+SCORE_COUNTER_ID = 4  # io_robot.ActuatorID.SCORE_COUNTER (io_robot needs the robot hardware)
+# Alternate between two commands of each type, whose payloads are accepted by the Teensy (see
+# message_definition.payload_checksum)
+LINK_MESSAGES = (
+    ('SPEED_COMMAND', lambda link, i: link.send_speed_command(100 * (i % 2), 0, 0)),
+    ('ACTUATOR_COMMAND', lambda link, i: link.send_actuator_command(SCORE_COUNTER_ID, i % 2)),
+    ('HMI_COMMAND', lambda link, i: link.send_hmi_command(255 * (i % 2), 0, 0)),
+)
+
+
+def summarize(latencies):
+    """
+    :param latencies: latencies (s)
+    :type latencies: list[float]
+    :return: mean and percentiles of the latencies (us)
+    :rtype: dict[str, float]
+    """
+    ordered = sorted(latencies)
+    summary = {'mean': sum(ordered) / len(ordered) * 1e6}
+    for name, ratio in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+        summary[name] = ordered[min(len(ordered) - 1, int(len(ordered) * ratio))] * 1e6
+    summary['max'] = ordered[-1] * 1e6
+    return summary
+
+
+def ack_latencies(number, latency=0., batching=False):
+    """
+    :param number: messages sent of each type, one at a time
+    :type number: int
+    :param latency: latency added by the emulator in both directions (s)
+    :type latency: float
+    :return: {down type name: latency summary (us)}
+    :rtype: dict[str, dict[str, float]]
+    """
+    communication.LINK_STATISTICS_PERIOD = None
+    emulator = TeensyEmulator(latency, pos_report_period=math.inf, io_report_period=math.inf)
+    link = Communication(emulator.open(), batching=batching)
+    try:
+        link.start()
+        results = {}
+        for name, send in LINK_MESSAGES:
+            latencies = []
+            for i in range(number):
+                start = time.perf_counter()
+                if send(link, i) != 0:
+                    raise RuntimeError("{} message not acknowledged by the emulator".format(name))
+                latencies.append(time.perf_counter() - start)
+            results[name] = summarize(latencies)
+        return results
+    finally:
+        link.reader_process.terminate()
+        link.reader_process.join()
+        emulator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser("Teensy link acknowledgement latency benchmark")
+    parser.add_argument('--number', type=int, default=500, help="Messages sent of each type")
+    parser.add_argument('--latency', type=float, default=0., help="Latency of the emulated link (s)")
+    parser.add_argument('--batching', action='store_true', default=False, help="Use the protocol version 2")
+    args = parser.parse_args()
+    for name, summary in ack_latencies(args.number, args.latency, args.batching).items():
+        print("{:<16} {}".format(name, ", ".join("{} {:.0f} us".format(key, value) for key, value in summary.items())))
+
+
+if __name__ == '__main__':
+    main()
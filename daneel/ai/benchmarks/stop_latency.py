@@ -0,0 +1,84 @@
+"""
+Worst case latency of the stop commands under a mixed load, with and without the priority lanes of Communication.
+
+The Teensy is emulated (communication.emulator) with a latency and frame loss. LED and score display commands are
+sent continuously while a zero speed command is sent periodically, and the time until the acknowledgement of each
+stop command is measured. Without priority lanes (every message in the same lane), a stop waits behind the queued
+HMI messages, and behind their retransmissions when a frame is lost.
+"""
+import argparse
+import time
+
+import communication
+from communication import Communication, MessagePriority
+from communication.emulator import TeensyEmulator
+
+STOP_PERIOD = 0.05  # s
+HMI_PERIOD = 0.01  # s, between two LED or score display commands
+SCORE_COUNTER_ID = 4  # io_robot.ActuatorID.SCORE_COUNTER (io_robot needs the robot hardware)
+
+
+def measure(message_priorities, duration, latency, loss, seed):
+    """
+    :param message_priorities: priorities given to Communication
+    :type message_priorities: dict|None
+    :return: latencies of the stop commands (s), None for the ones not acknowledged before the end
+    :rtype: list[float|None]
+    """
+    emulator = TeensyEmulator(latency, loss, seed=seed)
+    link = Communication(emulator.open(), message_priorities=message_priorities)
+    link.start()
+    stops = []  # (sending time, SendFuture)
+    latencies = []
+    start = time.monotonic()
+    next_stop = next_hmi = start
+    nb_hmi = 0
+    while time.monotonic() - start < duration:
+        now = time.monotonic()
+        if now >= next_hmi:
+            next_hmi += HMI_PERIOD
+            if nb_hmi % 2 == 0:
+                link.send_hmi_command(255 * (nb_hmi % 4 == 0), 0, 0, wait=False)
+            else:
+                link.send_actuator_command(SCORE_COUNTER_ID, nb_hmi, wait=False, priority=MessagePriority.HMI)
+            nb_hmi += 1
+        if now >= next_stop:
+            next_stop += STOP_PERIOD
+            stops.append((now, link.send_speed_command(0, 0, 0, wait=False)))
+        for sending_time, future in list(stops):
+            if future.done():
+                latencies.append(time.monotonic() - sending_time)
+                stops.remove((sending_time, future))
+        link.check_message(10)
+        time.sleep(0.001)
+    latencies.extend(None for _ in stops)
+    link.reader_process.terminate()
+    emulator.close()
+    return latencies
+
+
+def summarize(latencies):
+    acknowledged = sorted(latency for latency in latencies if latency is not None)
+    if not acknowledged:
+        return "no stop acknowledged"
+    return "{} stops, p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms, {} not acknowledged".format(
+        len(latencies), acknowledged[len(acknowledged) // 2] * 1000,
+        acknowledged[min(len(acknowledged) - 1, int(len(acknowledged) * 0.99))] * 1000, acknowledged[-1] * 1000,
+        len(latencies) - len(acknowledged))
+
+
+def main():
+    parser = argparse.ArgumentParser("Stop command latency benchmark")
+    parser.add_argument('--duration', type=float, default=10., help="Duration of each measure (s)")
+    parser.add_argument('--latency', type=float, default=0.002, help="Latency of the emulated link (s)")
+    parser.add_argument('--loss', type=float, default=0.02, help="Frame loss probability of the emulated link")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the frame loss")
+    args = parser.parse_args()
+    communication.LINK_STATISTICS_PERIOD = None
+    for name, priorities in (("single lane", {}), ("priority lanes", None)):
+        latencies = measure(priorities, args.duration, args.latency, args.loss, args.seed)
+        print("{:<16} {}".format(name, summarize(latencies)))
+
+
+if __name__ == '__main__':
+    main()
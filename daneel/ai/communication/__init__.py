@@ -3,56 +3,197 @@ Created on 29 July 2012
 @author: Guilhem Buisan
 """
 
+import queue
+import select
 import time
-from multiprocessing import Process, Queue
+from collections import deque
+from enum import Enum
+from multiprocessing import Pipe, Process, Queue
 
 import serial
 
+from communication.link_statistics import LinkStatistics, eLinkCounter, eLinkHistogram
 from communication.message_definition import *
 
 SERIAL_BAUDRATE = 115200
 SERIAL_PATH = "/dev/ttyAMA0"
 SERIAL_SEND_TIMEOUT = 500  # ms
 MAX_SEND_RETRIES = 100
+SERIAL_READ_BUFFER_SIZE = 4096  # bytes, reception buffer of the frame parser
+SEND_WINDOW_SIZE = 1  # maximum number of down messages waiting for their acknowledgement at the same time
+RESET_DRAIN_DURATION = 100  # ms, during which the bytes sent by the Teensy before a reset are dropped
+PROTOCOL_HANDSHAKE_RETRIES = 3  # sendings of the PROTOCOL_VERSION message before falling back to version 1
+PROTOCOL_HANDSHAKE_TIMEOUT = 50  # ms, between two sendings of the PROTOCOL_VERSION message, which delays all the
+# others: a Teensy in version 1 is detected after PROTOCOL_HANDSHAKE_RETRIES * PROTOCOL_HANDSHAKE_TIMEOUT
+# Messages sent alone on the link, as they change the state of the protocol
+EXCLUSIVE_TYPES = frozenset((eTypeDown.RESET, eTypeDown.PROTOCOL_VERSION))
 
 
-def serial_read_loop(serial_path, baudrate, mailbox, sendbox, is_sent_flag):
-    tr = TeensyReaderProcess(serial_path, baudrate, mailbox, sendbox, is_sent_flag)
+class CoalescingPolicy(Enum):
+    NONE = 0  # every message is transmitted
+    LATEST_WINS = 1  # only the newest message of this type is transmitted, the older pending ones are dropped
+
+
+COALESCING_POLICIES = {eTypeDown.SPEED_COMMAND: CoalescingPolicy.LATEST_WINS}
+
+
+class MessagePriority(Enum):
+    SAFETY = 0  # sent first, and not delayed by the lower priority messages waiting for their acknowledgement
+    CONTROL = 1
+    HMI = 2  # default priority of the message types not in the priorities
+
+
+MESSAGE_PRIORITIES = {eTypeDown.SPEED_COMMAND: MessagePriority.SAFETY,
+                      eTypeDown.RESET: MessagePriority.SAFETY,
+                      eTypeDown.REPOSITIONING: MessagePriority.CONTROL,
+                      eTypeDown.ACTUATOR_COMMAND: MessagePriority.CONTROL,
+                      eTypeDown.SENSOR_COMMAND: MessagePriority.CONTROL,
+                      eTypeDown.PID_TUNING: MessagePriority.CONTROL,
+                      eTypeDown.HMI_COMMAND: MessagePriority.HMI}
+
+
+class SensorSubscription:
+    """
+    Filter of the SENSOR_VALUE messages of a sensor, applied by the reader process so that the filtered values
+    neither cross the process boundary nor call the callbacks. A value is given to the main process only if
+    min_period has elapsed since the last value given for this sensor and if it differs from it by at least deadband.
+    """
+
+    def __init__(self, sensor_id, min_period=0., deadband=0):
+        """
+        :param sensor_id: The sensor id (see send_sensor_command)
+        :type sensor_id: int
+        :param min_period: minimum time between two values of the sensor (s)
+        :type min_period: float
+        :param deadband: minimum change of the value (in the raw unit of the sensor)
+        :type deadband: int
+        """
+        self.sensor_id = sensor_id
+        self.min_period = min_period
+        self.deadband = deadband
+        self.last_time = None
+        self.last_value = None
+
+    @property
+    def is_filtering(self):
+        return self.min_period > 0 or self.deadband > 0
+
+    def accept(self, value, now):
+        """
+        :param value: sensor value received
+        :type value: int
+        :param now: reception time (s, time.monotonic)
+        :type now: float
+        :return: True if the value must be given to the main process
+        :rtype: bool
+        """
+        if self.last_value is not None and (now - self.last_time < self.min_period or
+                                            abs(value - self.last_value) < self.deadband):
+            return False
+        self.last_time = now
+        self.last_value = value
+        return True
+
+
+LINK_STATISTICS_PERIOD = 10  # s, period of the link statistics printing (None to disable)
+
+# Arguments of the HMI_STATE callbacks for each hmi_state byte
+HMI_STATE_ARGUMENTS = tuple((bool(hmi_state & (1 << 7)), bool(hmi_state & (1 << 6)), bool(hmi_state & (1 << 5)),
+                             255 if hmi_state & (1 << 4) else 0, 255 if hmi_state & (1 << 3) else 0,
+                             255 if hmi_state & (1 << 2) else 0) for hmi_state in range(256))
+
+
+def serial_read_loop(serial_path, baudrate, mailbox, sendbox, is_sent_flag, window_size=SEND_WINDOW_SIZE,
+                     coalescing_policies=None, statistics=None, journal_path=None, message_priorities=None,
+                     batching=False):
+    tr = TeensyReaderProcess(serial_path, baudrate, mailbox, sendbox, is_sent_flag, window_size, coalescing_policies,
+                             statistics, journal_path, message_priorities, batching)
     while True:
         tr.loop()
-        time.sleep(0.0001)
 
 
-class Communication:
+class SendFuture:
     """
-    Class handling communication between ai and the Teensy.
+    Completion of a down message given to Communication.send_message, which is completed when the Teensy
+    acknowledges the message or when the reader process gives up retransmitting it.
     """
 
-    def __init__(self, serial_path=SERIAL_PATH, baudrate=SERIAL_BAUDRATE):
+    def __init__(self, communication, token, msg_type):
+        self._communication = communication
+        self.token = token
+        self.msg_type = msg_type
+        self._result = None
+
+    def done(self):
         """
-        ctor of the communication class
+        :return: True if the message has been acknowledged or has failed
+        :rtype: bool
+        """
+        if self._result is None and self._communication is not None:
+            self._communication._collect_send_results()
+        return self._result is not None
 
-        :param serial_path: The path of the serial file
-        :type serial_path: str
-        :param baudrate: The baudrate of UART (must the same as the one on the other board)
-        :type baudrate: int
+    def result(self, timeout=None):
         """
-        self._mailbox = Queue()
-        self._sendbox = Queue(1)  # We want to be blocked until the message is sent (or do we ?)
-        self._is_sent = Queue(1)  # Has to be empty when something needs to be sent, and will be filled when the message is sent
-        self.mock_communication = False  # Set to True if Serial is not plugged to the Teensy
+        Wait for the completion of the message.
+
+        :param timeout: maximum waiting time (s), None to wait until completion
+        :type timeout: float|None
+        :return: 0 if the message is acknowledged, -1 if max retries has been reached, None on timeout
+        :rtype: int|None
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._result is None:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            self._communication._collect_send_results(True, remaining)
+        return self._result
+
+    def _set_result(self, result):
+        self._result = result
+
+
+class BaseCommunication:
+    """
+    Message building and dispatching common to the Teensy communication classes. The subclasses implement
+    send_message.
+    """
+
+    def __init__(self):
         self._callbacks = {msg_type: [] for msg_type in eTypeUp}
-        if not self.mock_communication:
-            self.reader_process = Process(target=serial_read_loop, args=(serial_path, baudrate, self._mailbox,
-                                                                         self._sendbox, self._is_sent),
-                                          name="TeensyCommunication")
-            self.reader_process.daemon = True
+        # eTypeUp -> function calling the callbacks of this type with the data of the message
+        self._dispatch = {eTypeUp.SENSOR_VALUE: self._dispatch_sensor_value,
+                          eTypeUp.HMI_STATE: self._dispatch_hmi_state,
+                          eTypeUp.ODOM_REPORT: self._dispatch_odometry_report,
+                          eTypeUp.SPEED_REPORT: self._dispatch_speed_report}
+        self.statistics = LinkStatistics(shared=False)
         self.eTypeUp = eTypeUp  # For exposure purposes
 
-    def start(self):
-        if not self.mock_communication:
-            self.reader_process.start()
-            self.reset_soft_teensy()
+    @property
+    def coalesced_commands(self):
+        """
+        :return: number of messages replaced by a newer one of the same type before being sent
+        :rtype: int
+        """
+        return self.statistics.get(eLinkCounter.COALESCED_COMMANDS)
+
+    @property
+    def dropped_commands(self):
+        """
+        :return: number of sent messages whose retransmission was abandoned because a newer one of the same type
+            was pending
+        :rtype: int
+        """
+        return self.statistics.get(eLinkCounter.DROPPED_COMMANDS)
+
+    @property
+    def protocol_version(self):
+        """
+        :return: version of the protocol used with the Teensy since the last reset (1 until the handshake succeeds)
+        :rtype: int
+        """
+        return max(1, self.statistics.get(eLinkCounter.PROTOCOL_VERSION))
 
     def register_callback(self, message_type, callback):
         """
@@ -63,12 +204,15 @@ class Communication:
         ============ =============
         message_type callback type
         ============ =============
-        ODOM_REPORT  (previous_report_id [int], new_report_id [int], dx [float], dy [float], dtheta [float]) -> void
-        HMI_STATE    (cord_state [bool], button1_state [bool], button2_state [bool], red_led_state [bool],
-                     green_led_state [bool], blue_led_state [bool]) -> void
-        SENSOR_VALUE (sensor_id, sensor_value) -> void
+        ODOM_REPORT  (x [float], y [float], theta [float]) -> void
+        SPEED_REPORT (vx [float], vy [float], vtheta [float], left_drifting [bool], right_drifting [bool]) -> void
+        HMI_STATE    (cord_state [bool], button1_state [bool], button2_state [bool], red_led_state [int],
+                     green_led_state [int], blue_led_state [int]) -> void
+        SENSOR_VALUE (sensor_id [int], sensor_value [int]) -> void
         ============ =============
 
+        The LED states are 255 when the LED is on, 0 otherwise.
+
         :param message_type: The type of the message, which, when received, will trigger the callback.
         :type message_type: eTypeUp
         :param callback: Function which will be called.
@@ -78,7 +222,7 @@ class Communication:
             return
         self._callbacks[message_type].append(callback)
 
-    def send_speed_command(self, vx, vy, vtheta, max_retries=1000):
+    def send_speed_command(self, vx, vy, vtheta, max_retries=1000, wait=True):
         """
         Used to send a speed command to the teensy. The command must be in table frame ! (for vx and vtheta constant,
         the robot makes a straight line while rotating on itself and does not make a circle (which it would do if it was
@@ -92,8 +236,10 @@ class Communication:
         :type vtheta: float
         :param max_retries: number of times to retry if the sending fails (default = 1000)
         :type max_retries: int
-        :return: 0 if the message is sent, -1 if max_retries has been reached
-        :rtype: int
+        :param wait: if False, return a SendFuture instead of waiting for the acknowledgement
+        :type wait: bool
+        :return: 0 if the message is sent, -1 if max_retries has been reached (or a SendFuture if not wait)
+        :rtype: int|SendFuture
         """
         msg = sMessageDown()
         msg.type = eTypeDown.SPEED_COMMAND
@@ -101,9 +247,9 @@ class Communication:
         msg.data.vx = vx
         msg.data.vy = vy
         msg.data.vtheta = vtheta
-        return self.send_message(msg, max_retries)
+        return self.send_message(msg, max_retries, wait)
 
-    def send_hmi_command(self, red_led_cmd, green_led_cmd, blue_led_cmd, max_retries=1000):
+    def send_hmi_command(self, red_led_cmd, green_led_cmd, blue_led_cmd, max_retries=1000, wait=True):
         """
         /!\\ Blocking command (try to send the message until it has been received or max_retries)
         Send an HMI (LED) command to the teensy.
@@ -116,17 +262,19 @@ class Communication:
         :type blue_led_cmd: int
         :param max_retries: number of times to retry if the sending fails (default = 1000)
         :type max_retries: int
-        :return: 0 if message has been sent, -1 if max retries has been reached
-        :rtype: int
+        :param wait: if False, return a SendFuture instead of waiting for the acknowledgement
+        :type wait: bool
+        :return: 0 if message has been sent, -1 if max retries has been reached (or a SendFuture if not wait)
+        :rtype: int|SendFuture
         """
         msg = sMessageDown()
         msg.type = eTypeDown.HMI_COMMAND
         msg.data = sHMICommand()
         msg.data.hmi_command = (red_led_cmd & 0b11100000) | (green_led_cmd >> 3 & 0b00011100) | (blue_led_cmd >> 6
                                                                                                  & 0b00000011)
-        return self.send_message(msg, max_retries)
+        return self.send_message(msg, max_retries, wait)
 
-    def send_actuator_command(self, actuator_id, actuator_value, max_retries=1000):
+    def send_actuator_command(self, actuator_id, actuator_value, max_retries=1000, wait=True, priority=None):
         """
         Send an actuator command to the Teensy.
 
@@ -137,19 +285,23 @@ class Communication:
         :type actuator_value: int
         :param max_retries: number of times to retry if the sending fails (default = 1000)
         :type max_retries: int
-        :return: 0 if the message is sent, -1 if max_retries has been reached
-        :rtype: int
+        :param wait: if False, return a SendFuture instead of waiting for the acknowledgement
+        :type wait: bool
+        :param priority: priority of this command, eg. MessagePriority.HMI for the score display (default : CONTROL)
+        :type priority: MessagePriority|None
+        :return: 0 if the message is sent, -1 if max_retries has been reached (or a SendFuture if not wait)
+        :rtype: int|SendFuture
         """
         msg = sMessageDown()
         msg.type = eTypeDown.ACTUATOR_COMMAND
         msg.data = sActuatorCommand()
         msg.data.actuator_id = actuator_id
         msg.data.actuator_command = actuator_value
-        return self.send_message(msg, max_retries)
+        return self.send_message(msg, max_retries, wait, priority)
 
-    def send_sensor_command(self, sensor_id, command_state, max_retries=1000):
+    def send_sensor_command(self, sensor_id, command_state, max_retries=1000, wait=True, min_period=0., deadband=0):
         """
-        Change a sensor state by sending a command to Teensy.
+        Change a sensor state by sending a command to Teensy, and subscribe to its values (see subscribe_sensor).
 
         :param sensor_id: The sensor id as defined in the base/code/InputOutputs.h:sensors array (which is filled
             in base/code/InputOutputs.h:initSensors function).
@@ -159,38 +311,24 @@ class Communication:
         :type command_state: int
         :param max_retries: number of times to retry if the sending fails (default = 1000)
         :type max_retries: int
-        :return: 0 if the message is sent, -1 if max_retries has been reached
-        :rtype: int
+        :param wait: if False, return a SendFuture instead of waiting for the acknowledgement
+        :type wait: bool
+        :param min_period: minimum time between two values of the sensor given to the callbacks (s)
+        :type min_period: float
+        :param deadband: minimum change of the value given to the callbacks (in the raw unit of the sensor)
+        :type deadband: int
+        :return: 0 if the message is sent, -1 if max_retries has been reached (or a SendFuture if not wait)
+        :rtype: int|SendFuture
         """
+        self.subscribe_sensor(sensor_id, min_period, deadband)
         msg = sMessageDown()
         msg.type = eTypeDown.SENSOR_COMMAND
         msg.data = sSensorCommand()
         msg.data.sensor_id = sensor_id
         msg.data.sensor_state = command_state
-        return self.send_message(msg, max_retries)
-
-    def reset_soft_teensy(self, max_retries=1000):
-        """
-        Send a reset order to the Teensy. This message will be accepted by the Teensy whatever the id (so even
-        after a desynchronisation between Teensy and ai, eg. when the ai reboots and not the Teensy)
+        return self.send_message(msg, max_retries, wait)
 
-        :param max_retries: number of times to retry if the sending fails (default = 1000)
-        :type max_retries: int
-        :return: 0 if the message is sent, -1 if max_retries has been reached
-        :rtype: int
-        """
-        if self.mock_communication:
-            print("[Communication] Warning : Teensy communication mocked !")
-            return 0
-        msg = sMessageDown()
-        msg.type = eTypeDown.RESET
-        ret = self.send_message(msg, max_retries)
-        if ret == 0:
-            while not self._mailbox.empty():
-                self._mailbox.get()
-        return ret
-
-    def send_repositioning(self, x, y, theta, max_retries=1000):
+    def send_repositioning(self, x, y, theta, max_retries=1000, wait=True):
         """
         Send an angular repositioning command to the Teensy,
 
@@ -202,8 +340,10 @@ class Communication:
         :type theta: float
         :param max_retries: number of times to retry if the sending fails (default = 1000)
         :type max_retries: int
-        :return: 0 if the message is sent, -1 if max_retries has been reached
-        :rtype: int
+        :param wait: if False, return a SendFuture instead of waiting for the acknowledgement
+        :type wait: bool
+        :return: 0 if the message is sent, -1 if max_retries has been reached (or a SendFuture if not wait)
+        :rtype: int|SendFuture
         """
         msg = sMessageDown()
         msg.type = eTypeDown.REPOSITIONING
@@ -211,9 +351,10 @@ class Communication:
         msg.data.x_repositioning = x
         msg.data.y_repositioning = y
         msg.data.theta_repositioning = theta
-        return self.send_message(msg, max_retries)
+        return self.send_message(msg, max_retries, wait)
 
-    def send_pid_tuning(self, kp_linear, ki_linear, kd_linear, kp_angular, ki_angular, kd_angular, max_retries=1000):
+    def send_pid_tuning(self, kp_linear, ki_linear, kd_linear, kp_angular, ki_angular, kd_angular, max_retries=1000,
+                        wait=True):
         msg = sMessageDown()
         msg.type = eTypeDown.PID_TUNING
         msg.data = sPIDTuning()
@@ -223,156 +364,625 @@ class Communication:
         msg.data.kp_angular = kp_angular
         msg.data.ki_angular = ki_angular
         msg.data.kd_angular = kd_angular
-        return self.send_message(msg, max_retries)
+        return self.send_message(msg, max_retries, wait)
+
+    def send_message(self, msg, _=None, wait=True, priority=None):
+        raise NotImplementedError()
+
+    def subscribe_sensor(self, sensor_id, min_period=0., deadband=0):
+        """
+        Filter the values of a sensor before they are given to the SENSOR_VALUE callbacks, in the reader process.
+        The first value received after the subscription is always given. A null min_period and deadband remove the
+        filter.
+
+        :param sensor_id: The sensor id (see send_sensor_command)
+        :type sensor_id: int
+        :param min_period: minimum time between two values of the sensor (s)
+        :type min_period: float
+        :param deadband: minimum change of the value (in the raw unit of the sensor)
+        :type deadband: int
+        """
+        raise NotImplementedError()
+
+    def handle_message(self, message):
+        """
+        Call registered callbacks with well formed arguments depending on message.type.
+
+        :param message: The message to be handled (containing the type and the arguments to be passed
+            to the callback.
+        :type message: sMessageUp
+        """
+        dispatch = self._dispatch.get(message.type)
+        if dispatch is not None:
+            dispatch(message.data)
+
+    def _dispatch_sensor_value(self, data):
+        for cb in self._callbacks[eTypeUp.SENSOR_VALUE]:
+            cb(data.sensor_id, data.sensor_value)
+
+    def _dispatch_hmi_state(self, data):
+        arguments = HMI_STATE_ARGUMENTS[data.hmi_state]
+        for cb in self._callbacks[eTypeUp.HMI_STATE]:
+            cb(*arguments)
+
+    def _dispatch_odometry_report(self, data):
+        callbacks = self._callbacks[eTypeUp.ODOM_REPORT]
+        if callbacks:
+            x, y, theta = data.x, data.y, data.theta
+            for cb in callbacks:
+                cb(x, y, theta)
+
+    def _dispatch_speed_report(self, data):
+        callbacks = self._callbacks[eTypeUp.SPEED_REPORT]
+        if callbacks:
+            vx, vy, vtheta = data.vx, data.vy, data.vtheta
+            left_drifting, right_drifting = data.drifting
+            for cb in callbacks:
+                cb(vx, vy, vtheta, left_drifting, right_drifting)
+
+
+class Communication(BaseCommunication):
+    """
+    Class handling communication between ai and the Teensy.
+    """
+
+    def __init__(self, serial_path=SERIAL_PATH, baudrate=SERIAL_BAUDRATE, window_size=SEND_WINDOW_SIZE,
+                 coalescing_policies=None, journal_path=None, message_priorities=None, batching=False):
+        """
+        ctor of the communication class
+
+        :param serial_path: The path of the serial file
+        :type serial_path: str
+        :param baudrate: The baudrate of UART (must the same as the one on the other board)
+        :type baudrate: int
+        :param window_size: maximum number of down messages waiting for their acknowledgement at the same time. With
+            more than one, a retransmitted message can be executed by the Teensy after a more recent one.
+        :type window_size: int
+        :param coalescing_policies: CoalescingPolicy of each down message type (default : COALESCING_POLICIES).
+            The futures of the messages dropped by a LATEST_WINS policy get the result of the newest message.
+        :type coalescing_policies: dict[eTypeDown, CoalescingPolicy]|None
+        :param journal_path: if given, every frame sent and received is recorded in this file (see
+            communication.journal)
+        :type journal_path: str|None
+        :param message_priorities: MessagePriority of each down message type (default : MESSAGE_PRIORITIES). The
+            waiting messages are sent by priority, then in order.
+        :type message_priorities: dict[eTypeDown, MessagePriority]|None
+        :param batching: negotiate the protocol version 2 after each reset, and if the Teensy supports it, send the
+            messages waiting at the same time in BATCH frames, with a single acknowledgement. The negotiation delays
+            the other messages, by up to PROTOCOL_HANDSHAKE_RETRIES * PROTOCOL_HANDSHAKE_TIMEOUT with a Teensy in
+            version 1.
+        :type batching: bool
+        """
+        super().__init__()
+        self._mailbox = Queue()  # lists of the messages received at once by the reader process
+        self._received = deque()  # messages taken from the mailbox and not handled yet
+        # (token, message, priority) to send and SensorSubscription, handled in order by the reader process, which
+        # also waits on this pipe to wake up
+        sendbox_reader, self._sendbox = Pipe(duplex=False)
+        self._is_sent = Queue()  # (token, result) of the sent messages
+        self._send_futures = {}  # token -> SendFuture of the messages not completed yet
+        self._next_token = 0
+        self.statistics = LinkStatistics()
+        self._last_statistics_time = time.monotonic()
+        self.mock_communication = False  # Set to True if Serial is not plugged to the Teensy
+        if not self.mock_communication:
+            self.reader_process = Process(target=serial_read_loop, args=(serial_path, baudrate, self._mailbox,
+                                                                         sendbox_reader, self._is_sent, window_size,
+                                                                         coalescing_policies,
+                                                                         self.statistics, journal_path,
+                                                                         message_priorities, batching),
+                                          name="TeensyCommunication")
+            self.reader_process.daemon = True
+
+    def start(self):
+        if not self.mock_communication:
+            self.reader_process.start()
+            self.reset_soft_teensy()
 
-    def send_message(self, msg, _):
+    def reset_soft_teensy(self, max_retries=1000):
         """
-        Send message via Serial (defined during the instantiation of the class)
+        Send a reset order to the Teensy. This message will be accepted by the Teensy whatever the id (so even
+        after a desynchronisation between Teensy and ai, eg. when the ai reboots and not the Teensy)
+
+        :param max_retries: number of times to retry if the sending fails (default = 1000)
+        :type max_retries: int
+        :return: 0 if the message is sent, -1 if max_retries has been reached
+        :rtype: int
+        """
+        if self.mock_communication:
+            print("[Communication] Warning : Teensy communication mocked !")
+            return 0
+        msg = sMessageDown()
+        msg.type = eTypeDown.RESET
+        ret = self.send_message(msg, max_retries)
+        if ret == 0:
+            self._fetch_received_messages()
+            self.statistics.increment(eLinkCounter.MESSAGES_HANDLED, len(self._received))
+            self._received.clear()
+        return ret
+
+    def send_message(self, msg, _=None, wait=True, priority=None):
+        """
+        Send message via Serial (defined during the instantiation of the class). The messages are sent by priority
+        then in order, and up to window_size messages of a priority or a higher one can wait for their
+        acknowledgement at the same time (so a SAFETY message is never delayed by the lower priority ones).
 
         :param msg: the message to send
         :type msg: sMessageDown
         :param _: Not used only for legacy purpose
         :type _:
-        :return: 0 if the message is sent, -1 if max_retries has been reached
-        :rtype: int
+        :param wait: if True, block until the message is acknowledged (or max retries is reached), else return a
+            SendFuture immediately (fire and forget if it is not used)
+        :type wait: bool
+        :param priority: priority of this message, instead of the one of its type
+        :type priority: MessagePriority|None
+        :return: 0 if the message is sent, -1 if max_retries has been reached (or a SendFuture if not wait)
+        :rtype: int|SendFuture
         """
-        if not self._is_sent.empty():
-            # This should not happen
-            self._is_sent.get()
-
-        self._sendbox.put(msg)
-        while self._is_sent.empty():
-            time.sleep(0.00001)
-        ret = self._is_sent.get()
-        return ret
+        future = SendFuture(None if self.mock_communication else self, self._next_token, msg.type)
+        self._next_token += 1
+        if self.mock_communication:
+            future._set_result(0)
+        else:
+            self._send_futures[future.token] = future
+            self._sendbox.send((future.token, msg, priority))
+        if not wait:
+            return future
+        start = time.monotonic()
+        result = future.result()
+        self.statistics.record(eLinkHistogram.SEND_WAIT, (time.monotonic() - start) * 1e6)
+        return result
+
+    def subscribe_sensor(self, sensor_id, min_period=0., deadband=0):
+        """
+        Filter the values of a sensor in the reader process (see BaseCommunication.subscribe_sensor). The
+        subscription is sent before the messages sent after this call.
+        """
+        if not self.mock_communication:
+            self._sendbox.send(SensorSubscription(sensor_id, min_period, deadband))
 
-    def check_message(self, max_read=1):
+    def _collect_send_results(self, block=False, timeout=None):
         """
-        Check if there is any incoming message on the Serial (defined during the instantiation of the class)
-        and returns the oldest message.
+        Complete the futures of the messages handled by the reader process since the last call.
 
-        :return: The oldest message non read
-        :rtype: sMessageUp
+        :param block: wait for at least one result
+        :type block: bool
+        :param timeout: maximum waiting time if block (s)
+        :type timeout: float|None
         """
+        try:
+            token, result = self._is_sent.get(block, timeout)
+            while True:
+                future = self._send_futures.pop(token, None)
+                if future is not None:
+                    if result != 0:
+                        print("[Comm] {} message not acknowledged by the Teensy".format(future.msg_type))
+                    future._set_result(result)
+                token, result = self._is_sent.get_nowait()
+        except queue.Empty:
+            pass
 
-        for i in range(max_read):
-            if not self._mailbox.empty():
-                msg = self._mailbox.get()
-                self.handle_message(msg)
+    def check_message(self, max_read=1):
+        """
+        Handle (see handle_message) the oldest messages received from the Teensy. The reader process gives the
+        messages by batches, which are all taken from the mailbox at once.
 
-    def handle_message(self, message):
+        :param max_read: maximum number of messages to handle
+        :type max_read: int
         """
-        Call registered callbacks with well formed arguments depending on message.type.
 
-        :param message: The message to be handled (containing the type and the arguments to be passed
-            to the callback.
-        :type message: sMessageUp
+        self._collect_send_results()
+        self.statistics.record(eLinkHistogram.MAILBOX_DEPTH, self.statistics.get(eLinkCounter.MESSAGES_DELIVERED) -
+                               self.statistics.get(eLinkCounter.MESSAGES_HANDLED))
+        if len(self._received) < max_read:
+            self._fetch_received_messages()
+        nb_handled = min(max_read, len(self._received))
+        for i in range(nb_handled):
+            self.handle_message(self._received.popleft())
+        self.statistics.increment(eLinkCounter.MESSAGES_HANDLED, nb_handled)
+        if LINK_STATISTICS_PERIOD is not None and time.monotonic() - self._last_statistics_time >= \
+                LINK_STATISTICS_PERIOD:
+            self._last_statistics_time = time.monotonic()
+            self.print_statistics()
+
+    def _fetch_received_messages(self):
         """
-        if message.type == eTypeUp.SENSOR_VALUE:
-            for cb in self._callbacks[eTypeUp.SENSOR_VALUE]:
-                cb(message.data.sensor_id, message.data.sensor_value)
-        elif message.type == eTypeUp.HMI_STATE:
-            cord_state = bool(message.data.hmi_state & (1 << 7))
-            button1_state = bool(message.data.hmi_state & (1 << 6))
-            button2_state = bool(message.data.hmi_state & (1 << 5))
-            red_led_state = 255 if bool(message.data.hmi_state & (1 << 4)) else 0
-            green_led_state = 255 if bool(message.data.hmi_state & (1 << 3)) else 0
-            blue_led_state = 255 if bool(message.data.hmi_state & (1 << 2)) else 0
-            for cb in self._callbacks[eTypeUp.HMI_STATE]:
-                cb(cord_state, button1_state, button2_state, red_led_state, green_led_state, blue_led_state)
-        elif message.type == eTypeUp.ODOM_REPORT:
-            for cb in self._callbacks[eTypeUp.ODOM_REPORT]:
-                cb(message.data.x, message.data.y, message.data.theta)
-        elif message.type == eTypeUp.SPEED_REPORT:
-            for cb in self._callbacks[eTypeUp.SPEED_REPORT]:
-                cb(message.data.vx, message.data.vy, message.data.vtheta, *message.data.drifting)
-        elif message.type == eTypeUp.ACK_DOWN:
+        Move every batch of messages waiting in the mailbox to the received messages.
+        """
+        try:
+            while True:
+                self._received.extend(self._mailbox.get_nowait())
+        except queue.Empty:
             pass
 
+    def print_statistics(self):
+        print("[Comm] Link statistics :\n{}".format(self.statistics))
+
+
+class OutgoingMessage:
+    """
+    Down message handled by the reader process, from its reception in the sendbox to its acknowledgement.
+    """
+
+    def __init__(self, token, msg, priority, max_retries=MAX_SEND_RETRIES, timeout=SERIAL_SEND_TIMEOUT):
+        self.tokens = [] if token is None else [token]  # the first ones are the tokens of the messages coalesced in
+        # this one (or sent in the same BATCH)
+        self.msg = msg
+        self.priority = priority
+        self.max_retries = max_retries
+        self.timeout = timeout / 1000  # s, before a retransmission
+        self.frame = None
+        self.down_ids = []  # every down_id used for this message (a retransmission may need a new one)
+        self.nb_sent = 0
+        self.first_sent_time = None
+        self.last_sent_time = None
 
-class TeensyReaderProcess:
-    STATE_IDLE = 0
-    STATE_HEADER_RECEIVED = 1
 
-    def __init__(self, serial_path, baudrate,  mailbox: Queue, sendbox: Queue, is_sent_flag: Queue):
+class TeensyReaderProcess:
+    def __init__(self, serial_path, baudrate,  mailbox: Queue, sendbox, is_sent_flag: Queue,
+                 window_size=SEND_WINDOW_SIZE, coalescing_policies=None, statistics=None, journal_path=None,
+                 message_priorities=None, batching=False, blocking_drain=True):
         self._receivebox = mailbox
+        self._received = []  # messages received by the current process call, put at once in the receivebox
         self._sendbox = sendbox
         self._is_sent_flag = is_sent_flag
         self._serial_port = serial.Serial(serial_path, baudrate)
         self._serial_port.reset_input_buffer()
-        self._tmp_msg = sMessageUp()
-        self._state = self.STATE_IDLE
-        self._last_start_byte = None
+        self._parser = FrameParser(UP_DATA_SIZES, UP_HEADER, buffer_size=SERIAL_READ_BUFFER_SIZE)
         self._current_msg_id = 0
+        self._last_sent_id = None
+        self._encoder = DownFrameEncoder()
+        self._window_size = max(1, window_size)
+        self._lanes = [deque() for _ in MessagePriority]  # OutgoingMessage not sent yet, for each priority
+        self._in_flight = []  # OutgoingMessage sent and waiting for their acknowledgement, oldest first
+        self._in_flight_ids = {}  # down_id -> OutgoingMessage
+        self._coalescing_policies = COALESCING_POLICIES if coalescing_policies is None else coalescing_policies
+        self._message_priorities = MESSAGE_PRIORITIES if message_priorities is None else message_priorities
+        self._batching = batching
+        self._blocking_drain = blocking_drain  # False in an event loop, which must not sleep before a reset
+        self._drain_end_time = None  # end of the non blocking drain before a reset
+        self._protocol_version = 1
+        self._sensor_subscriptions = {}  # sensor_id -> SensorSubscription filtering its values
+        self._statistics = LinkStatistics(shared=False) if statistics is None else statistics
+        self._journal = None
+        if journal_path is not None:
+            from communication.journal import Journal  # Not imported by default, to run it as a script
+            self._journal = Journal(journal_path)
+
+    def loop(self, max_wait=None):
+        """
+        Wait until something happens (incoming bytes, a message to send or a retransmission timeout) and handle it.
+
+        :param max_wait: maximum waiting time (s), None to wait for the next event
+        :type max_wait: float|None
+        """
+        timeout = self.next_retransmission_delay()
+        if max_wait is not None:
+            timeout = max_wait if timeout is None else min(timeout, max_wait)
+        select.select([self._serial_port, self._sendbox], [], [], timeout)
+        self.process()
+
+    def process(self):
+        """
+        Handle everything that can be done without waiting: messages to send, received bytes and retransmissions.
+        Can be called from an event loop instead of loop (see communication.aio).
+        """
+        self._fetch_messages_to_send()
+        self._read_available_messages()
+        self._retransmit_timed_out_messages()
+        self._send_waiting_messages()  # After the acknowledgements, which make room in the sending window
+
+    def fileno(self):
+        return self._serial_port.fileno()
+
+    def close(self):
+        self._serial_port.close()
+        if self._journal is not None:
+            self._journal.close()
+
+    def submit(self, token, msg, priority=None):
+        """
+        Add a message to send, as if it was received in the sendbox.
+
+        :param token: identifier of the message, given back with its result
+        :type token: int
+        :type msg: sMessageDown
+        :param priority: priority of this message, instead of the one of its type
+        :type priority: MessagePriority|None
+        """
+        if priority is None:
+            priority = self._message_priorities.get(msg.type, MessagePriority.HMI)
+        self._enqueue(OutgoingMessage(token, msg, priority))
+
+    def subscribe_sensor(self, subscription):
+        """
+        Set (or remove if it does not filter) the subscription of a sensor, as if it was received in the sendbox.
+
+        :type subscription: SensorSubscription
+        """
+        if subscription.is_filtering:
+            self._sensor_subscriptions[subscription.sensor_id] = subscription
+        else:
+            self._sensor_subscriptions.pop(subscription.sensor_id, None)
 
-    def loop(self):
-        if not self._sendbox.empty() and self._is_sent_flag.empty():
-            msg_to_send = self._sendbox.get()
-            if msg_to_send.type == eTypeDown.RESET:
-                for i in range(10):
-                    time.sleep(0.01)
-                    self._serial_port.read_all()
+    def next_retransmission_delay(self):
+        """
+        :return: the time before the next retransmission or the end of the drain before a reset (s), or None if
+        there is nothing to wait for
+        :rtype: float|None
+        """
+        times = [outgoing.last_sent_time + outgoing.timeout for outgoing in self._in_flight]
+        if self._drain_end_time is not None:
+            times.append(self._drain_end_time)
+        if not times:
+            return None
+        next_time = min(times)
+        return max(0., next_time - time.monotonic())
+
+    def _read_available_messages(self):
+        """
+        Read every received byte and handle the complete messages.
+        """
+        if self._drain_end_time is not None:
+            self._serial_port.read_all()  # Sent before the reset
+            return
+        in_waiting = self._serial_port.in_waiting
+        if in_waiting > 0:
+            self._parser.feed(self._serial_port.read(in_waiting))
+        for up_id, type_value, checksum, payload in self._parser.frames():
+            self._statistics.increment(eLinkCounter.FRAMES_RECEIVED)
+            if self._journal is not None:
+                self._journal.record_up(UP_HEADER.pack(up_id, type_value, len(payload), checksum) + payload)
+            msg = sMessageUp()
+            msg.up_id = up_id
+            msg.type = eTypeUp(type_value)
+            msg.data_size = len(payload)
+            msg.checksum = checksum
+            try:
+                msg.deserialize_data(payload)
+            except DeserializationException as e:
+                print("[Comm] Cannot deserialize data : {}".format(e))
+                self._statistics.increment(eLinkCounter.DESERIALIZATION_ERRORS)
+                continue
+            self._handle_acknowledgement(msg)
+            self._handle_received_message(msg)
+        if self._received:
+            self._statistics.increment(eLinkCounter.MESSAGES_DELIVERED, len(self._received))
+            self._receivebox.put(self._received)
+            self._received = []
+        self._statistics.set(eLinkCounter.SYNC_LOSSES, self._parser.sync_losses)
+        self._statistics.set(eLinkCounter.CHECKSUM_FAILURES, self._parser.checksum_failures)
+
+    def _fetch_messages_to_send(self):
+        while self._sendbox is not None and self._sendbox.poll():
+            item = self._sendbox.recv()
+            if isinstance(item, SensorSubscription):
+                self.subscribe_sensor(item)
+            else:
+                self.submit(*item)
+
+    def _latest_wins(self, msg_type):
+        return self._coalescing_policies.get(msg_type, CoalescingPolicy.NONE) == CoalescingPolicy.LATEST_WINS
+
+    def _enqueue(self, outgoing):
+        """
+        Add a message to the messages to send. With a LATEST_WINS policy, it takes the place of the pending message
+        of the same type and priority (if any) in the queue.
+
+        :type outgoing: OutgoingMessage
+        """
+        lane = self._lanes[outgoing.priority.value]
+        if self._latest_wins(outgoing.msg.type):
+            for i, waiting in enumerate(lane):
+                if waiting.msg.type == outgoing.msg.type:
+                    outgoing.tokens = waiting.tokens + outgoing.tokens
+                    lane[i] = outgoing
+                    self._statistics.increment(eLinkCounter.COALESCED_COMMANDS)
+                    return
+        lane.append(outgoing)
+
+    def _newer_message(self, outgoing):
+        """
+        :return: the most recent message of the same type and priority as outgoing, sent or not, if it is not
+            outgoing itself
+        :rtype: OutgoingMessage|None
+        """
+        for candidate in reversed(self._lanes[outgoing.priority.value]):
+            if candidate.msg.type == outgoing.msg.type:
+                return candidate
+        for candidate in reversed(self._in_flight):
+            if candidate is outgoing:
+                return None
+            if candidate.msg.type == outgoing.msg.type and candidate.priority == outgoing.priority:
+                return candidate
+        return None
+
+    def _send_waiting_messages(self):
+        for lane in self._lanes:
+            while lane:
+                outgoing = lane[0]
+                if not self._can_send(outgoing):
+                    return  # The lower priority messages cannot be sent either
+                if outgoing.msg.type == eTypeDown.RESET:
+                    if not self._drain_input():
+                        return  # The reset is sent at the end of the drain
+                    self._parser.clear()
                     self._current_msg_id = 0
-            ret = self._send_message(msg_to_send)
-            self._is_sent_flag.put(ret, True)
-        msg = self._read_message()
-        if msg is not None and msg.type != eTypeUp.ACK_DOWN:
-            self._receivebox.put(msg)
-
-    def _send_message(self, msg):
-        msg.down_id = self._current_msg_id
+                    self._set_protocol_version(1)
+                    for subscription in self._sensor_subscriptions.values():
+                        subscription.last_value = None  # The first value after the reset is always given
+                lane.popleft()
+                if self._protocol_version >= 2 and outgoing.msg.type in BATCHABLE_TYPES:
+                    outgoing = self._batch(outgoing)
+                self._in_flight.append(outgoing)
+                self._transmit(outgoing)
+
+    def _batch(self, outgoing):
+        """
+        Gather the messages waiting at the head of the lanes with outgoing, as long as they fit in a BATCH.
+
+        :param outgoing: first message of the batch, removed from its lane
+        :type outgoing: OutgoingMessage
+        :return: outgoing if no other message can be sent with it, else the BATCH message
+        :rtype: OutgoingMessage
+        """
+        parts = [outgoing]
+        size = 1 + DOWN_DATA_SIZES[outgoing.msg.type.value]
+        for lane in self._lanes:
+            while lane and lane[0].msg.type in BATCHABLE_TYPES and \
+                    size + 1 + DOWN_DATA_SIZES[lane[0].msg.type.value] <= BATCH_MAX_DATA_SIZE:
+                size += 1 + DOWN_DATA_SIZES[lane[0].msg.type.value]
+                parts.append(lane.popleft())
+        if len(parts) == 1:
+            return outgoing
+        msg = sMessageDown()
+        msg.type = eTypeDown.BATCH
+        msg.data = sBatch(part.msg for part in parts)
+        batch = OutgoingMessage(None, msg, outgoing.priority)
+        for part in parts:
+            batch.tokens.extend(part.tokens)
+        self._statistics.increment(eLinkCounter.BATCHED_MESSAGES, len(parts))
+        return batch
+
+    def _can_send(self, outgoing):
+        """
+        :return: True if less than window_size messages of the priority of outgoing, or of a higher priority, are
+            waiting for their acknowledgement. The EXCLUSIVE_TYPES messages are sent alone.
+        :rtype: bool
+        """
+        if outgoing.msg.type in EXCLUSIVE_TYPES:
+            return not self._in_flight
+        nb_in_flight = 0
+        for in_flight in self._in_flight:
+            if in_flight.msg.type in EXCLUSIVE_TYPES:
+                return False
+            if in_flight.priority.value <= outgoing.priority.value:
+                nb_in_flight += 1
+        return nb_in_flight < self._window_size
+
+    def _set_protocol_version(self, version):
+        self._protocol_version = version
+        self._statistics.set(eLinkCounter.PROTOCOL_VERSION, version)
+
+    def _start_handshake(self):
+        """
+        Ask the Teensy if it supports the protocol version 2, before any other message. A Teensy which does not
+        know the PROTOCOL_VERSION message does not acknowledge it, so the version 1 is kept after
+        PROTOCOL_HANDSHAKE_RETRIES sendings, PROTOCOL_HANDSHAKE_TIMEOUT apart.
+        """
+        msg = sMessageDown()
+        msg.type = eTypeDown.PROTOCOL_VERSION
+        msg.data = sProtocolVersion()
+        msg.data.version = PROTOCOL_VERSION
+        self._lanes[MessagePriority.SAFETY.value].appendleft(
+            OutgoingMessage(None, msg, MessagePriority.SAFETY, PROTOCOL_HANDSHAKE_RETRIES, PROTOCOL_HANDSHAKE_TIMEOUT))
+
+    def _next_down_id(self):
+        down_id = self._current_msg_id
         self._current_msg_id = (self._current_msg_id + 1) % 256
-        serialized = msg.serialize().tobytes()
-        for i in range(MAX_SEND_RETRIES):
-            # print(serialized)
-            self._serial_port.write(b'\xff\xff' + serialized)
-            # print("Sending :", b'\xff\xff' + serialized)
-            time_sent = int(round(time.time() * 1000))
-            while int(round(time.time() * 1000)) - time_sent < SERIAL_SEND_TIMEOUT:
-                msg = self._read_message()
-                if msg is not None:
-                    if msg.type == eTypeUp.ACK_DOWN:
-                        return 0  # success
-                    else:
-                        self._receivebox.put(msg)  # if it is not an ACK or a NONACK, store it to deliver later
-        return -1  # failure
-
-    def _read_message(self, max_read=1):
-        for i in range(max_read):
-            if self._state == self.STATE_IDLE:
-                if self._last_start_byte is None and self._serial_port.in_waiting >= 1:
-                    self._last_start_byte = self._serial_port.read(1)[0]
-                if self._serial_port.in_waiting >= UP_HEADER_SIZE + 1:
-                    start_byte = self._serial_port.read(1)[0]
-                    if self._last_start_byte == 0xFF and start_byte == 0xFF:
-                        try:
-                            packed_header = self._serial_port.read(UP_HEADER_SIZE)
-                            self._last_start_byte = None
-                            self._tmp_msg.deserialize_header(packed_header)
-                        except DeserializationException as e:
-                            print("[Comm] Message synchronisation lost : Trying to re synchronise : {}".format(e))
-                            continue
-                        else:
-                            self._state = self.STATE_HEADER_RECEIVED
-                    else:
-                        self._last_start_byte = start_byte
-
-            if self._state == self.STATE_HEADER_RECEIVED:
-                if self._serial_port.in_waiting >= self._tmp_msg.data_size:
-                    self._state = self.STATE_IDLE
-                    packed_data = self._serial_port.read(self._tmp_msg.data_size)
-                    msg = sMessageUp()
-                    try:
-                        msg.up_id = self._tmp_msg.up_id
-                        msg.type = self._tmp_msg.type
-                        msg.data_size = self._tmp_msg.data_size
-                        msg.checksum = self._tmp_msg.checksum
-                        msg.deserialize_data(packed_data)
-                    except DeserializationException as e:
-                        print("[Comm] Cannot deserialize data : {}".format(e))
-                        continue
-                    self._handle_acknowledgement(msg)
-                    return msg
+        self._last_sent_id = down_id
+        return down_id
+
+    def _transmit(self, outgoing):
+        """
+        (Re)send a message. The Teensy acknowledges every message but only executes the ones with an id newer than
+        the last one it received, so a retransmission keeps its id only if no other message has been sent since
+        (the Teensy then ignores it if it had already received it).
+
+        :type outgoing: OutgoingMessage
+        """
+        if outgoing.frame is None or outgoing.down_ids[-1] != self._last_sent_id:
+            outgoing.msg.down_id = self._next_down_id()
+            outgoing.down_ids.append(outgoing.msg.down_id)
+            self._in_flight_ids[outgoing.msg.down_id] = outgoing
+            outgoing.frame = self._encoder.encode(outgoing.msg)
+        self._serial_port.write(outgoing.frame)
+        if self._journal is not None:
+            self._journal.record_down(outgoing.frame[len(FRAME_START):])
+        # print("Sending :", outgoing.frame)
+        self._statistics.increment(eLinkCounter.FRAMES_SENT)
+        if outgoing.nb_sent > 0:
+            self._statistics.increment(eLinkCounter.RETRANSMISSIONS)
+        outgoing.nb_sent += 1
+        outgoing.last_sent_time = time.monotonic()
+        if outgoing.first_sent_time is None:
+            outgoing.first_sent_time = outgoing.last_sent_time
+
+    def _remove_in_flight(self, outgoing):
+        self._in_flight.remove(outgoing)
+        for down_id in outgoing.down_ids:
+            if self._in_flight_ids.get(down_id) is outgoing:
+                del self._in_flight_ids[down_id]
+
+    def _drain_input(self):
+        """
+        Drop the bytes sent by the Teensy before a reset. The reader process sleeps meanwhile, while in an event loop
+        the reset waits for the end of the drain and the bytes are dropped as they come (see _read_available_messages).
+
+        :return: True if the drain is over and the reset can be sent
+        :rtype: bool
+        """
+        if self._blocking_drain:
+            for i in range(10):
+                time.sleep(RESET_DRAIN_DURATION / 10000)
+                self._serial_port.read_all()
+            return True
+        now = time.monotonic()
+        if self._drain_end_time is None:
+            self._drain_end_time = now + RESET_DRAIN_DURATION / 1000
+        self._serial_port.read_all()
+        if now < self._drain_end_time:
+            return False
+        self._drain_end_time = None
+        return True
+
+    def _complete(self, outgoing, result):
+        self._remove_in_flight(outgoing)
+        if outgoing.msg.type == eTypeDown.RESET and result == 0 and self._batching:
+            self._start_handshake()
+        elif outgoing.msg.type == eTypeDown.PROTOCOL_VERSION:
+            self._set_protocol_version(PROTOCOL_VERSION if result == 0 else 1)
+            print("[Comm] Teensy protocol version {}".format(self._protocol_version))
+        for token in outgoing.tokens:
+            self._is_sent_flag.put((token, result))
+
+    def _handle_received_message(self, msg):
+        if msg.type == eTypeUp.ACK_DOWN:
+            outgoing = self._in_flight_ids.get(msg.data.ack_down_id)
+            if outgoing is not None:
+                self._statistics.record(eLinkHistogram.ACK_RTT, (time.monotonic() - outgoing.first_sent_time) * 1e6)
+                self._statistics.record(eLinkHistogram.RETRIES, outgoing.nb_sent - 1)
+                self._complete(outgoing, 0)  # success
+        elif msg.type == eTypeUp.SENSOR_VALUE and not self._accept_sensor_value(msg.data):
+            self._statistics.increment(eLinkCounter.SENSOR_VALUES_FILTERED)
+        else:
+            self._received.append(msg)
+
+    def _accept_sensor_value(self, data):
+        """
+        :type data: sSensorValue
+        :return: True if the value is not filtered by the subscription of its sensor
+        :rtype: bool
+        """
+        subscription = self._sensor_subscriptions.get(data.sensor_id)
+        return subscription is None or subscription.accept(data.sensor_value, time.monotonic())
+
+    def _retransmit_timed_out_messages(self):
+        now = time.monotonic()
+        for outgoing in list(self._in_flight):
+            if now - outgoing.last_sent_time >= outgoing.timeout:
+                newer = self._newer_message(outgoing) if self._latest_wins(outgoing.msg.type) else None
+                if newer is not None:
+                    # Useless to retransmit an outdated message, it will complete with the newer one
+                    self._remove_in_flight(outgoing)
+                    newer.tokens = outgoing.tokens + newer.tokens
+                    self._statistics.increment(eLinkCounter.DROPPED_COMMANDS)
+                elif outgoing.nb_sent >= outgoing.max_retries:
+                    if outgoing.msg.type != eTypeDown.PROTOCOL_VERSION:  # Not a failure, the Teensy is in version 1
+                        self._statistics.increment(eLinkCounter.SEND_FAILURES)
+                    self._complete(outgoing, -1)  # failure
+                else:
+                    self._transmit(outgoing)
 
     def _handle_acknowledgement(self, msg):
         if msg.type == eTypeUp.ACK_DOWN:
@@ -382,11 +992,13 @@ class TeensyReaderProcess:
 
     def _send_acknowledgment(self, id_to_acknowledge):
         ack = sMessageDown()
-        ack.down_id = self._current_msg_id
-        self._current_msg_id = (self._current_msg_id + 1) % 256
+        ack.down_id = self._next_down_id()
         ack.type = eTypeDown.ACK_UP
         ack.data = sAckUp()
         ack.data.ack_up_id = id_to_acknowledge
-        serialized = ack.serialize().tobytes()
-        self._serial_port.write(b'\xff\xff' + serialized)
-        # print("Sending :", b'\xff\xff' + serialized)
+        serialized = self._encoder.encode(ack)
+        self._serial_port.write(serialized)
+        if self._journal is not None:
+            self._journal.record_down(serialized[len(FRAME_START):])
+        self._statistics.increment(eLinkCounter.FRAMES_SENT)
+        # print("Sending :", serialized)
@@ -0,0 +1,17 @@
+"""
+Prints the source of the payload classes of communication.message_definition, generated from
+communication.protocol_schema by communication.codegen.
+
+From the ai directory:
+    python3 -m communication
+"""
+from communication.codegen import generate_source
+from communication.protocol_schema import UP_PAYLOADS, DOWN_PAYLOADS
+
+
+def main():
+    print(generate_source(UP_PAYLOADS + DOWN_PAYLOADS), end="")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+asyncio variant of the Teensy communication.
+
+The serial port is watched by the event loop (loop.add_reader on its file descriptor) and the protocol (framing,
+acknowledgements, sending window, retransmissions and coalescing) is the one of TeensyReaderProcess, run in the
+event loop instead of a separate process. Example:
+
+    async def main():
+        communication = AsyncCommunication("/dev/ttyAMA0")
+        await communication.start()
+        asyncio.ensure_future(communication.dispatch_messages())  # calls the registered callbacks
+        await communication.send_hmi_command(255, 0, 0)
+        communication.send_speed_command(100, 0, 0)  # fire and forget
+"""
+import asyncio
+
+from communication import BaseCommunication, MessagePriority, SensorSubscription, TeensyReaderProcess, SERIAL_PATH, \
+    SERIAL_BAUDRATE, SEND_WINDOW_SIZE
+from communication.link_statistics import eLinkCounter
+from communication.message_definition import *
+
+
+class _CallbackQueue:
+    """
+    Queue-like object calling a function for each item put, to plug the TeensyReaderProcess outputs in the event
+    loop.
+    """
+
+    def __init__(self, callback):
+        self.put = callback
+
+
+class AsyncCommunication(BaseCommunication):
+    """
+    Communication with the Teensy in an asyncio event loop. The send_* methods return an asyncio.Future, which gives
+    0 when the message is acknowledged and -1 when max retries has been reached (their wait argument is ignored: await
+    the future to wait for the acknowledgement). The received messages can be iterated with async for.
+    """
+
+    def __init__(self, serial_path=SERIAL_PATH, baudrate=SERIAL_BAUDRATE, window_size=SEND_WINDOW_SIZE,
+                 coalescing_policies=None, journal_path=None, message_priorities=None, batching=False):
+        """
+        :param serial_path: The path of the serial file
+        :type serial_path: str
+        :param baudrate: The baudrate of UART (must the same as the one on the other board)
+        :type baudrate: int
+        :param window_size: maximum number of down messages waiting for their acknowledgement at the same time
+        :type window_size: int
+        :param coalescing_policies: CoalescingPolicy of each down message type (default : COALESCING_POLICIES)
+        :type coalescing_policies: dict[eTypeDown, CoalescingPolicy]|None
+        :param journal_path: if given, every frame sent and received is recorded in this file
+        :type journal_path: str|None
+        :param message_priorities: MessagePriority of each down message type (default : MESSAGE_PRIORITIES)
+        :type message_priorities: dict[eTypeDown, MessagePriority]|None
+        :param batching: negotiate the protocol version 2 and send the waiting messages in BATCH frames (see
+            Communication, the negotiation delays the other messages after each reset)
+        :type batching: bool
+        """
+        super().__init__()
+        self._serial_path = serial_path
+        self._baudrate = baudrate
+        self._window_size = window_size
+        self._coalescing_policies = coalescing_policies
+        self._journal_path = journal_path
+        self._message_priorities = message_priorities
+        self._batching = batching
+        self._loop = None
+        self._link = None
+        self._incoming = None
+        self._send_futures = {}  # token -> asyncio.Future of the messages not completed yet
+        self._next_token = 0
+        self._retransmission_timer = None
+
+    async def start(self):
+        """
+        Open the serial port and reset the Teensy.
+
+        :return: 0 if the reset is acknowledged, -1 if max retries has been reached
+        :rtype: int
+        """
+        self._loop = asyncio.get_event_loop()
+        self._incoming = asyncio.Queue()
+        self._link = TeensyReaderProcess(self._serial_path, self._baudrate, _CallbackQueue(self._put_received),
+                                         None, _CallbackQueue(self._on_send_result), self._window_size,
+                                         self._coalescing_policies, self.statistics, self._journal_path,
+                                         self._message_priorities, self._batching, blocking_drain=False)
+        self._loop.add_reader(self._link.fileno(), self._process)
+        return await self.reset_soft_teensy()
+
+    def close(self):
+        if self._link is not None:
+            self._loop.remove_reader(self._link.fileno())
+            if self._retransmission_timer is not None:
+                self._retransmission_timer.cancel()
+            self._link.close()
+            self._link = None
+
+    async def reset_soft_teensy(self, max_retries=1000):
+        """
+        Send a reset order to the Teensy and forget the messages received before.
+
+        :return: 0 if the message is sent, -1 if max_retries has been reached
+        :rtype: int
+        """
+        msg = sMessageDown()
+        msg.type = eTypeDown.RESET
+        ret = await self.send_message(msg, max_retries)
+        if ret == 0:
+            while not self._incoming.empty():
+                self._incoming.get_nowait()
+                self.statistics.increment(eLinkCounter.MESSAGES_HANDLED)
+        return ret
+
+    def send_message(self, msg, _=None, wait=True, priority=None):
+        """
+        Send a message (by priority then in order, see Communication.send_message).
+
+        :param msg: the message to send
+        :type msg: sMessageDown
+        :param _: Not used only for legacy purpose
+        :param wait: Not used, await the returned future to wait for the acknowledgement
+        :param priority: priority of this message, instead of the one of its type
+        :type priority: MessagePriority|None
+        :return: future giving 0 if the message is sent, -1 if max_retries has been reached
+        :rtype: asyncio.Future
+        """
+        future = self._loop.create_future()
+        token = self._next_token
+        self._next_token += 1
+        self._send_futures[token] = future
+        self._link.submit(token, msg, priority)
+        self._process()
+        return future
+
+    def subscribe_sensor(self, sensor_id, min_period=0., deadband=0):
+        """
+        Filter the values of a sensor before they are given to the event loop (see
+        BaseCommunication.subscribe_sensor).
+        """
+        self._link.subscribe_sensor(SensorSubscription(sensor_id, min_period, deadband))
+
+    def _put_received(self, messages):
+        for msg in messages:
+            self._incoming.put_nowait(msg)
+
+    def _on_send_result(self, token_result):
+        token, result = token_result
+        future = self._send_futures.pop(token, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    def _process(self):
+        """
+        Run the protocol, and schedule it again for the next retransmission.
+        """
+        self._link.process()
+        if self._retransmission_timer is not None:
+            self._retransmission_timer.cancel()
+            self._retransmission_timer = None
+        delay = self._link.next_retransmission_delay()
+        if delay is not None:
+            self._retransmission_timer = self._loop.call_later(delay, self._process)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        """
+        :return: the next message received from the Teensy (the acknowledgements are handled internally)
+        :rtype: sMessageUp
+        """
+        msg = await self._incoming.get()
+        self.statistics.increment(eLinkCounter.MESSAGES_HANDLED)
+        return msg
+
+    async def dispatch_messages(self):
+        """
+        Call the registered callbacks (see register_callback) for every received message, forever.
+        """
+        async for msg in self:
+            self.handle_message(msg)
@@ -0,0 +1,100 @@
+"""
+Generation of the payload classes of communication.message_definition from communication.protocol_schema.
+
+Each payload class gets plain attributes (no property per field) and deserialize, pack_into and serialize methods
+with its precompiled struct and the scale and offset conversions of its fields inlined. The source is compiled when
+message_definition is imported, so the schema is the only description of the payloads.
+
+The generated source is printed by `python3 -m communication` (communication/__main__.py: this module is already
+imported with the communication package). The classes are compared byte for byte with the baseline implementation by
+tests/test_payloads.py.
+"""
+import linecache
+import struct
+
+from communication.protocol_schema import *
+
+GENERATED_FILENAME = "<communication.codegen>"
+WIDTH_MAXIMUMS = {'B': 0xFF, 'H': 0xFFFF}
+
+
+def _decoding(field, raw):
+    if field.factor is None:
+        return raw
+    return "{} / {!r} - {!r}".format(raw, field.factor, field.adder) if field.adder else \
+        "{} / {!r}".format(raw, field.factor)
+
+
+def _encoding(field, value):
+    if field.factor is None:
+        return value
+    if field.adder:
+        raw = "round(({} + {!r}) * {!r})".format(value, field.adder, field.factor)
+    else:
+        raw = "round({} * {!r})".format(value, field.factor)
+    return "min({}, {})".format(raw, WIDTH_MAXIMUMS[field.width]) if field.saturate else raw
+
+
+def generate_class(payload):
+    """
+    :type payload: Payload
+    :return: source of the class of the payload, and of the module level aliases of its struct methods
+    :rtype: str
+    """
+    names = [field.name for field in payload.fields]
+    fmt = '<' + ''.join(field.width for field in payload.fields)
+    encoded = ", ".join(_encoding(field, "self." + field.name) for field in payload.fields)
+    lines = ["class {}:".format(payload.class_name)]
+    if payload.doc:
+        lines += ['    """', "    {}".format(payload.doc), '    """', ""]
+    lines += ["    __slots__ = ({})".format("".join("{!r}, ".format(name) for name in names)),
+              "    FORMAT = struct.Struct({!r})".format(fmt),
+              "",
+              "    def __init__(self):"]
+    lines += ["        self.{} = None  # uint:{}".format(field.name, 8 * struct.calcsize(field.width))
+              for field in payload.fields]
+    lines += ["",
+              "    def deserialize(self, bytes_packed):",
+              "        {}, = _unpack_from_{}(bytes_packed)".format(", ".join(names), payload.class_name)]
+    lines += ["        self.{} = {}".format(field.name, _decoding(field, field.name)) for field in payload.fields]
+    lines += ["",
+              "    def pack_into(self, buffer, offset):",
+              "        _pack_into_{}(buffer, offset, {})".format(payload.class_name, encoded),
+              "",
+              "    def serialize(self):",
+              "        return _pack_{}({})".format(payload.class_name, encoded),
+              "",
+              "    def __repr__(self):",
+              "        return '{}({})'.format({})".format(
+                  payload.class_name, ", ".join("{}={{!r}}".format(name) for name in names),
+                  ", ".join("self." + name for name in names)),
+              "",
+              "",
+              "_unpack_from_{0} = {0}.FORMAT.unpack_from".format(payload.class_name),
+              "_pack_into_{0} = {0}.FORMAT.pack_into".format(payload.class_name),
+              "_pack_{0} = {0}.FORMAT.pack".format(payload.class_name)]
+    return "\n".join(lines)
+
+
+def generate_source(payloads):
+    """
+    :type payloads: collections.Iterable[Payload]
+    :return: source of a module defining the class of every payload
+    :rtype: str
+    """
+    return "import struct\n\n\n" + "\n\n\n".join(generate_class(payload) for payload in payloads) + "\n"
+
+
+def compile_payloads(payloads):
+    """
+    :type payloads: collections.Iterable[Payload]
+    :return: class name -> generated class
+    :rtype: dict[str, type]
+    """
+    payloads = tuple(payloads)
+    source = generate_source(payloads)
+    # Makes the generated source visible in the tracebacks and the profilers
+    linecache.cache[GENERATED_FILENAME] = (len(source), None, source.splitlines(True), GENERATED_FILENAME)
+    namespace = {'__name__': 'communication.message_definition'}
+    exec(compile(source, GENERATED_FILENAME, 'exec'), namespace)
+    return {payload.class_name: namespace[payload.class_name] for payload in payloads}
@@ -0,0 +1,298 @@
+"""
+Emulator of the Teensy side of the serial protocol, on a local pseudo-terminal, to run and load test the ai without
+the robot.
+
+It behaves like base/code/communication/Communication.cpp and base/code/propulsion_rustyDuck_2019.cpp:
+    * every valid down frame is acknowledged, but only executed if its id is newer than the last one (or on RESET).
+      The Teensy checksum is the plain XOR of the payload, so the frames whose XOR is 255 (sent with a 0 checksum
+      by payload_checksum) are rejected, as on the robot.
+    * speed commands (forward speed and rotation speed, as the Teensy ignores vy) are integrated into the odometry
+    * ODOM_REPORT and SPEED_REPORT are sent every POS_REPORT_PERIOD, HMI_STATE (on change) and SENSOR_VALUE
+      (according to the sensor read states) every IO_REPORT_PERIOD
+    * up messages are not retransmitted
+    * with protocol_version 1, the BATCH and PROTOCOL_VERSION messages are ignored (not acknowledged)
+Latency and frame loss can be added in both directions.
+
+Usage (from the ai directory):
+    python3 -m communication.emulator --latency 0.002 --loss 0.01   # prints the pty path to give to robot.py -t
+"""
+import argparse
+import heapq
+import math
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+from communication.message_definition import *
+
+POS_REPORT_PERIOD = 0.05  # s, as in base/code/params.h
+IO_REPORT_PERIOD = 0.5  # s, as in base/code/params.h
+
+SENSOR_STOPPED = 0
+SENSOR_ON_CHANGE = 1
+SENSOR_PERIODIC = 2
+
+
+class TeensyEmulator:
+    def __init__(self, latency=0., loss=0., pos_report_period=POS_REPORT_PERIOD, io_report_period=IO_REPORT_PERIOD,
+                 seed=None, protocol_version=PROTOCOL_VERSION):
+        """
+        :param latency: delay added to every frame, in both directions (s)
+        :type latency: float
+        :param loss: probability to lose a frame, in both directions
+        :type loss: float
+        :param seed: seed of the frame loss random generator
+        :param protocol_version: version of the protocol supported by the emulated Teensy
+        :type protocol_version: int
+        """
+        self.latency = latency
+        self.loss = loss
+        self.pos_report_period = pos_report_period
+        self.io_report_period = io_report_period
+        self.protocol_version = protocol_version
+        self._random = random.Random(seed)
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._running = False
+        self._parser = FrameParser(DOWN_DATA_SIZES, DOWN_HEADER)
+        self._events = []  # heap of (time, sequence number, function, argument) for the delayed frames
+        self._sequence = 0
+        self.sensor_values = {}  # sensor_id -> value sent for this sensor, to be changed by the user
+        self.cord = False
+        self.button1 = False
+        self.button2 = False
+        self.frames_received = 0
+        self.frames_lost = 0
+        self.checksum_errors = 0
+        self.reset()
+
+    def reset(self):
+        """
+        State of the Teensy after a RESET message.
+        """
+        self.x = 0.
+        self.y = 0.
+        self.theta = 0.
+        self.vx = 0.
+        self.vtheta = 0.
+        self.leds = (0, 0, 0)
+        self.actuators = {}
+        self.sensor_states = {}
+        self._last_sensor_values = {}
+        self._last_down_id = None
+        self._up_id = 0
+        self._last_hmi_state = None
+        self._last_integration_time = time.monotonic()
+
+    @property
+    def path(self):
+        """
+        :return: path of the pty to open as the Teensy serial port (None before open)
+        :rtype: str|None
+        """
+        return None if self._slave is None else os.ttyname(self._slave)
+
+    def open(self):
+        """
+        Create the pseudo-terminal and start emulating in a daemon thread.
+
+        :return: path of the pty to open as the Teensy serial port
+        :rtype: str
+        """
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name="TeensyEmulator")
+        self._thread.start()
+        return self.path
+
+    def close(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+        self._master = self._slave = None
+
+    def _schedule(self, delay, function, argument):
+        heapq.heappush(self._events, (time.monotonic() + delay, self._sequence, function, argument))
+        self._sequence += 1
+
+    def _lost(self):
+        if self.loss > 0 and self._random.random() < self.loss:
+            self.frames_lost += 1
+            return True
+        return False
+
+    def _run(self):
+        now = time.monotonic()
+        next_pos_report = now + self.pos_report_period
+        next_io_report = now + self.io_report_period
+        while self._running:
+            now = time.monotonic()
+            deadline = min(next_pos_report, next_io_report, self._events[0][0] if self._events else math.inf)
+            readable, _, _ = select.select([self._master], [], [], min(max(0., deadline - now), 0.1))
+            if readable:
+                self._parser.feed(os.read(self._master, 1024))
+                for msg_id, msg_type, checksum, payload in self._parser.frames():
+                    self.frames_received += 1
+                    if not self._lost():
+                        self._schedule(self.latency, self._handle_frame, (msg_id, msg_type, checksum, bytes(payload)))
+            now = time.monotonic()
+            while self._events and self._events[0][0] <= now:
+                _, _, function, argument = heapq.heappop(self._events)
+                function(argument)
+            if now >= next_pos_report:
+                next_pos_report += self.pos_report_period
+                self._integrate(now)
+                self._send_position_report()
+            if now >= next_io_report:
+                next_io_report += self.io_report_period
+                self._send_io_report()
+
+    def _write(self, frame):
+        os.write(self._master, frame)
+
+    def _send(self, msg_type, data):
+        """
+        Send an up message, after the configured latency (or never if it is lost).
+
+        :type msg_type: eTypeUp
+        """
+        msg = sMessageUp()
+        msg.up_id = self._up_id
+        self._up_id = (self._up_id + 1) % 256
+        msg.type = msg_type
+        msg.data = data
+        if not self._lost():
+            self._schedule(self.latency, self._write, FRAME_START + msg.serialize())
+
+    def _handle_frame(self, frame):
+        msg_id, type_value, checksum, payload = frame
+        xor = 0
+        for octet in payload:
+            xor ^= octet
+        if xor != checksum:
+            self.checksum_errors += 1
+            return
+        msg_type = eTypeDown(type_value)
+        if self.protocol_version < 2 and msg_type in (eTypeDown.BATCH, eTypeDown.PROTOCOL_VERSION):
+            return  # Unknown message type for the version 1 Teensy
+        ack = sAckDown()
+        ack.ack_down_id = msg_id
+        self._send(eTypeUp.ACK_DOWN, ack)
+        if msg_type != eTypeDown.RESET and self._last_down_id is not None and \
+                not 0 < (msg_id - self._last_down_id) % 256 < 128:
+            return  # Already received
+        self._last_down_id = msg_id
+        if msg_type == eTypeDown.RESET:
+            self.reset()
+            return
+        if msg_type in (eTypeDown.ACK_UP, eTypeDown.PROTOCOL_VERSION):
+            return  # The Teensy does not retransmit up messages, and the version is acknowledged
+        if msg_type == eTypeDown.BATCH:
+            offset = 0
+            while offset < len(payload) and eTypeDown(payload[offset]) in BATCHABLE_TYPES:
+                msg_type = eTypeDown(payload[offset])
+                data = DOWN_DATA_CLASSES[msg_type]()
+                data.deserialize(payload[offset + 1:])
+                self._execute(msg_type, data)
+                offset += 1 + data.FORMAT.size
+            return
+        data = DOWN_DATA_CLASSES[msg_type]()
+        data.deserialize(payload)
+        self._execute(msg_type, data)
+
+    def _execute(self, msg_type, data):
+        if msg_type == eTypeDown.SPEED_COMMAND:
+            self._integrate(time.monotonic())
+            self.vx = data.vx
+            self.vtheta = data.vtheta
+        elif msg_type == eTypeDown.REPOSITIONING:
+            self.x = data.x_repositioning
+            self.y = data.y_repositioning
+            self.theta = data.theta_repositioning
+            self._last_integration_time = time.monotonic()
+        elif msg_type == eTypeDown.HMI_COMMAND:
+            hmi_command = data.hmi_command
+            self.leds = (hmi_command & 0b11100000, (hmi_command & 0b00011100) << 3, (hmi_command & 0b00000011) << 6)
+        elif msg_type == eTypeDown.ACTUATOR_COMMAND:
+            self.actuators[data.actuator_id] = data.actuator_command
+        elif msg_type == eTypeDown.SENSOR_COMMAND:
+            self.sensor_states[data.sensor_id] = data.sensor_state
+            self._last_sensor_values.pop(data.sensor_id, None)
+
+    def _integrate(self, now):
+        dt = now - self._last_integration_time
+        self._last_integration_time = now
+        if abs(self.vtheta) > 1e-9:
+            # Exact integration of a constant speed arc
+            new_theta = self.theta + self.vtheta * dt
+            radius = self.vx / self.vtheta
+            self.x += radius * (math.sin(new_theta) - math.sin(self.theta))
+            self.y -= radius * (math.cos(new_theta) - math.cos(self.theta))
+            self.theta = new_theta
+        else:
+            self.x += self.vx * math.cos(self.theta) * dt
+            self.y += self.vx * math.sin(self.theta) * dt
+        self.theta = (self.theta + math.pi) % (2 * math.pi) - math.pi
+
+    def _send_position_report(self):
+        odometry = sOdomReport()
+        odometry.x = min(max(self.x, -LINEAR_POSITION_TO_MSG_ADDER), 65535 / LINEAR_POSITION_TO_MSG_FACTOR -
+                         LINEAR_POSITION_TO_MSG_ADDER)
+        odometry.y = min(max(self.y, -LINEAR_POSITION_TO_MSG_ADDER), 65535 / LINEAR_POSITION_TO_MSG_FACTOR -
+                         LINEAR_POSITION_TO_MSG_ADDER)
+        odometry.theta = min(self.theta, 65535 / RADIAN_TO_MSG_FACTOR - RADIAN_TO_MSG_ADDER)
+        self._send(eTypeUp.ODOM_REPORT, odometry)
+        speed = sSpeedReport()
+        speed.vx = self.vx
+        speed.vy = 0
+        speed.vtheta = self.vtheta
+        speed.drifting_flags = 0
+        self._send(eTypeUp.SPEED_REPORT, speed)
+
+    def _send_io_report(self):
+        hmi_state = (self.cord << 7) | (self.button1 << 6) | (self.button2 << 5) | (bool(self.leds[0]) << 4) | \
+                    (bool(self.leds[1]) << 3) | (bool(self.leds[2]) << 2)
+        if hmi_state != self._last_hmi_state:
+            self._last_hmi_state = hmi_state
+            hmi = sHMIState()
+            hmi.hmi_state = hmi_state
+            self._send(eTypeUp.HMI_STATE, hmi)
+        for sensor_id, sensor_state in self.sensor_states.items():
+            value = self.sensor_values.get(sensor_id, 0)
+            if sensor_state == SENSOR_PERIODIC or \
+                    (sensor_state == SENSOR_ON_CHANGE and self._last_sensor_values.get(sensor_id) != value):
+                self._last_sensor_values[sensor_id] = value
+                sensor_value = sSensorValue()
+                sensor_value.sensor_id = sensor_id
+                sensor_value.sensor_value = value
+                self._send(eTypeUp.SENSOR_VALUE, sensor_value)
+
+
+def main():
+    parser = argparse.ArgumentParser("Teensy protocol emulator")
+    parser.add_argument('--latency', type=float, default=0., help="Delay added to every frame (s)")
+    parser.add_argument('--loss', type=float, default=0., help="Probability to lose a frame")
+    parser.add_argument('--seed', type=int, default=None, help="Seed of the frame loss random generator")
+    parser.add_argument('--protocol', type=int, default=PROTOCOL_VERSION, help="Protocol version of the Teensy")
+    args = parser.parse_args()
+    emulator = TeensyEmulator(args.latency, args.loss, seed=args.seed, protocol_version=args.protocol)
+    print("Teensy emulated on {}".format(emulator.open()))
+    try:
+        while True:
+            time.sleep(1)
+            print("x: {:.0f}\ty: {:.0f}\ttheta: {:.2f}\tframes received: {}\tlost: {}".format(
+                emulator.x, emulator.y, emulator.theta, emulator.frames_received, emulator.frames_lost))
+    except KeyboardInterrupt:
+        emulator.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Binary journal of the frames exchanged with the Teensy, and its replay.
+
+The journal is an append-only file starting with JOURNAL_MAGIC, followed by one record per frame : RECORD_HEADER
+(monotonic timestamp in s, eJournalDirection, frame size) then the frame without its FRAME_START bytes (header and
+payload). The reader process only puts the frames in a queue, they are written by a background thread.
+
+Replay of a journal recorded during a match, eg. to profile the callbacks (from the ai directory):
+    python3 -m communication.journal log/teensy.journal               # summary of the journal
+    python3 -m communication.journal log/teensy.journal --dump        # every frame
+    python3 -m communication.journal log/teensy.journal --replay --speed 0 --profile
+or from the code, with the callbacks of the robot registered on communication:
+    replay("log/teensy.journal", robot.communication, speed=10.)
+"""
+import argparse
+import cProfile
+import pstats
+import queue
+import struct
+import threading
+import time
+from collections import Counter
+from enum import Enum
+
+from communication.message_definition import *
+
+JOURNAL_MAGIC = b'EBJ1'
+RECORD_HEADER = struct.Struct('<dBH')
+JOURNAL_FLUSH_SIZE = 64  # records written between two flushes when the queue is never empty
+
+
+class eJournalDirection(Enum):
+    UP = 0  # Teensy -> raspi
+    DOWN = 1  # raspi -> Teensy
+
+
+class Journal:
+    """
+    Writer of a journal. Must be created in the process sending and receiving the frames, as it starts a thread.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: journal file, the records are appended if it already exists
+        :type path: str
+        """
+        self.path = path
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(JOURNAL_MAGIC)
+        self._records = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True, name="TeensyJournal")
+        self._thread.start()
+
+    def record_up(self, frame):
+        """
+        Add a received frame to the journal (timestamped now), without waiting for the disk.
+
+        :param frame: frame header and payload, without FRAME_START
+        :type frame: bytes|bytearray|memoryview
+        """
+        self._records.put((time.monotonic(), eJournalDirection.UP.value, bytes(frame)))
+
+    def record_down(self, frame):
+        """
+        Add a sent frame to the journal (timestamped now), without waiting for the disk.
+
+        :param frame: frame header and payload, without FRAME_START
+        :type frame: bytes|bytearray|memoryview
+        """
+        self._records.put((time.monotonic(), eJournalDirection.DOWN.value, bytes(frame)))
+
+    def close(self):
+        """
+        Write the pending records and close the file.
+        """
+        self._records.put(None)
+        self._thread.join()
+        self._file.close()
+
+    def _write_loop(self):
+        nb_unflushed = 0
+        while True:
+            record = self._records.get()
+            if record is None:
+                self._file.flush()
+                return
+            timestamp, direction, frame = record
+            self._file.write(RECORD_HEADER.pack(timestamp, direction, len(frame)))
+            self._file.write(frame)
+            nb_unflushed += 1
+            if self._records.empty() or nb_unflushed >= JOURNAL_FLUSH_SIZE:
+                self._file.flush()
+                nb_unflushed = 0
+
+
+def read_journal(path):
+    """
+    :param path: journal file
+    :type path: str
+    :return: generator of (timestamp, eJournalDirection, frame) for every record, in the recording order
+    :rtype: collections.Iterable[tuple[float, eJournalDirection, bytes]]
+    """
+    with open(path, 'rb') as journal:
+        if journal.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            raise ValueError("{} is not a Teensy journal".format(path))
+        while True:
+            header = journal.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return  # End of the journal (a truncated record is the end of an interrupted recording)
+            timestamp, direction, size = RECORD_HEADER.unpack(header)
+            frame = journal.read(size)
+            if len(frame) < size:
+                return
+            yield timestamp, eJournalDirection(direction), frame
+
+
+def decode_up_frame(frame):
+    """
+    :param frame: up frame recorded in a journal
+    :type frame: bytes
+    :rtype: sMessageUp
+    """
+    msg = sMessageUp()
+    msg.deserialize(frame)
+    return msg
+
+
+def replay(path, communication, speed=1., profile=None):
+    """
+    Feed the up messages of a journal to communication.handle_message, so to its registered callbacks, as the ai
+    would have received them (the acknowledgements are not given, as by the reader process).
+
+    :param path: journal file
+    :type path: str
+    :type communication: communication.BaseCommunication
+    :param speed: replay speed factor relative to the recording (0 to replay as fast as possible)
+    :type speed: float
+    :param profile: if given, the handle_message calls are profiled in it
+    :type profile: cProfile.Profile|None
+    :return: {eTypeUp: (number of messages, total time spent in handle_message (s))}
+    :rtype: dict[eTypeUp, tuple[int, float]]
+    """
+    costs = {}
+    first_timestamp = None
+    start = time.monotonic()
+    for timestamp, direction, frame in read_journal(path):
+        if direction != eJournalDirection.UP:
+            continue
+        try:
+            msg = decode_up_frame(frame)
+        except (ValueError, DeserializationException) as e:
+            print("[Journal] Cannot decode frame {} : {}".format(frame.hex(), e))
+            continue
+        if msg.type == eTypeUp.ACK_DOWN:
+            continue
+        if first_timestamp is None:
+            first_timestamp = timestamp
+        if speed > 0:
+            delay = start + (timestamp - first_timestamp) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        handling_start = time.perf_counter()
+        if profile is not None:
+            profile.runcall(communication.handle_message, msg)
+        else:
+            communication.handle_message(msg)
+        count, total = costs.get(msg.type, (0, 0.))
+        costs[msg.type] = (count + 1, total + time.perf_counter() - handling_start)
+    return costs
+
+
+def summarize(path):
+    """
+    :param path: journal file
+    :type path: str
+    :return: {(eJournalDirection, message type): number of frames} and the recording duration (s)
+    :rtype: tuple[collections.Counter, float]
+    """
+    counts = Counter()
+    first_timestamp = last_timestamp = None
+    for timestamp, direction, frame in read_journal(path):
+        if first_timestamp is None:
+            first_timestamp = timestamp
+        last_timestamp = timestamp
+        type_value = frame[1] if len(frame) > 1 else None
+        try:
+            msg_type = eTypeUp(type_value) if direction == eJournalDirection.UP else eTypeDown(type_value)
+        except ValueError:
+            msg_type = type_value
+        counts[(direction, msg_type)] += 1
+    return counts, 0. if first_timestamp is None else last_timestamp - first_timestamp
+
+
+def main():
+    from communication import BaseCommunication
+    parser = argparse.ArgumentParser("Teensy journal replay")
+    parser.add_argument('journal', type=str, help="Journal file")
+    parser.add_argument('--dump', action='store_true', default=False, help="Print every frame")
+    parser.add_argument('--replay', action='store_true', default=False,
+                        help="Replay the up messages in handle_message, printing them")
+    parser.add_argument('--speed', type=float, default=1., help="Replay speed factor (0 : as fast as possible)")
+    parser.add_argument('--profile', action='store_true', default=False, help="Profile the replay")
+    args = parser.parse_args()
+
+    if args.dump:
+        first_timestamp = None
+        for timestamp, direction, frame in read_journal(args.journal):
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            if direction == eJournalDirection.UP:
+                msg = decode_up_frame(frame)
+                description = "{} id {} : {}".format(msg.type.name, msg.up_id, msg.data)
+            else:
+                down_id, type_value, _, _ = DOWN_HEADER.unpack_from(frame)
+                description = "{} id {} : {}".format(eTypeDown(type_value).name, down_id,
+                                                     frame[DOWN_HEADER.size:].hex())
+            print("{:10.4f} {:4} {}".format(timestamp - first_timestamp, direction.name, description))
+
+    counts, duration = summarize(args.journal)
+    print("{:.1f} s recorded".format(duration))
+    for (direction, msg_type), count in sorted(counts.items(), key=lambda item: (item[0][0].value, str(item[0][1]))):
+        print("{:4} {:20} {:6d} ({:.1f}/s)".format(direction.name, getattr(msg_type, 'name', str(msg_type)), count,
+                                                   count / duration if duration > 0 else 0))
+
+    if args.replay:
+        communication = BaseCommunication()
+        for msg_type in (eTypeUp.HMI_STATE, eTypeUp.ODOM_REPORT, eTypeUp.SENSOR_VALUE, eTypeUp.SPEED_REPORT):
+            communication.register_callback(msg_type, lambda *values, msg_type=msg_type: print(
+                "{} : {}".format(msg_type.name, values)) if not args.profile else None)
+        profile = cProfile.Profile() if args.profile else None
+        costs = replay(args.journal, communication, args.speed, profile)
+        for msg_type, (count, total) in costs.items():
+            print("{:20} {:6d} messages, {:.1f} us per message".format(msg_type.name, count, total / count * 1e6))
+        if profile is not None:
+            pstats.Stats(profile).sort_stats('cumulative').print_stats(20)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Low overhead statistics of the Teensy serial link, shared between the main process and the reader process.
+
+Counters and histograms are stored in shared memory arrays without lock: each slot is only written by one process
+(see the comments of eLinkCounter and eLinkHistogram), the other one only reads it. The histograms have logarithmic
+bins: bin 0 counts the zeros and bin k the values in [2^(k-1), 2^k).
+"""
+from enum import Enum
+from multiprocessing import RawArray
+
+HISTOGRAM_BINS = 32
+
+
+class eLinkCounter(Enum):
+    FRAMES_SENT = 0  # reader process
+    RETRANSMISSIONS = 1  # reader process
+    SEND_FAILURES = 2  # reader process, messages not acknowledged after MAX_SEND_RETRIES
+    FRAMES_RECEIVED = 3  # reader process
+    SYNC_LOSSES = 4  # reader process
+    CHECKSUM_FAILURES = 5  # reader process
+    DESERIALIZATION_ERRORS = 6  # reader process
+    MESSAGES_DELIVERED = 7  # reader process, up messages put in the mailbox
+    COALESCED_COMMANDS = 8  # reader process, messages replaced by a newer one before being sent
+    DROPPED_COMMANDS = 9  # reader process, sent messages no longer retransmitted because a newer one is pending
+    MESSAGES_HANDLED = 10  # main process, up messages taken from the mailbox
+    BATCHED_MESSAGES = 11  # reader process, down messages sent in a BATCH
+    PROTOCOL_VERSION = 12  # reader process, version of the protocol used with the Teensy (not a counter)
+    SENSOR_VALUES_FILTERED = 13  # reader process, SENSOR_VALUE messages dropped by a SensorSubscription
+
+
+class eLinkHistogram(Enum):
+    ACK_RTT = 0  # reader process, us from the first transmission of a message to its acknowledgement
+    RETRIES = 1  # reader process, retransmissions of each acknowledged message
+    SEND_WAIT = 2  # main process, us blocked in send_message waiting for the acknowledgement
+    MAILBOX_DEPTH = 3  # main process, messages waiting in the mailbox at each check_message
+
+
+class LinkStatistics:
+    def __init__(self, shared=True):
+        """
+        :param shared: allocate the statistics in shared memory, to give them to another process
+        :type shared: bool
+        """
+        nb_counters = len(eLinkCounter)
+        nb_bins = len(eLinkHistogram) * HISTOGRAM_BINS
+        if shared:
+            self._counters = RawArray('Q', nb_counters)
+            self._histograms = RawArray('Q', nb_bins)
+        else:
+            self._counters = [0] * nb_counters
+            self._histograms = [0] * nb_bins
+
+    def increment(self, counter, value=1):
+        """
+        :type counter: eLinkCounter
+        :type value: int
+        """
+        self._counters[counter.value] += value
+
+    def set(self, counter, value):
+        """
+        :type counter: eLinkCounter
+        :type value: int
+        """
+        self._counters[counter.value] = value
+
+    def get(self, counter):
+        """
+        :type counter: eLinkCounter
+        :rtype: int
+        """
+        return self._counters[counter.value]
+
+    def record(self, histogram, value):
+        """
+        Add a value (positive integer, rounded if needed) to a histogram.
+
+        :type histogram: eLinkHistogram
+        :type value: float
+        """
+        self._histograms[histogram.value * HISTOGRAM_BINS + min(int(value).bit_length(), HISTOGRAM_BINS - 1)] += 1
+
+    def histogram(self, histogram):
+        """
+        :type histogram: eLinkHistogram
+        :return: the number of values of each bin
+        :rtype: list[int]
+        """
+        start = histogram.value * HISTOGRAM_BINS
+        return list(self._histograms[start:start + HISTOGRAM_BINS])
+
+    def reset(self):
+        for i in range(len(self._counters)):
+            self._counters[i] = 0
+        for i in range(len(self._histograms)):
+            self._histograms[i] = 0
+
+    def snapshot(self):
+        """
+        :return: {counter name: value} and {histogram name: {'count', 'p50', 'p90', 'p99', 'max'}}. The percentiles
+            and the maximum are the upper bounds of their bins.
+        :rtype: tuple[dict[str, int], dict[str, dict[str, int]]]
+        """
+        counters = {counter.name.lower(): self._counters[counter.value] for counter in eLinkCounter}
+        histograms = {}
+        for histogram in eLinkHistogram:
+            bins = self.histogram(histogram)
+            histograms[histogram.name.lower()] = summarize_histogram(bins)
+        return counters, histograms
+
+    def __str__(self):
+        counters, histograms = self.snapshot()
+        return "{}\n{}".format(", ".join("{}: {}".format(name, value) for name, value in counters.items()),
+                               "\n".join("{}: {}".format(name, ", ".join("{} {}".format(key, value)
+                                                                         for key, value in summary.items()))
+                                         for name, summary in histograms.items()))
+
+
+def bin_upper_bound(index):
+    return 0 if index == 0 else (1 << index) - 1
+
+
+def summarize_histogram(bins):
+    """
+    :param bins: number of values of each logarithmic bin
+    :type bins: list[int]
+    :rtype: dict[str, int]
+    """
+    count = sum(bins)
+    summary = {'count': count}
+    for name, ratio in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+        threshold = ratio * count
+        cumulated = 0
+        summary[name] = 0
+        for index, nb in enumerate(bins):
+            cumulated += nb
+            if nb > 0 and cumulated >= threshold:
+                summary[name] = bin_upper_bound(index)
+                break
+    used = [index for index, nb in enumerate(bins) if nb > 0]
+    summary['max'] = bin_upper_bound(used[-1]) if used else 0
+    return summary
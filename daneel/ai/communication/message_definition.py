@@ -1,20 +1,38 @@
 from enum import Enum
-import bitstring
+import struct
+
+from communication.codegen import compile_payloads
+from communication.protocol_schema import *
 
 UP_MESSAGE_SIZE = 10  # maximum size of a up message (teensy -> raspi) in bytes
 UP_HEADER_SIZE = 4  # size of the header (all except the data) of an up message
 DOWN_MESSAGE_SIZE = 16  # maximum size of a down message (raspi -> teensy) in bytes
 DOWN_HEADER_SIZE = 4  # size of the header (all except the data) of a down message
+DOWN_MAX_DATA_SIZE = DOWN_MESSAGE_SIZE - DOWN_HEADER_SIZE
+BATCH_MAX_DATA_SIZE = 32  # maximum size of the data of a BATCH down message (protocol version 2) in bytes
+PROTOCOL_VERSION = 2  # version 1 : one message per frame, version 2 : BATCH and PROTOCOL_VERSION down messages
+FRAME_START = b'\xff\xff'  # synchronisation bytes sent before each message, in both directions
+
+# Headers: id (uint8), type (uint8), data size (uint8), checksum (uint8). Payloads are little endian.
+UP_HEADER = struct.Struct('<BBBB')
+DOWN_HEADER = struct.Struct('<BBBB')
+
+# Payload classes (sOdomReport, sSpeedCommand...), generated from communication.protocol_schema, which also defines
+# the data converters (from and to what is sent over the wire and what is used as data).
+_PAYLOAD_CLASSES = compile_payloads(UP_PAYLOADS + DOWN_PAYLOADS)
+
+
+def payload_checksum(payload):
+    """
+    Checksum of a message payload, as computed by the Teensy (XOR of every byte).
 
-# Data converters (from and to what is sent over the wire and what is used as data).
-LINEAR_POSITION_TO_MSG_FACTOR = 4
-LINEAR_POSITION_TO_MSG_ADDER = 8192
-RADIAN_TO_MSG_FACTOR = 10430.378350470453
-RADIAN_TO_MSG_ADDER = 3.14159265358979323846
-LINEAR_SPEED_TO_MSG_FACTOR = 32.768
-LINEAR_SPEED_TO_MSG_ADDER = 1000
-ANGULAR_SPEED_TO_MSG_FACTOR = 2607.5945876176133
-ANGULAR_SPEED_TO_MSG_ADDER = 4 * 3.14159265358979323846
+    :type payload: bytes|bytearray|memoryview
+    :rtype: int
+    """
+    checksum = 0
+    for octet in payload:
+        checksum ^= octet
+    return checksum % 0xFF
 
 
 class DeserializationException(Exception):
@@ -46,141 +64,22 @@ class eTypeUp(Enum):
     SPEED_REPORT = 4
 
 
-class sAckDown:
-    """
-    Payload of an up message (from base to ai) acknowledging a down message (from ai to base).
-    """
-
-    def __init__(self):
-        """
-        Ctor
-        """
-        self.ack_down_id = None  # uint:8
-
-    def deserialize(self, bytes_packed):
-        """
-        Fills the id of the acknowledged message with no alteration from what is received from the wire.
-
-        :param bytes_packed: The bytes received from serial.
-        :type bytes_packed: list[bytes]
-        """
-        s = bitstring.BitStream(bytes_packed)
-        self.ack_down_id, = s.unpack('uint:8')
-
-    def serialize(self):
-        """
-        Not used.
-
-        :return:
-        :rtype:
-        """
-        return bitstring.pack('uint:8', self.ack_down_id)
-
-
-class sOdomReport:
-    def __init__(self):
-        self._x = None  # uint:16
-        self._y = None  # uint:16
-        self._theta = None  # uint:16
-
-    @property
-    def x(self):
-        return self._x / LINEAR_POSITION_TO_MSG_FACTOR - LINEAR_POSITION_TO_MSG_ADDER
+sAckDown = _PAYLOAD_CLASSES['sAckDown']
+sOdomReport = _PAYLOAD_CLASSES['sOdomReport']
+sHMIState = _PAYLOAD_CLASSES['sHMIState']
+sSensorValue = _PAYLOAD_CLASSES['sSensorValue']
 
-    @x.setter
-    def x(self, x):
-        self._x = (x + LINEAR_POSITION_TO_MSG_ADDER) * LINEAR_POSITION_TO_MSG_FACTOR
 
-    @property
-    def y(self):
-        return self._y / LINEAR_POSITION_TO_MSG_FACTOR - LINEAR_POSITION_TO_MSG_ADDER
-
-    @y.setter
-    def y(self, y):
-        self._y = (y + LINEAR_POSITION_TO_MSG_ADDER) * LINEAR_POSITION_TO_MSG_FACTOR
+class sSpeedReport(_PAYLOAD_CLASSES['sSpeedReport']):
+    __slots__ = ()
 
-    @property
-    def theta(self):
-        return self._theta / RADIAN_TO_MSG_FACTOR - RADIAN_TO_MSG_ADDER
-
-    @theta.setter
-    def theta(self, theta):
-        self._theta = (theta + RADIAN_TO_MSG_ADDER) * RADIAN_TO_MSG_FACTOR
-
-    def deserialize(self, bytes_packed):
-        s = bitstring.BitStream(bytes_packed)
-        self._x, self._y, self._theta = s.unpack(
-            'uintle:16, uintle:16, uintle:16')
-
-    def serialize(self):
-        return bitstring.pack('uintle:16, uintle:16, uintle:16',
-                              self._x, self._y, self._theta)
-
-
-class sHMIState:
-    def __init__(self):
-        self.hmi_state = None  # uint:8
-
-    def deserialize(self, bytes_packed):
-        s = bitstring.BitStream(bytes_packed)
-        self.hmi_state, = s.unpack('uint:8')
-
-    def serialize(self):
-        return bitstring.pack('uint:8', self.hmi_state)
-
-
-class sSpeedReport:
-    def __init__(self):
-        self._vx = None  #  uint:16
-        self._vy = None  #  uint:16
-        self._vtheta = None  #  uint:16
-        self._drifting = None #  uint:8
-
-    @property
-    def vx(self):
-        return self._vx / LINEAR_SPEED_TO_MSG_FACTOR - LINEAR_SPEED_TO_MSG_ADDER
-
-    @vx.setter
-    def vx(self, value):
-        self._vx = round((value + LINEAR_SPEED_TO_MSG_ADDER) * LINEAR_SPEED_TO_MSG_FACTOR)
-
-    @property
-    def vy(self):
-        return self._vy / LINEAR_SPEED_TO_MSG_FACTOR - LINEAR_SPEED_TO_MSG_ADDER
-
-    @vy.setter
-    def vy(self, value):
-        self._vy = round((value + LINEAR_SPEED_TO_MSG_ADDER) * LINEAR_SPEED_TO_MSG_FACTOR)
-
-    @property
-    def vtheta(self):
-        return self._vtheta / ANGULAR_SPEED_TO_MSG_FACTOR - ANGULAR_SPEED_TO_MSG_ADDER
-
-    @vtheta.setter
-    def vtheta(self, value):
-        self._vtheta = round((value + ANGULAR_SPEED_TO_MSG_ADDER) * ANGULAR_SPEED_TO_MSG_FACTOR)
-    
     @property
     def drifting(self):
-        return (bool(self._drifting & 0b01), bool(self._drifting & 0b10))
-
-    def deserialize(self, bytes_packed):
-        s = bitstring.BitStream(bytes_packed)
-        self._vx, self._vy, self._vtheta, self._drifting= s.unpack(
-                'uintle:16, uintle:16, uintle:16, uint:8')
-
-    def serialize(self):
-        return bitstring.pack('uintle:16, uintle:16, uintle:16, uint8:t', self._vx, self._vy, self._vtheta, self._drifting)
-
-
-class sSensorValue:
-    def __init__(self):
-        self.sensor_id = None
-        self.sensor_value = None
-
-    def deserialize(self, bytes_packed):
-        s = bitstring.BitStream(bytes_packed)
-        self.sensor_id, self.sensor_value = s.unpack('uint:8, uintle:16')
+        """
+        :return: drifting of the left and right wheels
+        :rtype: tuple[bool, bool]
+        """
+        return bool(self.drifting_flags & 0b01), bool(self.drifting_flags & 0b10)
 
 
 class sMessageUp:
@@ -200,49 +99,35 @@ class sMessageUp:
         self.data = None
 
     def deserialize_header(self, packed):
-        header = bitstring.BitStream(packed[0:UP_HEADER_SIZE])
         try:
-            self.up_id, type_value, self.data_size, self.checksum = header.unpack('uint:8, uint:8, uint:8, uint:8')
+            self.up_id, type_value, self.data_size, self.checksum = UP_HEADER.unpack_from(packed)
             self.type = eTypeUp(type_value)
-        except ValueError as e:
+        except (ValueError, struct.error) as e:
             raise DeserializationException("Can't deserialize up message header : {}".format(str(e)))
 
     def deserialize_data(self, packed):
-        if self.type == eTypeUp.ACK_DOWN:
-            self.data = sAckDown()
-        elif self.type == eTypeUp.HMI_STATE:
-            self.data = sHMIState()
-        elif self.type == eTypeUp.ODOM_REPORT:
-            self.data = sOdomReport()
-        elif self.type == eTypeUp.SENSOR_VALUE:
-            self.data = sSensorValue()
-        elif self.type == eTypeUp.SPEED_REPORT:
-            self.data = sSpeedReport()
+        self.data = UP_DATA_CLASSES[self.type]()
         try:
             self.data.deserialize(packed[0:self.data_size])
-        except ValueError as e:
+        except (ValueError, struct.error) as e:
             raise DeserializationException("Can't deserialize up message payload : {}".format(str(e)))
 
     def deserialize(self, packed):
         self.deserialize_header(packed)
-        self.deserialize(packed[UP_HEADER_SIZE:])
+        self.deserialize_data(packed[UP_HEADER_SIZE:])
 
     def serialize(self):
-
-        ser2 = None
+        payload = b''
         if self.data is not None:
-            ser2 = self.data.serialize()
-            self.data_size = len(ser2.tobytes())
-            self.checksum = 0
-            for octet in ser2.tobytes():
-                self.checksum ^= octet
-            self.checksum = self.checksum % 0xFF
+            payload = self.data.serialize()
+            self.data_size = len(payload)
+            self.checksum = payload_checksum(payload)
+        return UP_HEADER.pack(self.up_id, self.type.value, self.data_size, self.checksum) + payload
 
-        ser = bitstring.pack('uint:8, uint:8, uint:8, uint:8',
-                             self.up_id, self.type.value, self.data_size, self.checksum)
-        serialized_msg = ser + ser2
-        return serialized_msg
 
+UP_DATA_CLASSES = {eTypeUp.ACK_DOWN: sAckDown, eTypeUp.ODOM_REPORT: sOdomReport, eTypeUp.HMI_STATE: sHMIState,
+                   eTypeUp.SENSOR_VALUE: sSensorValue, eTypeUp.SPEED_REPORT: sSpeedReport}
+UP_DATA_SIZES = {msg_type.value: data_class.FORMAT.size for msg_type, data_class in UP_DATA_CLASSES.items()}
 
 # ====== End up message declaration
 # ====== Down (raspi -> prop) message declaration #
@@ -257,173 +142,47 @@ class eTypeDown(Enum):
     REPOSITIONING = 5
     PID_TUNING = 6
     SENSOR_COMMAND = 7
+    BATCH = 8  # protocol version 2
+    PROTOCOL_VERSION = 9  # protocol version 2, only acknowledged by a Teensy supporting this version
 
 
-class sAckUp:
-    def __init__(self):
-        self.ack_up_id = None  # uint:8
-
-    def serialize(self):
-        return bitstring.pack('uint:8', self.ack_up_id)
-
-
-class sSpeedCommand:
-    def __init__(self):
-        self._vx = None  # uint:16
-        self._vy = None  # uint:16
-        self._vtheta = None  # uint:16
-
-    @property
-    def vx(self):
-        return self._vx / LINEAR_SPEED_TO_MSG_FACTOR - LINEAR_SPEED_TO_MSG_ADDER
-
-    @vx.setter
-    def vx(self, vx):
-        self._vx = round((vx + LINEAR_SPEED_TO_MSG_ADDER) * LINEAR_SPEED_TO_MSG_FACTOR)
-
-    @property
-    def vy(self):
-        return self._vy / LINEAR_SPEED_TO_MSG_FACTOR - LINEAR_SPEED_TO_MSG_ADDER
-
-    @vy.setter
-    def vy(self, vy):
-        self._vy = round((vy + LINEAR_SPEED_TO_MSG_ADDER) * LINEAR_SPEED_TO_MSG_FACTOR)
-
-    @property
-    def vtheta(self):
-        return self._vtheta / ANGULAR_SPEED_TO_MSG_FACTOR - ANGULAR_SPEED_TO_MSG_ADDER
-
-    @vtheta.setter
-    def vtheta(self, vtheta):
-        self._vtheta = round((vtheta + ANGULAR_SPEED_TO_MSG_ADDER) * ANGULAR_SPEED_TO_MSG_FACTOR)
-
-    def serialize(self):
-        return bitstring.pack('uintle:16, uintle:16, uintle:16', self._vx, self._vy,
-                              self._vtheta)
+sAckUp = _PAYLOAD_CLASSES['sAckUp']
+sSpeedCommand = _PAYLOAD_CLASSES['sSpeedCommand']
+sActuatorCommand = _PAYLOAD_CLASSES['sActuatorCommand']
+sHMICommand = _PAYLOAD_CLASSES['sHMICommand']
+sRepositioning = _PAYLOAD_CLASSES['sRepositioning']
+sPIDTuning = _PAYLOAD_CLASSES['sPIDTuning']
+sSensorCommand = _PAYLOAD_CLASSES['sSensorCommand']
+sProtocolVersion = _PAYLOAD_CLASSES['sProtocolVersion']
 
 
-class sActuatorCommand:
-    def __init__(self):
-        self.actuator_id = None  # uint:8
-        self.actuator_command = None  # uint:16
-
-    def serialize(self):
-        return bitstring.pack('uint:8, uintle:16', self.actuator_id, self.actuator_command)
-
-
-class sHMICommand:
-    def __init__(self):
-        self.hmi_command = None
-
-    def serialize(self):
-        return bitstring.pack('uint:8', self.hmi_command)
-
-
-class sRepositioning:
-    def __init__(self):
-        self._x_repositioning = None
-        self._y_repositioning = None
-        self._theta_repositioning = None
-
-    @property
-    def x_repositioning(self):
-        return self._x_repositioning / LINEAR_POSITION_TO_MSG_FACTOR - LINEAR_POSITION_TO_MSG_ADDER
-
-    @x_repositioning.setter
-    def x_repositioning(self, value):
-        self._x_repositioning = min(round((value + LINEAR_POSITION_TO_MSG_ADDER) * LINEAR_POSITION_TO_MSG_FACTOR), 65535)
-
-    @property
-    def y_repositioning(self):
-        return self._y_repositioning / LINEAR_POSITION_TO_MSG_FACTOR - LINEAR_POSITION_TO_MSG_ADDER
-
-    @y_repositioning.setter
-    def y_repositioning(self, value):
-        self._y_repositioning = min(round((value + LINEAR_POSITION_TO_MSG_ADDER) * LINEAR_POSITION_TO_MSG_FACTOR), 65535)
-
-    @property
-    def theta_repositioning(self):
-        return self._theta_repositioning / RADIAN_TO_MSG_FACTOR - RADIAN_TO_MSG_ADDER
-
-    @theta_repositioning.setter
-    def theta_repositioning(self, value):
-        self._theta_repositioning = min(round((value + RADIAN_TO_MSG_ADDER) * RADIAN_TO_MSG_FACTOR), 65535)
-
-    def serialize(self):
-        return bitstring.pack('uintle:16, uintle:16, uintle:16',
-                              self._x_repositioning, self._y_repositioning, self._theta_repositioning)
-
-
-class sPIDTuning:
-    def __init__(self):
-        self._kp_linear = None
-        self._ki_linear = None
-        self._kd_linear = None
-        self._kp_angular = None
-        self._ki_angular = None
-        self._kd_angular = None
-
-    @property
-    def kp_linear(self):
-        return self._kp_linear / 1000
-
-    @kp_linear.setter
-    def kp_linear(self, value):
-        self._kp_linear = value * 1000
-
-    @property
-    def ki_linear(self):
-        return self._ki_linear / 1000
-
-    @ki_linear.setter
-    def ki_linear(self, value):
-        self._ki_linear = value * 1000
-
-    @property
-    def kd_linear(self):
-        return self._kd_linear / 1000
-
-    @kd_linear.setter
-    def kd_linear(self, value):
-        self._kd_linear = value * 1000
-
-    @property
-    def kp_angular(self):
-        return self._kp_angular / 1000
-
-    @kp_angular.setter
-    def kp_angular(self, value):
-        self._kp_angular = value * 1000
-
-    @property
-    def ki_angular(self):
-        return self._ki_angular / 1000
-
-    @ki_angular.setter
-    def ki_angular(self, value):
-        self._ki_angular = value * 1000
-
-    @property
-    def kd_angular(self):
-        return self._kd_angular / 1000
-
-    @kd_angular.setter
-    def kd_angular(self, value):
-        self._kd_angular = value * 1000
-
-    def serialize(self):
-        return bitstring.pack('uintle:16, uintle:16, uintle:16, uintle:16, uintle:16, uintle:16',
-                              self._kp_linear, self._ki_linear, self._kd_linear, self._kp_angular, self._ki_angular,
-                              self._kd_angular)
-
+class sBatch:
+    """
+    Several down messages sent in one frame, acknowledged and executed (in order) at once by the Teensy. Each
+    message is its type (uint:8) followed by its data.
+    """
 
-class sSensorCommand:
-    def __init__(self):
-        self.sensor_id = None
-        self.sensor_state = None
+    def __init__(self, messages=()):
+        """
+        :param messages: messages of the batch, of the BATCHABLE_TYPES
+        :type messages: list[sMessageDown]
+        """
+        self.messages = list(messages)
+        self.FORMAT = struct.Struct('<' + ''.join('B' + ('' if msg.data is None else msg.data.FORMAT.format[1:])
+                                                  for msg in self.messages))
+
+    def pack_into(self, buffer, offset):
+        for msg in self.messages:
+            buffer[offset] = msg.type.value
+            offset += 1
+            if msg.data is not None:
+                msg.data.pack_into(buffer, offset)
+                offset += msg.data.FORMAT.size
 
     def serialize(self):
-        return bitstring.pack('uint:8, uint:8', self.sensor_id, self.sensor_state)
+        packed = bytearray(self.FORMAT.size)
+        self.pack_into(packed, 0)
+        return bytes(packed)
 
 
 class sMessageDown:
@@ -432,7 +191,7 @@ class sMessageDown:
     :type type: eTypeDown|None
     :type down_id: int
     :type checksum: int
-    :type data: sAckUp|sActuatorCommand|sSpeedCommand|sHMICommand|sRepositioning|None
+    :type data: sAckUp|sActuatorCommand|sSpeedCommand|sHMICommand|sRepositioning|sBatch|None
     """
 
     def __init__(self):
@@ -443,21 +202,167 @@ class sMessageDown:
         self.data = None
 
     def serialize(self):
+        """
+        :return: the message as sent on the wire (header and payload, without the synchronisation bytes)
+        :rtype: bytes
+        """
+        return DownFrameEncoder().encode(self)[len(FRAME_START):]
 
-        ser2 = None
-        if self.data is not None:
-            ser2 = self.data.serialize()
-            self.data_size = len(ser2.tobytes())
-            self.checksum = 0
 
-            for octet in ser2.tobytes():
-                self.checksum ^= octet
+class DownFrameEncoder:
+    """
+    Builds the complete down frames (start bytes, header and payload) in a preallocated buffer, with the
+    precompiled struct of each message, instead of allocating the intermediate objects of each field.
+    One encoder is meant to be kept by the process writing on the serial port.
+    """
 
-        self.checksum = self.checksum % 0xFF
+    def __init__(self):
+        self._buffer = bytearray(len(FRAME_START) + DOWN_HEADER_SIZE + max(DOWN_MAX_DATA_SIZE, BATCH_MAX_DATA_SIZE))
+        self._buffer[0:len(FRAME_START)] = FRAME_START
+        self._view = memoryview(self._buffer)
 
-        ser = bitstring.pack('uint:8, uint:8, uint:8, uint:8', self.down_id, self.type.value, self.data_size,
-                             self.checksum)
-        serialized_msg = ser + ser2
-        return serialized_msg
+    def encode(self, msg):
+        """
+        Fills msg.data_size and msg.checksum and serializes the message.
+
+        :param msg: The message to send
+        :type msg: sMessageDown
+        :return: the frame to write on the serial port
+        :rtype: bytes
+        """
+        payload_offset = len(FRAME_START) + DOWN_HEADER_SIZE
+        if msg.data is not None:
+            msg.data_size = msg.data.FORMAT.size
+            msg.data.pack_into(self._buffer, payload_offset)
+            msg.checksum = payload_checksum(self._view[payload_offset:payload_offset + msg.data_size])
+        msg.checksum = msg.checksum % 0xFF
+        DOWN_HEADER.pack_into(self._buffer, len(FRAME_START), msg.down_id, msg.type.value, msg.data_size,
+                              msg.checksum)
+        return bytes(self._view[:payload_offset + msg.data_size])
+
+
+DOWN_DATA_CLASSES = {eTypeDown.ACK_UP: sAckUp, eTypeDown.SPEED_COMMAND: sSpeedCommand,
+                     eTypeDown.ACTUATOR_COMMAND: sActuatorCommand, eTypeDown.HMI_COMMAND: sHMICommand,
+                     eTypeDown.RESET: None, eTypeDown.REPOSITIONING: sRepositioning,
+                     eTypeDown.PID_TUNING: sPIDTuning, eTypeDown.SENSOR_COMMAND: sSensorCommand,
+                     eTypeDown.PROTOCOL_VERSION: sProtocolVersion}
+DOWN_DATA_SIZES = {msg_type.value: 0 if data_class is None else data_class.FORMAT.size
+                   for msg_type, data_class in DOWN_DATA_CLASSES.items()}
+DOWN_DATA_SIZES[eTypeDown.BATCH.value] = range(1, BATCH_MAX_DATA_SIZE + 1)
+# Messages which can be sent in a BATCH
+BATCHABLE_TYPES = frozenset((eTypeDown.SPEED_COMMAND, eTypeDown.ACTUATOR_COMMAND, eTypeDown.HMI_COMMAND,
+                             eTypeDown.REPOSITIONING, eTypeDown.PID_TUNING, eTypeDown.SENSOR_COMMAND))
 
 # ====== End down message declaration
+
+
+class FrameParser:
+    """
+    Incremental parser of a stream of frames (start bytes, header, payload), in either direction.
+
+    The received bytes are appended to a preallocated buffer, the start bytes are searched in bulk and a header is
+    only accepted if its type is known and its data size is the size of this type, which makes resynchronisation
+    after a corrupted or truncated frame immediate. Payloads are returned as memoryview slices of the buffer, which
+    are only valid until the next call to feed.
+    """
+
+    def __init__(self, data_sizes, header=UP_HEADER, verify_checksum=False, buffer_size=1024):
+        """
+        :param data_sizes: payload size of each message type value (eg. UP_DATA_SIZES), or range of sizes for the
+            variable size messages
+        :type data_sizes: dict[int, int|range]
+        :param header: struct of the header (id, type, data size, checksum)
+        :type header: struct.Struct
+        :param verify_checksum: drop the frames with a wrong checksum. The up checksums of the Teensy are not reliable
+            so it is disabled by default.
+        :type verify_checksum: bool
+        :param buffer_size: size of the reception buffer, must be bigger than the biggest chunk fed at once
+        :type buffer_size: int
+        """
+        self._data_sizes = data_sizes
+        self._header = header
+        self._header_end = len(FRAME_START) + header.size
+        self.verify_checksum = verify_checksum
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # first unparsed byte
+        self._end = 0  # end of the received bytes
+        self.sync_losses = 0
+        self.checksum_failures = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def clear(self):
+        """
+        Drop every unparsed byte.
+        """
+        self._start = 0
+        self._end = 0
+
+    def feed(self, data):
+        """
+        Append received bytes to the buffer, dropping the oldest unparsed bytes if there is not enough room.
+
+        :type data: bytes|bytearray|memoryview
+        """
+        size = len(data)
+        if size == 0:
+            return
+        if self._end + size > len(self._buffer):
+            pending = self._end - self._start
+            if size > len(self._buffer):
+                data = data[size - len(self._buffer):]
+                size = len(data)
+            keep = min(pending, len(self._buffer) - size)
+            if keep < pending:
+                self.sync_losses += 1  # Not enough room, the oldest bytes are lost
+            self._view[0:keep] = self._view[self._end - keep:self._end]
+            self._start = 0
+            self._end = keep
+        self._view[self._end:self._end + size] = data
+        self._end += size
+
+    def next_frame(self):
+        """
+        :return: (id, type value, checksum, payload) of the next complete frame, None if there is none yet
+        :rtype: tuple[int, int, int, memoryview]|None
+        """
+        while True:
+            frame_start = self._buffer.find(FRAME_START, self._start, self._end)
+            if frame_start < 0:
+                # Only keep a trailing byte which could be the beginning of the next start bytes
+                keep = 1 if self._end > self._start and self._buffer[self._end - 1] == FRAME_START[0] else 0
+                self._start = self._end - keep
+                return None
+            if frame_start != self._start:
+                self.sync_losses += 1
+            self._start = frame_start
+            if self._end - frame_start < self._header_end:
+                return None
+            msg_id, msg_type, data_size, checksum = self._header.unpack_from(self._buffer,
+                                                                             frame_start + len(FRAME_START))
+            expected_size = self._data_sizes.get(msg_type)
+            if data_size != expected_size and not (isinstance(expected_size, range) and data_size in expected_size):
+                self.sync_losses += 1
+                self._start = frame_start + 1
+                continue
+            data_start = frame_start + self._header_end
+            if self._end - data_start < data_size:
+                return None
+            payload = self._view[data_start:data_start + data_size]
+            if self.verify_checksum and payload_checksum(payload) != checksum:
+                self.checksum_failures += 1
+                self._start = frame_start + 1
+                continue
+            self._start = data_start + data_size
+            return msg_id, msg_type, checksum, payload
+
+    def frames(self):
+        """
+        Iterate over the complete frames of the buffer (see next_frame).
+        """
+        frame = self.next_frame()
+        while frame is not None:
+            yield frame
+            frame = self.next_frame()
@@ -0,0 +1,88 @@
+"""
+Declarative description of the payloads of the Teensy messages, from which communication.codegen generates the
+classes of communication.message_definition.
+
+Must be the same as the structures of base/code/communication/Communication.h (uMessageUpData and
+uMessageDownData). Each field is sent little endian, with the struct format character of its width, and is converted
+with:
+    value = raw / factor - adder
+    raw = round((value + adder) * factor)
+"""
+from typing import NamedTuple
+
+# Data converters (from and to what is sent over the wire and what is used as data).
+LINEAR_POSITION_TO_MSG_FACTOR = 4
+LINEAR_POSITION_TO_MSG_ADDER = 8192
+RADIAN_TO_MSG_FACTOR = 10430.378350470453
+RADIAN_TO_MSG_ADDER = 3.14159265358979323846
+LINEAR_SPEED_TO_MSG_FACTOR = 32.768
+LINEAR_SPEED_TO_MSG_ADDER = 1000
+ANGULAR_SPEED_TO_MSG_FACTOR = 2607.5945876176133
+ANGULAR_SPEED_TO_MSG_ADDER = 4 * 3.14159265358979323846
+PID_TO_MSG_FACTOR = 1000
+
+
+class Field(NamedTuple):
+    name: str
+    width: str  # struct format character : 'B' (uint:8) or 'H' (uint:16)
+    factor: float = None  # None : the value is sent as is
+    adder: float = 0
+    saturate: bool = False  # clip the raw value to the maximum of the width instead of failing
+
+
+class Payload(NamedTuple):
+    class_name: str
+    type_name: str  # name of the eTypeUp or eTypeDown message type
+    fields: tuple
+    doc: str = ""
+
+
+def _position(name, **kwargs):
+    return Field(name, 'H', LINEAR_POSITION_TO_MSG_FACTOR, LINEAR_POSITION_TO_MSG_ADDER, **kwargs)
+
+
+def _angle(name, **kwargs):
+    return Field(name, 'H', RADIAN_TO_MSG_FACTOR, RADIAN_TO_MSG_ADDER, **kwargs)
+
+
+def _linear_speed(name):
+    return Field(name, 'H', LINEAR_SPEED_TO_MSG_FACTOR, LINEAR_SPEED_TO_MSG_ADDER)
+
+
+def _angular_speed(name):
+    return Field(name, 'H', ANGULAR_SPEED_TO_MSG_FACTOR, ANGULAR_SPEED_TO_MSG_ADDER)
+
+
+def _pid(name):
+    return Field(name, 'H', PID_TO_MSG_FACTOR)
+
+
+UP_PAYLOADS = (
+    Payload('sAckDown', 'ACK_DOWN', (Field('ack_down_id', 'B'),),
+            "Payload of an up message (from base to ai) acknowledging a down message (from ai to base)."),
+    Payload('sOdomReport', 'ODOM_REPORT', (_position('x'), _position('y'), _angle('theta')),
+            "Position of the robot (mm, mm, rad) in the table frame."),
+    Payload('sHMIState', 'HMI_STATE', (Field('hmi_state', 'B'),),
+            "Cord, buttons and LEDs states, one bit each from the most significant bit."),
+    Payload('sSensorValue', 'SENSOR_VALUE', (Field('sensor_id', 'B'), Field('sensor_value', 'H'))),
+    Payload('sSpeedReport', 'SPEED_REPORT', (_linear_speed('vx'), _linear_speed('vy'), _angular_speed('vtheta'),
+                                             Field('drifting_flags', 'B')),
+            "Speed of the robot (mm/s, mm/s, rad/s) in the robot frame, and the drifting flags of the wheels."),
+)
+
+DOWN_PAYLOADS = (
+    Payload('sAckUp', 'ACK_UP', (Field('ack_up_id', 'B'),)),
+    Payload('sSpeedCommand', 'SPEED_COMMAND', (_linear_speed('vx'), _linear_speed('vy'), _angular_speed('vtheta')),
+            "Speed command (mm/s, mm/s, rad/s) in the robot frame."),
+    Payload('sActuatorCommand', 'ACTUATOR_COMMAND', (Field('actuator_id', 'B'), Field('actuator_command', 'H'))),
+    Payload('sHMICommand', 'HMI_COMMAND', (Field('hmi_command', 'B'),),
+            "LEDs command : 3 bits of red, 3 bits of green and 2 bits of blue."),
+    Payload('sRepositioning', 'REPOSITIONING', (_position('x_repositioning', saturate=True),
+                                                _position('y_repositioning', saturate=True),
+                                                _angle('theta_repositioning', saturate=True)),
+            "New position of the robot (mm, mm, rad) in the table frame."),
+    Payload('sPIDTuning', 'PID_TUNING', (_pid('kp_linear'), _pid('ki_linear'), _pid('kd_linear'),
+                                         _pid('kp_angular'), _pid('ki_angular'), _pid('kd_angular'))),
+    Payload('sSensorCommand', 'SENSOR_COMMAND', (Field('sensor_id', 'B'), Field('sensor_state', 'B'))),
+    Payload('sProtocolVersion', 'PROTOCOL_VERSION', (Field('version', 'B'),)),
+)
@@ -0,0 +1,205 @@
+"""
+Recording and replay of raw Neato XV11 lidar packets, so that the lidar driver (and everything using its points)
+can be run without the sensor.
+
+File format (little endian):
+    header : magic b'XV11', format version (uint8), packet size (uint8), recording start time (float64,
+             time.monotonic() clock)
+    records: time since the start of the recording in microseconds (uint32), raw packet (22 bytes,
+             starting with the 0xFA start byte)
+
+Usage (from the ai directory):
+    python3 -m drivers.lidar_recording record /dev/ttyUSB0 match.xv11 --duration 30
+    python3 -m drivers.lidar_recording replay match.xv11 --speed 2   # prints a pty path to use as lidar serial
+    python3 -m drivers.lidar_recording bench match.xv11
+"""
+import argparse
+import os
+import struct
+import threading
+import time
+import tty
+
+from drivers import neato_xv11_lidar
+from drivers.neato_xv11_lidar import PACKET_SIZE, EndOfStream
+
+MAGIC = b'XV11'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sBBd')
+RECORD = struct.Struct('<I{}s'.format(PACKET_SIZE))
+
+
+class LidarRecorder:
+    """
+    Append raw lidar packets to a recording file. To be given to read_v_2_4 as recorder.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._start_time = time.monotonic()
+        self._file.write(HEADER.pack(MAGIC, FORMAT_VERSION, PACKET_SIZE, self._start_time))
+        self.packets_written = 0
+
+    def write(self, timestamp, packet):
+        if len(packet) != PACKET_SIZE:
+            return
+        self._file.write(RECORD.pack(max(0, round((timestamp - self._start_time) * 1e6)), packet))
+        self.packets_written += 1
+
+    def close(self):
+        self._file.close()
+
+
+def read_recording(path):
+    """
+    Read a whole recording.
+
+    :param path: path of the recording file
+    :type path: str
+    :return: the start time of the recording and the list of (time since start [s], raw packet)
+    :rtype: tuple[float, list[tuple[float, bytes]]]
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, packet_size, start_time = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION or packet_size != PACKET_SIZE:
+        raise ValueError("{} is not a lidar recording (version {})".format(path, FORMAT_VERSION))
+    nb_records = (len(data) - HEADER.size) // RECORD.size
+    return start_time, [(t_us / 1e6, packet) for t_us, packet in RECORD.iter_unpack(
+        memoryview(data)[HEADER.size:HEADER.size + nb_records * RECORD.size])]
+
+
+class ReplaySerial:
+    """
+    Serial-like object giving the bytes of a recording, at the recorded pace divided by speed
+    (speed = 0 : as fast as possible). Can be given to read_v_2_4 instead of the lidar serial port.
+    """
+
+    def __init__(self, path, speed=1.0, loop=False):
+        _, self._records = read_recording(path)
+        self.speed = speed
+        self.loop = loop
+        self._index = 0
+        self._buffer = b''
+        self._start = None
+
+    @property
+    def in_waiting(self):
+        return len(self._buffer)
+
+    def _next_packet(self):
+        if self._index >= len(self._records):
+            if not self.loop or len(self._records) == 0:
+                raise EndOfStream()
+            self._index = 0
+            self._start = None
+        t, packet = self._records[self._index]
+        self._index += 1
+        if self.speed > 0:
+            if self._start is None:
+                self._start = time.monotonic() - t / self.speed
+            delay = self._start + t / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return packet
+
+    def read(self, size=1):
+        while len(self._buffer) < size:
+            self._buffer += self._next_packet()
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def flushInput(self):
+        pass  # Flushing would drop recorded data, and a replay never lags behind
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        self._records = []
+
+
+def replay_to_pty(path, speed=1.0, loop=False):
+    """
+    Write a recording in a local pseudo-terminal, from a daemon thread. The returned path can be opened as the lidar
+    serial port (eg. LIDAR_SERIAL_PATH in io_robot), to test the whole stack without the lidar.
+
+    :return: the path of the pty slave side
+    :rtype: str
+    """
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    source = ReplaySerial(path, speed, loop)
+
+    def feed():
+        try:
+            while True:
+                os.write(master, source.read(PACKET_SIZE))
+        except EndOfStream:
+            pass
+
+    threading.Thread(target=feed, daemon=True, name="LidarReplay").start()
+    return os.ttyname(slave)
+
+
+def benchmark(path):
+    """
+    Decode every packet of a recording as fast as possible.
+
+    :return: (number of packets, number of valid packets, packets decoded per second)
+    :rtype: tuple[int, int, float]
+    """
+    _, records = read_recording(path)
+    start = time.perf_counter()
+    valid = 0
+    for t, packet in records:
+        valid += neato_xv11_lidar.decode_packet(packet, t)
+    duration = time.perf_counter() - start
+    return len(records), valid, len(records) / duration if duration > 0 else float('inf')
+
+
+def main():
+    parser = argparse.ArgumentParser("Neato XV11 lidar recorder")
+    subparsers = parser.add_subparsers(dest='command')
+    record_parser = subparsers.add_parser('record', help="Record the packets of a lidar")
+    record_parser.add_argument('serial', help="Serial port of the lidar")
+    record_parser.add_argument('output', help="Recording file to create")
+    record_parser.add_argument('--baudrate', type=int, default=115200)
+    record_parser.add_argument('--duration', type=float, default=None, help="Recording duration (s)")
+    replay_parser = subparsers.add_parser('replay', help="Replay a recording in a pseudo terminal")
+    replay_parser.add_argument('recording')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help="Replay speed factor (0 : max speed)")
+    replay_parser.add_argument('--loop', action='store_true', default=False)
+    bench_parser = subparsers.add_parser('bench', help="Benchmark packet decoding on a recording")
+    bench_parser.add_argument('recording')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        import serial
+        lidar_serial = serial.Serial(args.serial, args.baudrate)
+        recorder = LidarRecorder(args.output)
+        thread = threading.Thread(target=neato_xv11_lidar.read_v_2_4, args=(lidar_serial, recorder), daemon=True)
+        thread.start()
+        try:
+            thread.join(args.duration)
+        except KeyboardInterrupt:
+            pass
+        recorder.close()
+        print("{} packets recorded in {}".format(recorder.packets_written, args.output))
+    elif args.command == 'replay':
+        print("Replaying {} on {}".format(args.recording, replay_to_pty(args.recording, args.speed, args.loop)))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'bench':
+        nb_packets, nb_valid, rate = benchmark(args.recording)
+        print("{} packets ({} valid) decoded at {:.0f} packets/s".format(nb_packets, nb_valid, rate))
+        print("Lidar statistics : {}".format(neato_xv11_lidar.lidar_statistics))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,12 +6,71 @@ Under Apache 2.0 License
 import time
 import math
 import serial
+import numpy as np
 
 lidar_points = [None]*360  # type: list[LidarPoint]
 packet_per_cyle = int(359/4)  # In order to flush the input on each rotation
+PACKET_SIZE = 22  # start byte, index, speed (2), 4 * data (4), checksum (2)
+
+# Same data as lidar_points, laid out as arrays (index = azimut in degrees) for vectorized processing.
+LIDAR_AZIMUTS = np.radians(np.arange(360))
+lidar_distances = np.zeros(360)  # mm
+lidar_usable = np.zeros(360, dtype=bool)  # valid and without warning
+lidar_timestamps = np.zeros(360)  # time.monotonic() at packet reception
+lidar_scan_count = 0  # Incremented each time the last packet of a revolution is received
+
+SPEED_TIMEOUT = 0.5  # s, the lidar is considered stopped if no valid packet is received during this time
+
+
+class LidarStatistics:
+    """
+    Rotation speed and packet error statistics of the lidar, updated by decode_packet.
+    """
+
+    def __init__(self):
+        self.rpm = 0.  # Rotation speed given by the last valid packet
+        self.valid_packets = 0
+        self.invalid_packets = 0
+        self.last_packet_time = None  # time.monotonic() of the last valid packet
+        self.last_revolution_time = None
+        self.revolution_period = None  # s, measured between the two last completed revolutions
+
+    @property
+    def scan_frequency(self):
+        """
+        :return: the rotation frequency given by the lidar (Hz), 0 if no valid packet has been received lately.
+        :rtype: float
+        """
+        if self.last_packet_time is None or time.monotonic() - self.last_packet_time > SPEED_TIMEOUT:
+            return 0.
+        return self.rpm / 60
+
+    @property
+    def error_rate(self):
+        total = self.valid_packets + self.invalid_packets
+        return self.invalid_packets / total if total > 0 else 0.
+
+    def reset(self):
+        self.__init__()
+
+    def __str__(self):
+        return "{:.1f} rpm, {} valid packets, {} invalid packets ({:.1%})".format(
+            self.rpm, self.valid_packets, self.invalid_packets, self.error_rate)
+
+
+lidar_statistics = LidarStatistics()
+
+
+class EndOfStream(Exception):
+    """
+    Raised by a lidar data source which will not give any more data (eg. the end of a replayed recording),
+    to stop read_v_2_4.
+    """
+
 
 class LidarPoint:
-    def __init__(self, azimut=0, distance=0, quality=0, valid=False, warning=True, updTour=0, point = None):
+    def __init__(self, azimut=0, distance=0, quality=0, valid=False, warning=True, updTour=0, point = None,
+                 timestamp=0.):
         if point is not None:
             self.azimut = point.azimut  # type: int
             self.distance = point.distance  # type: int
@@ -19,6 +78,7 @@ class LidarPoint:
             self.valid = point.valid  # type: bool
             self.warning = point.warning  # type: bool
             self.updTour = point.updTour  # type: int
+            self.timestamp = point.timestamp  # type: float
         else:
             self.azimut = azimut  # type: int
             self.distance = distance  # type: int
@@ -26,6 +86,7 @@ class LidarPoint:
             self.valid = valid  # type: bool
             self.warning = warning  # type: bool
             self.updTour = updTour  # type: int
+            self.timestamp = timestamp  # type: float
 
     def get_cartesian_coord(self):
         return (self.distance * math.cos(math.radians(self.azimut)),
@@ -41,11 +102,18 @@ class LidarPoint:
         return str(self)
 
 
-def read_v_2_4(lidar_serial):
-    global lidar_points
+def read_v_2_4(lidar_serial, recorder=None):
+    """
+    Read lidar packets forever (until lidar_serial raises EndOfStream).
+
+    :param lidar_serial: serial port plugged to the lidar, or any object with the same read/flushInput methods
+        (see drivers.lidar_recording.ReplaySerial)
+    :param recorder: if given, every raw packet is written to it (see drivers.lidar_recording.LidarRecorder)
+    """
     init_level = 0
     index = 0
     cycle = 0
+    timestamp = 0.
     while True:
         try:
             time.sleep(0.00001)  # do not hog the processor power
@@ -53,6 +121,7 @@ def read_v_2_4(lidar_serial):
                 b = lidar_serial.read(1)
                 # start byte
                 if b == bytes([0xFA]):
+                    timestamp = time.monotonic()
                     init_level = 1
                 else:
                     init_level = 0
@@ -62,71 +131,79 @@ def read_v_2_4(lidar_serial):
                 if bytes([0xA0]) <= b <= bytes([0xF9]):
                     index = int.from_bytes(b, byteorder='big') - 0xA0
                     init_level = 2
-                elif b != bytes([0xFA]):
+                elif b == bytes([0xFA]):
+                    timestamp = time.monotonic()
+                else:
                     init_level = 0
             elif init_level == 2:
-                # speed
-                b_speed = [b for b in lidar_serial.read(2)]
-
-                # data
-                b_data0 = [b for b in lidar_serial.read(4)]
-                b_data1 = [b for b in lidar_serial.read(4)]
-                b_data2 = [b for b in lidar_serial.read(4)]
-                b_data3 = [b for b in lidar_serial.read(4)]
-
-                # for the checksum, we need all the data of the packet...
-                # this could be collected in a more elegent fashion...
-                all_data = [0xFA, index + 0xA0] + b_speed + b_data0 + b_data1 + b_data2 + b_data3
-
-                # checksum
-                b_checksum = [b for b in lidar_serial.read(2)]
-                incoming_checksum = int(b_checksum[0]) + (int(b_checksum[1]) << 8)
-
-                # verify that the received checksum is equal to the one computed from the data
-                if checksum(all_data) == incoming_checksum:
-                    # speed_rpm = compute_speed(b_speed)
-                    # gui_update_speed(speed_rpm)
-
-                    # motor_control(speed_rpm)
-
-                    lidar_points[index * 4 + 0] = new_lidar_point(index * 4 + 0, b_data0)
-                    lidar_points[index * 4 + 1] = new_lidar_point(index * 4 + 1, b_data1)
-                    lidar_points[index * 4 + 2] = new_lidar_point(index * 4 + 2, b_data2)
-                    lidar_points[index * 4 + 3] = new_lidar_point(index * 4 + 3, b_data3)
-
-                    if index == packet_per_cyle:
-                        cycle = (cycle + 1) % 2
-                        if cycle == 0:
-                            lidar_serial.flushInput()
-
-                else:
-                    pass
-                    # the checksum does not match, something went wrong...
-                    # nb_errors += 1
-                    # label_errors.text = "errors: " + str(nb_errors)
-                    #
-                    # # display the samples in an error state
-                    # update_view(index * 4 + 0, [0, 0x80, 0, 0])
-                    # update_view(index * 4 + 1, [0, 0x80, 0, 0])
-                    # update_view(index * 4 + 2, [0, 0x80, 0, 0])
-                    # update_view(index * 4 + 3, [0, 0x80, 0, 0])
-
+                # speed (2 bytes), data (4 * 4 bytes) and checksum (2 bytes)
+                packet = bytes([0xFA, index + 0xA0]) + lidar_serial.read(PACKET_SIZE - 2)
+                if recorder is not None:
+                    recorder.write(timestamp, packet)
+                if decode_packet(packet, timestamp) and index == packet_per_cyle:
+                    cycle = (cycle + 1) % 2
+                    if cycle == 0:
+                        lidar_serial.flushInput()
                 init_level = 0  # reset and wait for the next packet
 
             else:  # default, should never happen...
                 init_level = 0
+        except EndOfStream:
+            return
         except Exception as err:
             print(err)
 
 
-def new_lidar_point(angle, data):
+def decode_packet(packet, timestamp=0.):
+    """
+    Decode a raw packet and store its 4 points in lidar_points (and the associated arrays).
+
+    :param packet: the 22 bytes of the packet, starting with the 0xFA start byte
+    :type packet: bytes
+    :param timestamp: time.monotonic() at which the packet has been received
+    :type timestamp: float
+    :return: True if the packet is valid (and has been stored), False if its checksum does not match
+    :rtype: bool
+    """
+    global lidar_scan_count
+    if len(packet) != PACKET_SIZE or checksum(packet) != packet[20] | (packet[21] << 8):
+        lidar_statistics.invalid_packets += 1
+        return False
+    index = packet[1] - 0xA0
+    lidar_statistics.valid_packets += 1
+    lidar_statistics.rpm = compute_speed(packet[2:4])
+    lidar_statistics.last_packet_time = timestamp
+    for i in range(4):
+        pt = new_lidar_point(index * 4 + i, packet[4 + 4 * i:8 + 4 * i], timestamp)
+        lidar_points[pt.azimut] = pt
+        lidar_distances[pt.azimut] = pt.distance
+        lidar_usable[pt.azimut] = pt.valid and not pt.warning
+        lidar_timestamps[pt.azimut] = timestamp
+    if index == packet_per_cyle:
+        lidar_scan_count += 1
+        if lidar_statistics.last_revolution_time is not None:
+            lidar_statistics.revolution_period = timestamp - lidar_statistics.last_revolution_time
+        lidar_statistics.last_revolution_time = timestamp
+    return True
+
+
+def new_lidar_point(angle, data, timestamp=0.):
     x = data[0]
     x1 = data[1]
     x2 = data[2]
     x3 = data[3]
     dist_mm = x | ((x1 & 0x3f) << 8)  # distance is coded on 13 bits ? 14 bits ?
     quality = x2 | (x3 << 8)  # quality is on 16 bits
-    return LidarPoint(angle, dist_mm, quality, not (x1 & 0x80),  bool(x1 & 0x40), 0)
+    return LidarPoint(angle, dist_mm, quality, not (x1 & 0x80),  bool(x1 & 0x40), 0, timestamp=timestamp)
+
+
+def compute_speed(data):
+    """
+    :param data: the 2 speed bytes of a packet (little endian, in 64th of rpm)
+    :return: the rotation speed in rpm
+    :rtype: float
+    """
+    return (data[0] | (data[1] << 8)) / 64.
 
 
 def checksum(data):
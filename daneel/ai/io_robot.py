@@ -4,11 +4,17 @@ Created on 29 July 2012
 """
 
 from enum import *
+from typing import NamedTuple
 import threading, serial
 
 import math
+import time
+import numpy as np
 
-from drivers.neato_xv11_lidar import lidar_points, read_v_2_4
+from communication import MessagePriority
+from drivers import neato_xv11_lidar
+from drivers.neato_xv11_lidar import lidar_points, read_v_2_4, lidar_distances, lidar_usable, lidar_timestamps, \
+    LIDAR_AZIMUTS, lidar_statistics
 from drivers import vl6180x as v
 from drivers import jevois
 import armothy
@@ -19,6 +25,22 @@ JEVOIS_SERIAL_PATH = "/dev/jevois_serial"
 JEVOIS_SERIAL_BAUDRATE = 115200
 
 BIT10_TO_BATTERY_FACTOR = 0.018
+SENSOR_MIN_PERIOD = 1.  # s, minimum time between two values of a sensor given to the callbacks
+SENSOR_DEADBAND = 3  # 10 bits steps (about 0.05 V of battery), minimum change of a sensor value given to the callbacks
+
+LIDAR_PWM_DEFAULT = 244  # Open loop PWM giving roughly the right rotation speed
+LIDAR_TARGET_FREQUENCY = 5.0  # Hz, nominal scan frequency of the XV11
+LIDAR_SPEED_KP = 10.  # PWM per Hz of error
+LIDAR_SPEED_KI = 20.  # PWM per Hz.s of error
+LIDAR_SPEED_CONTROL_PERIOD = 0.2  # s
+LIDAR_SPEED_TOLERANCE = 0.1  # Hz, no correction is made under this error (avoids PWM toggling on the Teensy link)
+
+# Deskewed lidar revolution. azimut [rad] and distance [mm] are expressed in the current robot frame, x and y [mm]
+# in table frame, all computed with the robot pose at the time each point was measured. origin_x and origin_y [mm]
+# are the positions of the lidar (in table frame) when each point was measured.
+LidarScan = NamedTuple("LidarScan", [('azimut', np.ndarray), ('distance', np.ndarray), ('usable', np.ndarray),
+                                     ('timestamp', np.ndarray), ('x', np.ndarray), ('y', np.ndarray),
+                                     ('masked', np.ndarray), ('origin_x', np.ndarray), ('origin_y', np.ndarray)])
 
 
 class ActuatorID(Enum):
@@ -30,6 +52,39 @@ class ActuatorID(Enum):
     EXPERIMENT_LAUNCHER = 5
 
 
+class LidarSpeedController:
+    """
+    PI controller keeping the lidar scan frequency (measured from the speed bytes of the lidar packets) at a target
+    value by adjusting the motor PWM (ActuatorID.LIDAR_SPEED). A new command is only sent when the PWM changes.
+    """
+
+    def __init__(self, io, target_frequency=LIDAR_TARGET_FREQUENCY, kp=LIDAR_SPEED_KP, ki=LIDAR_SPEED_KI,
+                 initial_pwm=LIDAR_PWM_DEFAULT):
+        self.io = io
+        self.target_frequency = target_frequency
+        self.kp = kp
+        self.ki = ki
+        self._integral = initial_pwm  # The integral term starts at the open loop PWM
+        self._last_update_time = None
+
+    def update(self):
+        """
+        Run one step of the controller (at most every LIDAR_SPEED_CONTROL_PERIOD).
+        """
+        now = time.monotonic()
+        if self._last_update_time is not None and now - self._last_update_time < LIDAR_SPEED_CONTROL_PERIOD:
+            return
+        dt = 0 if self._last_update_time is None else now - self._last_update_time
+        self._last_update_time = now
+        error = self.target_frequency - lidar_statistics.scan_frequency
+        if abs(error) <= LIDAR_SPEED_TOLERANCE:
+            return
+        self._integral = min(255, max(0, self._integral + self.ki * error * dt))
+        pwm = min(255, max(0, round(self._integral + self.kp * error)))
+        if pwm != self.io.lidar_pwm:
+            self.io.set_lidar_pwm(pwm)
+
+
 class IO(object):
     def __init__(self, robot):
         self.robot = robot
@@ -40,6 +95,8 @@ class IO(object):
         self.score_display_text = None
         self.battery_power_voltage = None
         self.battery_signal_voltage = None
+        self.lidar_pwm = None
+        self.lidar_speed_controller = None  # type: LidarSpeedController
         self.range_left = v.VL6180X()
         self.range_center = v.VL6180X()
         self.range_right = v.VL6180X()
@@ -47,6 +104,8 @@ class IO(object):
         self.lidar_serial = serial.Serial(LIDAR_SERIAL_PATH, LIDAR_SERIAL_BAUDRATE)
         self.lidar_thread = threading.Thread(target=read_v_2_4, args=(self.lidar_serial,))
         self.lidar_thread.start()
+        self._lidar_scan_callbacks = []
+        self._last_lidar_scan_count = 0
         self.jevois = jevois.JeVois(JEVOIS_SERIAL_PATH, JEVOIS_SERIAL_BAUDRATE)
         self.robot.communication.register_callback(self.robot.communication.eTypeUp.HMI_STATE, self._on_hmi_state_receive)
         self.robot.communication.register_callback(self.robot.communication.eTypeUp.SENSOR_VALUE, self._on_sensor_value_receive)
@@ -68,8 +127,15 @@ class IO(object):
         ON_CHANGE = 1
         PERIODIC = 2
 
-    def change_sensor_read_state(self, sensor_id: SensorId, sensor_state: SensorState):
-        return self.robot.communication.send_sensor_command(sensor_id.value, sensor_state.value)
+    def change_sensor_read_state(self, sensor_id: SensorId, sensor_state: SensorState, min_period=SENSOR_MIN_PERIOD,
+                                 deadband=SENSOR_DEADBAND):
+        """
+        Change the read state of a sensor on the Teensy. Its values are given to _on_sensor_value_receive at most
+        every min_period (s), and only if they changed by at least deadband (10 bits steps) since the last one given:
+        the other ones are dropped by the reader process of the communication.
+        """
+        return self.robot.communication.send_sensor_command(sensor_id.value, sensor_state.value,
+                                                            min_period=min_period, deadband=deadband)
 
     class LedColor(Enum):
         BLACK = (0, 0, 0)
@@ -117,10 +183,33 @@ class IO(object):
     def set_lidar_pwm(self, pwm):
         pwm=min(abs(int(pwm)), 255)
         if self.robot.communication.send_actuator_command(ActuatorID.LIDAR_SPEED.value, pwm) == 0:
-            pass
+            self.lidar_pwm = pwm
             if __debug__:
                 print("[IO] set lidar pwm to {}".format(pwm))
     
+    def enable_lidar_speed_control(self, target_frequency=LIDAR_TARGET_FREQUENCY):
+        """
+        Hold the lidar scan frequency with a LidarSpeedController (lidar_speed_control_loop must be called
+        regularly) instead of a fixed PWM.
+        """
+        self.lidar_speed_controller = LidarSpeedController(self, target_frequency,
+                                                           initial_pwm=self.lidar_pwm or LIDAR_PWM_DEFAULT)
+
+    def disable_lidar_speed_control(self):
+        self.lidar_speed_controller = None
+
+    def lidar_speed_control_loop(self):
+        if self.lidar_speed_controller is not None:
+            self.lidar_speed_controller.update()
+
+    @property
+    def lidar_statistics(self):
+        """
+        :return: rotation speed and packet errors of the lidar
+        :rtype: drivers.neato_xv11_lidar.LidarStatistics
+        """
+        return lidar_statistics
+
     def launch_experiment(self):
         if self.robot.communication.send_actuator_command(ActuatorID.EXPERIMENT_LAUNCHER.value, 1) == 0:
             pass
@@ -136,19 +225,22 @@ class IO(object):
                 print("[IO] Led switched to {}".format(color))
 
     def score_display_fat(self):
-        if self.robot.communication.send_actuator_command(ActuatorID.SCORE_COUNTER.value, self.ScoreDisplayTexts.FAT.value) == 0:
+        if self.robot.communication.send_actuator_command(ActuatorID.SCORE_COUNTER.value, self.ScoreDisplayTexts.FAT.value,
+                                                          priority=MessagePriority.HMI) == 0:
             self.score_display_text = "FAT"
             print("[IO] Score display displays " + self.score_display_text)
 
     def score_display_enac(self):
-        if self.robot.communication.send_actuator_command(ActuatorID.SCORE_COUNTER.value, self.ScoreDisplayTexts.ENAC.value) == 0:
+        if self.robot.communication.send_actuator_command(ActuatorID.SCORE_COUNTER.value, self.ScoreDisplayTexts.ENAC.value,
+                                                          priority=MessagePriority.HMI) == 0:
             self.score_display_text = "ENAC"
             print("[IO] Score display displays " + self.score_display_text)
 
     def score_display_rusty_ducks(self):
         if self.score_display_text == "Rusty Ducks":
             return
-        if self.robot.communication.send_actuator_command(ActuatorID.SCORE_COUNTER.value, self.ScoreDisplayTexts.RUSTY_DUCKS.value) == 0:
+        if self.robot.communication.send_actuator_command(ActuatorID.SCORE_COUNTER.value, self.ScoreDisplayTexts.RUSTY_DUCKS.value,
+                                                          priority=MessagePriority.HMI) == 0:
             self.score_display_text = "Rusty Ducks"
             print("[IO] Score display displays " + self.score_display_text)
 
@@ -156,7 +248,8 @@ class IO(object):
         command = number
         if with_two_points:
             command += 10000
-        if self.robot.communication.send_actuator_command(ActuatorID.SCORE_COUNTER.value, command) == 0:
+        if self.robot.communication.send_actuator_command(ActuatorID.SCORE_COUNTER.value, command,
+                                                          priority=MessagePriority.HMI) == 0:
             if with_two_points:
                 self.score_display_text = str(number)[:-2] + ":" + str(number)[-2:]
                 #FIXME: Not working with number = 4 (text = ":4" instead of ": 4")
@@ -203,11 +296,57 @@ class IO(object):
     def _bit10_to_battery_voltage(self, bit10):
         return bit10 * BIT10_TO_BATTERY_FACTOR
 
+    def register_lidar_scan_callback(self, callback):
+        """
+        Register a function called with the deskewed scan (LidarScan) each time a new lidar revolution is complete.
+        Callbacks are called from check_lidar_scan.
+        """
+        self._lidar_scan_callbacks.append(callback)
+
+    def check_lidar_scan(self):
+        """
+        Call the lidar scan callbacks if a new revolution has been received since the last call.
+        """
+        scan_count = neato_xv11_lidar.lidar_scan_count
+        if scan_count == self._last_lidar_scan_count or len(self._lidar_scan_callbacks) == 0:
+            return
+        self._last_lidar_scan_count = scan_count
+        scan = self.lidar_scan()
+        for cb in self._lidar_scan_callbacks:
+            cb(scan)
+
+    def _poses_at(self, timestamps):
+        poses = self.robot.locomotion.pose_history.interpolate(timestamps)
+        if poses is None:
+            return self.robot.locomotion.x, self.robot.locomotion.y, self.robot.locomotion.theta
+        return poses
+
+    def lidar_scan(self):
+        """
+        Deskewed snapshot of the last lidar revolution. A revolution takes about 200ms, during which the robot
+        moves : each point is projected in table frame with the pose the robot had when the point was measured,
+        then expressed back in the current robot frame.
+
+        :rtype: LidarScan
+        """
+        distances = lidar_distances.copy()
+        usable = lidar_usable.copy()
+        timestamps = lidar_timestamps.copy()
+        x_r, y_r, theta_r = self._poses_at(timestamps)
+        angles = LIDAR_AZIMUTS + theta_r
+        x_t = x_r + distances * np.cos(angles)
+        y_t = y_r + distances * np.sin(angles)
+        dx = x_t - self.robot.locomotion.x
+        dy = y_t - self.robot.locomotion.y
+        azimuts = (np.arctan2(dy, dx) - self.robot.locomotion.theta) % (2 * math.pi)
+        return LidarScan(azimuts, np.hypot(dx, dy), usable, timestamps, x_t, y_t,
+                         self.robot.map.in_lidar_mask(x_t, y_t), np.broadcast_to(x_r, x_t.shape),
+                         np.broadcast_to(y_r, y_t.shape))
+
     def in_lidar_mask(self, pt):
-        x_t = self.robot.locomotion.x + pt.distance * math.cos(
-            math.radians(pt.azimut) + self.robot.locomotion.theta)
-        y_t = self.robot.locomotion.y + pt.distance * math.sin(
-            math.radians(pt.azimut) + self.robot.locomotion.theta)
+        x_r, y_r, theta_r = self._poses_at(pt.timestamp)
+        x_t = x_r + pt.distance * math.cos(math.radians(pt.azimut) + theta_r)
+        y_t = y_r + pt.distance * math.sin(math.radians(pt.azimut) + theta_r)
         if not self.robot.map.lidar_table_bb.contains(x_t, y_t):
             return True
         in_mask = False
@@ -219,46 +358,26 @@ class IO(object):
         return in_mask
 
     def distance_to_cone_ellipse(self, direction, cone_angle, semi_major, semi_minor):
-        lidar_points = self.lidar_points
-        start_index = round(math.degrees(direction - cone_angle / 2)) % len(lidar_points)
-        stop_index = round(math.degrees(direction + cone_angle / 2)) % len(lidar_points)
-        while stop_index < start_index:
-            start_index -= len(lidar_points)
-
-        min_dist = float('inf')
-        max_dist = float('-inf')
-        for i in range(start_index, stop_index):
-            pt = lidar_points[i]
-            if pt is not None and pt.valid and not pt.warning and not self.in_lidar_mask(pt):
-                r_ellipse = semi_major * semi_minor / math.sqrt((semi_minor**2 - semi_major**2) * math.cos(math.radians(pt.azimut))**2 + semi_major ** 2)
-                d = pt.distance - r_ellipse
-                min_dist = min(min_dist, d)
-                max_dist = max(max_dist, d)
-        return min_dist, max_dist
+        scan = self.lidar_scan()
+        relative_azimuts = (scan.azimut - direction + math.pi) % (2 * math.pi) - math.pi
+        selected = scan.usable & ~scan.masked & (np.abs(relative_azimuts) <= cone_angle / 2)
+        if not selected.any():
+            return float('inf'), float('-inf')
+        cos_azimuts = np.cos(scan.azimut[selected])
+        r_ellipse = semi_major * semi_minor / np.sqrt((semi_minor**2 - semi_major**2) * cos_azimuts**2 +
+                                                      semi_major ** 2)
+        d = scan.distance[selected] - r_ellipse
+        return float(d.min()), float(d.max())
 
     def is_obstacle_in_cone(self, direction, cone_angle, distance):
-        direction = round(math.degrees(direction))
-        for i in range(len(self.lidar_points)):
-            pt = self.lidar_points[i]
-            if pt is None:
-                return
-            a = (pt.azimut - direction + 180) % 360 - 180
-            if abs(a) <= cone_angle:
-
-                #print(pt.azimut)
-                #print(pt.distance)
-                if pt.valid and not pt.warning and pt.distance < distance:
-                    if self.in_lidar_mask(pt):
-                        continue
-                    x_t = self.robot.locomotion.x + pt.distance * math.cos(
-                        math.radians(pt.azimut) + self.robot.locomotion.theta)
-                    y_t = self.robot.locomotion.y + pt.distance * math.sin(
-                        math.radians(pt.azimut) + self.robot.locomotion.theta)
-                    self.robot.ivy.highlight_point(51, x_t, y_t)
-                    # print(x_t, y_t)
-                    # print(pt.azimut, pt.distance)
-                    return True
-        return False
+        scan = self.lidar_scan()
+        a = (np.degrees(scan.azimut) - round(math.degrees(direction)) + 180) % 360 - 180
+        obstacles = np.flatnonzero(scan.usable & ~scan.masked & (np.abs(a) <= cone_angle) &
+                                   (scan.distance < distance))
+        if len(obstacles) == 0:
+            return False
+        self.robot.ivy.highlight_point(51, scan.x[obstacles[0]], scan.y[obstacles[0]])
+        return True
 
 
 # class USReader(threading.Thread):
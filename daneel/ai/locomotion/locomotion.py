@@ -6,6 +6,7 @@ from locomotion.relative_control import RelativeControl
 from locomotion.utils import *
 from locomotion.params import *
 from locomotion.pathfinding import ThetaStar
+from locomotion.pose_history import PoseHistory
 
 
 class LocomotionState(Enum):
@@ -43,6 +44,7 @@ class Locomotion:
         self.is_repositioning = False
 
         self.current_speed = Speed(0, 0, 0)  # type: Speed
+        self.pose_history = PoseHistory()  # Used to deskew lidar scans
         self.robot.communication.register_callback(self.robot.communication.eTypeUp.ODOM_REPORT,
                                                    self.handle_new_odometry_report)
         self.robot.communication.register_callback(self.robot.communication.eTypeUp.SPEED_REPORT,
@@ -53,6 +55,7 @@ class Locomotion:
         self.current_pose.x = x
         self.current_pose.y = y
         self.current_pose.theta = center_radians(theta)
+        self.pose_history.append(time.monotonic(), x, y, self.current_pose.theta)
 
     def handle_new_speed_report(self, vx, vy, vtheta, drifting_left, drifting_right):
         self.is_drifting = [drifting_left, drifting_right]
@@ -89,13 +92,22 @@ class Locomotion:
     def navigate_to(self, x, y, theta):
         # TODO: Probably detach a thread...
         traj = self.pathfinder.find_path((self.x, self.y), (float(x), float(y)))
-        if traj is None or len(traj) < 2:
+        if traj is None:
             print("[Locomotion] No trajectory found from {} to {} using pathfinder".format((self.x, self.y), (x, y)))
+            return
+        if not traj:
+            # The goal is in the node of the robot
+            self.go_to_orient(x, y, theta)
+            return
+        traj = self.pathfinder.smooth_path((self.x, self.y), traj)
+        # Each point is oriented along the path (only the orientation of the last one is reached by the robot)
         traj_orient = []
+        previous = (self.x, self.y)
         for pt in traj[:-1]:
-            traj_orient.append((int(pt[0]), int(pt[1]), 0))
-        traj_orient.append((int(traj[-1][0]), int(traj[-1][1]), theta))
-        print(traj_orient)
+            traj_orient.append((pt[0], pt[1], math.atan2(pt[1] - previous[1], pt[0] - previous[0])))
+            previous = pt
+        traj_orient.append((traj[-1][0], traj[-1][1], theta))
+        print("[Locomotion] Smoothed trajectory of {} points to {}".format(len(traj_orient), traj_orient[-1]))
         self.follow_trajectory(traj_orient)
 
     def speed_constraints_from_obstacles(self):
@@ -186,7 +198,7 @@ class Locomotion:
             
         # print("State : {}\tSending speed : {}".format(self.position_control.state, speed), end='\r', flush=True)
         self.current_speed = speed
-        self.robot.communication.send_speed_command(*speed)
+        self.robot.communication.send_speed_command(*speed, wait=False)
 
     def stop(self):
         self.previous_mode = self.mode
@@ -244,6 +256,8 @@ class Locomotion:
             self.x = x
             self.y = y
             self.theta = theta
+            self.pose_history.clear()
+            self.pose_history.append(time.monotonic(), x, y, theta)
 
     def follow_trajectory(self, points_list):
         """
@@ -8,6 +8,10 @@ ADMITTED_ANGLE_ERROR = 0.05  # rad
 
 ### Position control
 LOOKAHEAD_DISTANCE = 150.
+CLOSEST_SEGMENT_SEARCH_WINDOW = 3  # segments from the last closest one in which the closest point is searched
+PROFILE_DECELERATION = ACCELERATION_MAX / 2  # mm/s², the robot brakes on about twice the distance at ACCELERATION_MAX
+PROFILE_LOOKUP_TICKS = 1  # control periods ahead of the robot at which the profile speed is read (motor reaction time)
+PROFILE_MIN_SPEED = 20  # mm/s, lowest speed until the next point where the robot stops is reached
 
 ### Obstacle stopping
 FAR_ELLIPSE_MAJOR_AXIS = 550
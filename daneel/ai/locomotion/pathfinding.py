@@ -4,6 +4,63 @@ import numpy as np
 GRAPH_FILE = "data/nav_graph.pbm"
 TABLE_HEIGHT = 2000
 TABLE_WIDTH = 3000
+DYNAMIC_OBSTACLES_MARGIN = 200  # mm, inflation of the lidar occupancy grid cells (robot radius + safety margin)
+SMOOTHING_MIN_RADIUS = 100  # mm, tightest arc replacing a corner of a path, sharper corners are kept as they are
+SMOOTHING_STEP = 20  # mm, distance between the points of a smoothed path
+
+
+def corner_arc(before, corner, after, max_tangent_length, step):
+    """
+    Circular arc tangent to the segments before-corner and corner-after, replacing the corner, with the largest radius
+    whose tangent points are at most max_tangent_length from the corner.
+
+    :param before: point before the corner (x, y)
+    :type before: np.ndarray
+    :type corner: np.ndarray
+    :param after: point after the corner (x, y)
+    :type after: np.ndarray
+    :param max_tangent_length: distance from the corner to the tangent points (mm)
+    :type max_tangent_length: float
+    :param step: highest distance between two points of the arc (mm)
+    :type step: float
+    :return: radius of the arc (mm) and its points (x, y), from the tangent point before the corner to the one after
+        (radius 0 and the corner if the path turns back at the corner, None if it is straight or a segment is empty)
+    :rtype: tuple[float, np.ndarray]|None
+    """
+    length_in = np.hypot(*(corner - before))
+    length_out = np.hypot(*(after - corner))
+    if length_in == 0 or length_out == 0:
+        return None
+    direction_in = (corner - before) / length_in
+    direction_out = (after - corner) / length_out
+    turn = math.atan2(direction_in[0] * direction_out[1] - direction_in[1] * direction_out[0],
+                      direction_in.dot(direction_out))  # deflection angle, positive to the left
+    if abs(turn) < 1e-3:
+        return None
+    if abs(turn) > math.pi - 1e-3:
+        return 0., corner[np.newaxis]
+    radius = max_tangent_length / math.tan(abs(turn) / 2)
+    start = corner - direction_in * max_tangent_length
+    normal = np.array((-direction_in[1], direction_in[0])) * math.copysign(1, turn)  # towards the center of the arc
+    center = start + normal * radius
+    nb_points = max(2, math.ceil(radius * abs(turn) / step) + 1)
+    angles = math.atan2(-normal[1], -normal[0]) + np.linspace(0, turn, nb_points)
+    return radius, center + radius * np.column_stack((np.cos(angles), np.sin(angles)))
+
+
+def resample(points, step):
+    """
+    :param points: (x, y) of the points of a path
+    :type points: np.ndarray
+    :param step: distance along the path between two points of the new path (mm)
+    :type step: float
+    :return: points evenly spaced along the path, at most step apart (the first and last points are kept, even if the
+        path has no length)
+    :rtype: np.ndarray
+    """
+    lengths = np.concatenate(([0.], np.cumsum(np.hypot(*np.diff(points, axis=0).T))))
+    distances = np.linspace(0., lengths[-1], max(1, math.ceil(lengths[-1] / step)) + 1)
+    return np.column_stack((np.interp(distances, lengths, points[:, 0]), np.interp(distances, lengths, points[:, 1])))
 
 
 class PathFinding:
@@ -59,6 +116,25 @@ class ThetaStar(PathFinding):
         self.load_graph(GRAPH_FILE)
         self.height = len(self.graph[0])
         self.width = len(self.graph)
+        self.static_free = np.vectorize(lambda n: n.value, otypes=[bool])(self.graph)
+        self._current_free = self.static_free.copy()
+
+    def update_dynamic_obstacles(self, start):
+        """
+        Block the nodes which are occupied in the lidar occupancy grid (robot.map.occupancy), and free the ones
+        which are not anymore. The start node is never blocked by a dynamic obstacle.
+
+        :param start: start node of the next search
+        :type start: Node
+        """
+        occupancy = getattr(self.robot.map, 'occupancy', None)
+        if occupancy is None or occupancy.shape != self.static_free.shape:
+            return
+        free = self.static_free & ~occupancy.occupied(DYNAMIC_OBSTACLES_MARGIN)
+        free[start.x, start.y] = self.static_free[start.x, start.y]
+        for i, j in np.argwhere(free != self._current_free):
+            self.graph[i, j].value = free[i, j]
+        self._current_free = free
 
     def load_graph(self, file):
         with open(file, 'r') as f:
@@ -96,6 +172,7 @@ class ThetaStar(PathFinding):
         opened = set()
         closed = set()
         start_node = self.graph[int(start[0] * self.graph_table_ratio)][int(start[1] * self.graph_table_ratio)]
+        self.update_dynamic_obstacles(start_node)
         if not start_node.value:
             print("[Theta*] Start position in obstacle. Aborting.")
             return
@@ -205,4 +282,84 @@ class ThetaStar(PathFinding):
                 if dx == 0 and not self.graph[x0][y0 + (sy - 1)//2].value and not self.graph[x0 - 1][y0 + (sy - 1)//2].value:
                     return False
                 y0 = y0 + sy
-        return True
\ No newline at end of file
+        return True
+
+    def node_at(self, x, y):
+        """
+        :param x: position on the table (mm), of a node of a path found by find_path
+        :param y: position on the table (mm)
+        :return: the node closest to this position
+        :rtype: Node
+        """
+        return self.graph[min(self.width - 1, max(0, int(round(x * self.graph_table_ratio))))][
+            min(self.height - 1, max(0, int(round(y * self.graph_table_ratio))))]
+
+    def shortcut_path(self, points):
+        """
+        Remove the points of a path which can be skipped: from each point kept, go straight to the furthest point in
+        line of sight.
+
+        :param points: (x, y) of the points of the path (mm)
+        :type points: list[tuple[float, float]]
+        :rtype: list[tuple[float, float]]
+        """
+        nodes = [self.node_at(*point) for point in points]
+        kept = [points[0]]
+        i = 0
+        while i < len(points) - 1:
+            j = len(points) - 1
+            while j > i + 1 and not self.line_of_sight(nodes[i], nodes[j]):
+                j -= 1
+            kept.append(points[j])
+            i = j
+        return kept
+
+    def is_free_polyline(self, points):
+        """
+        :param points: (x, y) of the points of a polyline (mm)
+        :type points: np.ndarray
+        :return: True if all the segments of the polyline are in line of sight
+        :rtype: bool
+        """
+        nodes = [self.node_at(x, y) for x, y in points]
+        return all(self.line_of_sight(s, s_2) for s, s_2 in zip(nodes[:-1], nodes[1:]))
+
+    def smooth_path(self, start, path):
+        """
+        Make a path found by find_path faster to follow: shortcut the points in line of sight, replace each corner by
+        the largest circular arc (of radius at least SMOOTHING_MIN_RADIUS) which is free of obstacles and does not
+        overlap the arcs of the next corners, and resample the path every SMOOTHING_STEP.
+
+        :param start: start of the path (x, y) (mm), not in path
+        :type start: tuple[float, float]
+        :param path: path found by find_path from start
+        :type path: list[tuple[float, float]]
+        :return: points of the smoothed path (x, y) (mm), without start
+        :rtype: list[tuple[float, float]]
+        """
+        points = np.array(self.shortcut_path([tuple(start)] + list(path)), dtype=float)
+        lengths = np.hypot(*np.diff(points, axis=0).T)
+        pieces = [[points[:1]]]  # Smooth parts of the path, between the corners kept
+        for i in range(1, len(points) - 1):
+            tangent_length = min(lengths[i - 1], lengths[i]) / 2
+            while True:
+                arc = corner_arc(points[i - 1], points[i], points[i + 1], tangent_length, SMOOTHING_STEP)
+                if arc is None:  # No corner
+                    pieces[-1].append(points[i:i + 1])
+                    break
+                if arc[0] < SMOOTHING_MIN_RADIUS:
+                    # Corner kept, ending a piece so that the resampled path goes through it. The robot slows down
+                    # there, and stops and turns in place if the path turns by at least 60° (see
+                    # PositionControl.new_trajectory).
+                    pieces[-1].append(points[i:i + 1])
+                    pieces.append([points[i:i + 1]])
+                    break
+                if self.is_free_polyline(arc[1]):
+                    pieces[-1].append(arc[1])
+                    break
+                tangent_length /= 2
+        pieces[-1].append(points[-1:])
+        smoothed = []
+        for piece in pieces:
+            smoothed.extend((float(x), float(y)) for x, y in resample(np.concatenate(piece), SMOOTHING_STEP)[1:])
+        return smoothed
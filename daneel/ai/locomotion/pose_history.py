@@ -0,0 +1,77 @@
+import numpy as np
+
+from locomotion.utils import center_radians
+
+POSE_HISTORY_LENGTH = 64  # number of odometry reports kept (must cover at least one lidar revolution)
+
+
+class PoseHistory:
+    """
+    Short ring buffer of timestamped robot poses, fed by the odometry reports.
+    It is used to know where the robot was when a sensor (typically the lidar) took a measurement.
+    Theta is stored unwrapped so that it can be linearly interpolated.
+    """
+
+    def __init__(self, length=POSE_HISTORY_LENGTH):
+        self._t = np.zeros(length)
+        self._x = np.zeros(length)
+        self._y = np.zeros(length)
+        self._theta = np.zeros(length)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        """
+        Forget every stored pose (to be called when the pose jumps, eg. on repositioning).
+        """
+        self._next = 0
+        self._count = 0
+
+    def append(self, timestamp, x, y, theta):
+        """
+        Store a new pose. Timestamps must be increasing.
+
+        :param timestamp: time.monotonic() at which the robot was at this pose
+        :type timestamp: float
+        :param x: x coordinate of the robot in table frame (mm)
+        :type x: float
+        :param y: y coordinate of the robot in table frame (mm)
+        :type y: float
+        :param theta: orientation of the robot (rad)
+        :type theta: float
+        """
+        if self._count > 0:
+            last_theta = self._theta[self._next - 1]
+            theta = last_theta + center_radians(theta - last_theta)
+        self._t[self._next] = timestamp
+        self._x[self._next] = x
+        self._y[self._next] = y
+        self._theta[self._next] = theta
+        self._next = (self._next + 1) % len(self._t)
+        self._count = min(self._count + 1, len(self._t))
+
+    def _ordered(self, array):
+        if self._count < len(array):
+            return array[:self._count]
+        return np.roll(array, -self._next)
+
+    def interpolate(self, timestamps):
+        """
+        Vectorized pose lookup. Poses are linearly interpolated between odometry reports and clamped to the
+        oldest/newest known pose outside of the history.
+
+        :param timestamps: times (time.monotonic() clock) at which the pose is wanted
+        :type timestamps: np.ndarray
+        :return: (x, y, theta) arrays with the same shape as timestamps, or None if the history is empty.
+            Theta is not normalized.
+        :rtype: tuple[np.ndarray, np.ndarray, np.ndarray]|None
+        """
+        if self._count == 0:
+            return None
+        t = self._ordered(self._t)
+        return (np.interp(timestamps, t, self._ordered(self._x)),
+                np.interp(timestamps, t, self._ordered(self._y)),
+                np.interp(timestamps, t, self._ordered(self._theta)))
@@ -0,0 +1,192 @@
+import numpy as np
+
+from locomotion.params import ACCELERATION_MAX, PROFILE_DECELERATION, LINEAR_SPEED_MAX, ROTATION_SPEED_MAX
+from locomotion.utils import PointOrient, TrajPoint
+
+
+def curvatures(xy):
+    """
+    Curvature of the path at each point, from the circle through the point and its neighbours (0 at both ends).
+
+    :param xy: (x, y) of each point
+    :type xy: np.ndarray
+    :return: curvature at each point (1/mm)
+    :rtype: np.ndarray
+    """
+    curvature = np.zeros(len(xy))
+    if len(xy) < 3:
+        return curvature
+    before = xy[1:-1] - xy[:-2]
+    after = xy[2:] - xy[1:-1]
+    cross = np.abs(before[:, 0] * after[:, 1] - before[:, 1] * after[:, 0])
+    lengths = np.hypot(*before.T) * np.hypot(*after.T) * np.hypot(*(before + after).T)
+    np.divide(2 * cross, lengths, out=curvature[1:-1], where=lengths > 0)
+    return curvature
+
+
+def velocity_profile(lengths, max_speeds, acceleration=ACCELERATION_MAX, deceleration=PROFILE_DECELERATION):
+    """
+    Fastest speed at each point of a path reachable from the start with the acceleration, and from which the robot can
+    brake down to the speed of all the next points with the deceleration: a forward pass bounds the speeds by the
+    acceleration from the previous point, then a backward pass by the deceleration to the next point.
+
+    :param lengths: length of each segment (mm), one less than the points
+    :type lengths: np.ndarray
+    :param max_speeds: highest speed allowed at each point (mm/s)
+    :type max_speeds: np.ndarray
+    :type acceleration: float
+    :type deceleration: float
+    :return: speed at each point (mm/s)
+    :rtype: np.ndarray
+    """
+    speeds = np.array(max_speeds, dtype=float)
+    for i in range(len(lengths)):
+        speeds[i + 1] = min(speeds[i + 1], (speeds[i] ** 2 + 2 * acceleration * lengths[i]) ** 0.5)
+    for i in range(len(lengths) - 1, -1, -1):
+        speeds[i] = min(speeds[i], (speeds[i + 1] ** 2 + 2 * deceleration * lengths[i]) ** 0.5)
+    return speeds
+
+
+class Trajectory:
+    """
+    Trajectory followed by the position control: points (x, y, theta) with the target speed of the robot at each
+    one, stored in numpy arrays with the length of the path from the first point to each point.
+    The speeds are a velocity profile computed once, from the speeds given (ACCELERATION_MAX, PROFILE_DECELERATION,
+    and ROTATION_SPEED_MAX on the curvature of the path), so that speed_at is a lookup.
+    The reached points are dropped from the front without copying the arrays. Indexing and iterating give TrajPoint,
+    as the list of TrajPoint used before.
+    Segment i goes from point i to point i + 1 (the indexes are relative to the first point not dropped).
+    """
+
+    def __init__(self, points=(), speeds=()):
+        """
+        :param points: (x, y, theta) of each point
+        :type points: collections.Sequence[tuple[float, float, float]]
+        :param speeds: highest speed at each point (mm/s), 0 where the robot must stop
+        :type speeds: collections.Sequence[float]
+        """
+        points = np.array(points, dtype=float).reshape(-1, 3)
+        self._xy = points[:, :2].copy()
+        self._theta = points[:, 2].copy()
+        max_speeds = np.minimum(np.array(speeds, dtype=float), LINEAR_SPEED_MAX)
+        self._vectors = np.diff(self._xy, axis=0)  # vector of each segment
+        self._squared_lengths = (self._vectors ** 2).sum(axis=1)
+        self._lengths = np.sqrt(self._squared_lengths)
+        self._cumulative_lengths = np.concatenate(([0.], np.cumsum(self._lengths)))
+        self._stops = np.flatnonzero(max_speeds == 0)  # indexes of the points where the robot must stop
+        curvature_speeds = np.full(len(max_speeds), np.inf)
+        curvature = curvatures(self._xy)
+        np.divide(ROTATION_SPEED_MAX, curvature, out=curvature_speeds, where=curvature > 0)
+        np.minimum(max_speeds, curvature_speeds, out=max_speeds)
+        self._speed = velocity_profile(self._lengths, max_speeds)
+        self._start = 0
+
+    def __len__(self):
+        return len(self._theta) - self._start
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("trajectory index out of range")
+        i = self._start + item
+        return TrajPoint(PointOrient(float(self._xy[i, 0]), float(self._xy[i, 1]), float(self._theta[i])),
+                         float(self._speed[i]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def clear(self):
+        self._start = len(self._theta)
+
+    def pop_front(self, count=1):
+        """
+        Drop the first points of the trajectory, once they have been reached.
+
+        :type count: int
+        """
+        self._start = min(len(self._theta), self._start + count)
+
+    def closest_point(self, x, y, first_segment, nb_segments):
+        """
+        Find the point of the path closest to (x, y), in nb_segments segments from first_segment, and not after the
+        first point where the robot must stop (except the first point of the trajectory).
+
+        :return: the index of the segment of the closest point, and its position on the segment (0 to 1)
+        :rtype: tuple[int, float]
+        """
+        first = self._start + first_segment
+        last = min(len(self._theta) - 1, first + nb_segments)
+        stop = np.searchsorted(self._stops, max(first, self._start + 1))
+        if stop < len(self._stops):
+            last = min(last, self._stops[stop] + 1)
+        if last <= first:
+            return first_segment, 0.
+        relative = np.array((x, y)) - self._xy[first:last]
+        vectors = self._vectors[first:last]
+        squared_lengths = self._squared_lengths[first:last]
+        t = np.zeros(last - first)
+        np.divide((relative * vectors).sum(axis=1), squared_lengths, out=t, where=squared_lengths > 0)
+        np.clip(t, 0., 1., out=t)
+        distances = ((relative - vectors * t[:, np.newaxis]) ** 2).sum(axis=1)
+        closest = int(np.argmin(distances))
+        return first_segment + closest, float(t[closest])
+
+    def lookahead_point(self, segment, t, distance):
+        """
+        Find the point at distance along the path from the point at t on segment, or the next point where the robot
+        must stop if it is closer.
+
+        :param segment: index of the segment of the start point
+        :type segment: int
+        :param t: position of the start point on the segment (0 to 1)
+        :type t: float
+        :param distance: length of path to the lookahead point (mm)
+        :type distance: float
+        :return: the lookahead point (x, y), and the index of the end point of its segment
+        :rtype: tuple[float, float, int]
+        """
+        i = self._start + segment
+        goal_length = self._cumulative_lengths[i] + t * self._lengths[i] + distance
+        end = int(np.searchsorted(self._cumulative_lengths, goal_length))  # first point at least at goal_length
+        stop = np.searchsorted(self._stops, i + 1)
+        if stop < len(self._stops):
+            end = min(end, int(self._stops[stop]))
+        end = max(i + 1, min(end, len(self._theta) - 1))
+        length = self._lengths[end - 1]
+        goal_t = 1. if length == 0 else min(1., (goal_length - self._cumulative_lengths[end - 1]) / length)
+        goal_x, goal_y = self._xy[end - 1] + self._vectors[end - 1] * goal_t
+        return float(goal_x), float(goal_y), end - self._start
+
+    def speed_at(self, segment, t, distance=0.):
+        """
+        Speed of the velocity profile at distance along the path from the point at t on segment (not after the next
+        point where the robot must stop).
+        Between two points, the speed is the highest one reachable from the first and from which the robot can brake
+        down to the second.
+
+        :param segment: index of the segment of the start point
+        :type segment: int
+        :param t: position of the start point on the segment (0 to 1)
+        :type t: float
+        :param distance: length of path to the point whose speed is given (mm)
+        :type distance: float
+        :return: speed (mm/s)
+        :rtype: float
+        """
+        i = self._start + segment
+        if i >= len(self._lengths):
+            return 0.
+        length = self._cumulative_lengths[i] + t * self._lengths[i] + distance
+        stop = np.searchsorted(self._stops, i + 1)
+        if stop < len(self._stops):
+            length = min(length, self._cumulative_lengths[self._stops[stop]])
+        end = int(np.searchsorted(self._cumulative_lengths, length))
+        end = max(i + 1, min(end, len(self._theta) - 1))
+        from_start = min(self._lengths[end - 1], max(0., length - self._cumulative_lengths[end - 1]))
+        speed = min(self._speed[end - 1] ** 2 + 2 * ACCELERATION_MAX * from_start,
+                    self._speed[end] ** 2 + 2 * PROFILE_DECELERATION * (self._lengths[end - 1] - from_start)) ** 0.5
+        return float(min(speed, LINEAR_SPEED_MAX))
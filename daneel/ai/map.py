@@ -1,4 +1,7 @@
 import yaml
+import numpy as np
+
+from occupancy_grid import OccupancyGrid
 
 
 class Map:
@@ -7,6 +10,8 @@ class Map:
         self.lidar_table_bb = None  #   type: BoundingBox
         self.lidar_static_obstacles_bb = []  # type: list[BoundingBox]
         self.static_obstacles = []
+        self._lidar_mask_boxes = np.empty((0, 4))  # [[min_x, min_y, max_x, max_y], ...] for vectorized tests
+        self.occupancy = OccupancyGrid()  # Dynamic obstacles seen by the lidar, fed by IO lidar scans
         self.load_lidar_static_obstacle(obstacle_lidar_mask_path)
         self.load_obstacles(obstacles_path)
 
@@ -47,6 +52,42 @@ class Map:
                     x2 = int(o['x_stop'])
                     y2 = int(o['y_stop'])
                     self.lidar_static_obstacles_bb.append(BoundingBox(self.robot, x1, y1, x2, y2))
+        self._lidar_mask_boxes = np.array([[bb.min_x, bb.min_y, bb.max_x, bb.max_y]
+                                           for bb in self.lidar_static_obstacles_bb], dtype=float).reshape(-1, 4)
+
+    def is_dynamic_obstacle(self, x, y):
+        """
+        :return: True where the point is in an occupied cell of the lidar occupancy grid (vectorized)
+        :rtype: np.ndarray
+        """
+        return self.occupancy.is_occupied(x, y)
+
+    def in_lidar_mask(self, x, y):
+        """
+        Vectorized lidar mask test: a point is masked if it is outside of the table bounding box or inside
+        one of the static obstacles bounding boxes.
+
+        :param x: x coordinates of the points in table frame (mm)
+        :type x: np.ndarray
+        :param y: y coordinates of the points in table frame (mm)
+        :type y: np.ndarray
+        :return: True where the point must be ignored by obstacle detection
+        :rtype: np.ndarray
+        """
+        x = np.asarray(x)
+        y = np.asarray(y)
+        if self.lidar_table_bb is None:
+            masked = np.zeros(x.shape, dtype=bool)
+        else:
+            masked = ~((self.lidar_table_bb.min_x <= x) & (x <= self.lidar_table_bb.max_x) &
+                       (self.lidar_table_bb.min_y <= y) & (y <= self.lidar_table_bb.max_y))
+        if len(self._lidar_mask_boxes) > 0:
+            xe = x[..., np.newaxis]
+            ye = y[..., np.newaxis]
+            boxes = self._lidar_mask_boxes
+            masked |= ((boxes[:, 0] <= xe) & (xe <= boxes[:, 2]) & (boxes[:, 1] <= ye) & (ye <= boxes[:, 3])).any(
+                axis=-1)
+        return masked
 
 
 class Obstacle:
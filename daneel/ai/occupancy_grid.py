@@ -0,0 +1,131 @@
+"""
+Dynamic occupancy layer built from the lidar scans, complementary to the static obstacles of map.Map.
+
+The grid stores log-odds of occupancy and has the same resolution and indexing ([x][y]) as the ThetaStar
+navigation graph. Each lidar revolution lowers the log-odds of the cells crossed by the rays and raises the
+log-odds of the cells hit by the points; all the cells decay towards "unknown" between scans, so that moving
+obstacles do not stay in the grid.
+"""
+import numpy as np
+
+from locomotion.pathfinding import TABLE_WIDTH, TABLE_HEIGHT
+
+GRID_RATIO = 0.1  # cells per mm, must be the same as the ThetaStar graph (data/nav_graph.pbm)
+LOG_ODDS_HIT = 0.85
+LOG_ODDS_FREE = -0.4
+LOG_ODDS_MIN = -2.
+LOG_ODDS_MAX = 3.5
+LOG_ODDS_OCCUPIED = 0.7  # cells above this value are occupied
+DECAY = 0.85  # factor applied to the whole grid at each scan
+MAX_RAY_LENGTH = 1500  # mm, free space is only updated up to this distance (bounds the cost of a scan)
+
+
+class OccupancyGrid:
+    def __init__(self, ratio=GRID_RATIO, width=TABLE_WIDTH, height=TABLE_HEIGHT):
+        self.ratio = ratio
+        self.shape = (int(round(width * ratio)), int(round(height * ratio)))
+        self.log_odds = np.zeros(self.shape, dtype=np.float32)
+        step = 1 / ratio
+        self._ray_steps = np.arange(0, MAX_RAY_LENGTH, step)  # distances of the free space samples along a ray
+        self._free = np.zeros(self.shape[0] * self.shape[1], dtype=bool)
+        self._hit = np.zeros(self.shape[0] * self.shape[1], dtype=bool)
+
+    def reset(self):
+        self.log_odds[:] = 0
+
+    def _cell_indices(self, x, y):
+        """
+        :return: the flat indices of the cells containing the points, and which points are inside the grid
+        """
+        ix = np.floor(np.asarray(x) * self.ratio).astype(int)
+        iy = np.floor(np.asarray(y) * self.ratio).astype(int)
+        inside = (ix >= 0) & (ix < self.shape[0]) & (iy >= 0) & (iy < self.shape[1])
+        return np.where(inside, ix * self.shape[1] + iy, 0), inside
+
+    def update(self, origin_x, origin_y, x, y, hits):
+        """
+        Fuse a set of rays in the grid.
+
+        :param origin_x: x of the lidar for each ray (table frame, mm)
+        :param origin_y: y of the lidar for each ray (table frame, mm)
+        :param x: x of the end of each ray (table frame, mm)
+        :param y: y of the end of each ray (table frame, mm)
+        :param hits: for each ray, True if its end is an obstacle (False if it must only clear free space)
+        :type hits: np.ndarray
+        """
+        self.log_odds *= DECAY
+        dx = x - origin_x
+        dy = y - origin_y
+        lengths = np.hypot(dx, dy)
+        safe_lengths = np.maximum(lengths, 1e-9)
+        # Sample every ray each cell length, stopping one cell before its end
+        steps = self._ray_steps[np.newaxis, :]
+        on_ray = steps < (lengths - 1 / self.ratio)[:, np.newaxis]
+        sx = origin_x[:, np.newaxis] + dx[:, np.newaxis] / safe_lengths[:, np.newaxis] * steps
+        sy = origin_y[:, np.newaxis] + dy[:, np.newaxis] / safe_lengths[:, np.newaxis] * steps
+        free_cells, inside = self._cell_indices(sx[on_ray], sy[on_ray])
+        hit_cells, hit_inside = self._cell_indices(x[hits], y[hits])
+
+        # Boolean masks so that a cell is updated only once per scan whatever the number of rays crossing it
+        self._free[:] = False
+        self._hit[:] = False
+        self._free[free_cells[inside]] = True
+        self._hit[hit_cells[hit_inside]] = True
+        flat = self.log_odds.reshape(-1)
+        flat[self._free & ~self._hit] += LOG_ODDS_FREE
+        flat[self._hit] += LOG_ODDS_HIT
+        np.clip(self.log_odds, LOG_ODDS_MIN, LOG_ODDS_MAX, out=self.log_odds)
+
+    def handle_new_scan(self, scan):
+        """
+        Lidar scan callback (see IO.register_lidar_scan_callback). Every usable point clears the space between the
+        lidar and itself, points outside of the lidar mask are obstacles.
+
+        :type scan: io_robot.LidarScan
+        """
+        rays = scan.usable & (scan.distance > 0)
+        self.update(scan.origin_x[rays], scan.origin_y[rays], scan.x[rays], scan.y[rays], ~scan.masked[rays])
+
+    def occupied(self, margin=0):
+        """
+        :param margin: distance (mm) by which the occupied cells are inflated, eg. the robot radius
+        :type margin: float
+        :return: True for occupied cells, indexed [x][y] like the ThetaStar graph
+        :rtype: np.ndarray
+        """
+        occupied = self.log_odds > LOG_ODDS_OCCUPIED
+        if margin > 0:
+            occupied = inflate(occupied, int(round(margin * self.ratio)))
+        return occupied
+
+    def is_occupied(self, x, y):
+        """
+        Vectorized query.
+
+        :param x: x coordinates in table frame (mm)
+        :param y: y coordinates in table frame (mm)
+        :return: True where the cell containing the point is occupied (False outside of the grid)
+        """
+        cells, inside = self._cell_indices(x, y)
+        return inside & (self.log_odds.reshape(-1)[cells] > LOG_ODDS_OCCUPIED)
+
+
+def inflate(mask, radius):
+    """
+    Dilate a boolean grid by a square of (2 * radius + 1) cells, eg. to take the robot size into account.
+
+    :type mask: np.ndarray
+    :type radius: int
+    :rtype: np.ndarray
+    """
+    inflated = mask.copy()
+    for axis in (0, 1):
+        source = inflated.copy()
+        for shift in range(1, radius + 1):
+            if axis == 0:
+                inflated[shift:, :] |= source[:-shift, :]
+                inflated[:-shift, :] |= source[shift:, :]
+            else:
+                inflated[:, shift:] |= source[:, :-shift]
+                inflated[:, :-shift] |= source[:, shift:]
+    return inflated
@@ -0,0 +1,179 @@
+"""
+Opponent detection and tracking from lidar scans.
+
+Each new lidar revolution goes through the same vectorized pipeline:
+    1. keep the usable points which are not in the lidar mask (in table frame, see IO.lidar_scan)
+    2. split them into clusters wherever two consecutive points (in scan order) are too far from each other
+    3. keep the clusters which are the size of an opponent robot
+    4. associate the blobs with the tracked opponents and update them with an alpha-beta filter
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+CLUSTER_MAX_GAP = 80  # mm, two consecutive points further than this belong to different clusters
+CLUSTER_MIN_POINTS = 2
+OPPONENT_MIN_SIZE = 30  # mm, smallest blob extent considered as an opponent
+OPPONENT_MAX_SIZE = 450  # mm, biggest blob extent considered as an opponent
+
+TRACK_GATE = 300  # mm, a blob further than this from a predicted track position can not update it
+TRACK_ALPHA = 0.6  # position gain of the alpha-beta filter
+TRACK_BETA = 0.2  # speed gain of the alpha-beta filter
+TRACK_CONFIRMATION_HITS = 2  # number of detections before a track is exposed as an opponent
+TRACK_MAX_MISSES = 5  # number of scans without detection before a track is dropped
+
+Opponent = NamedTuple("Opponent", [('id', int), ('x', float), ('y', float), ('vx', float), ('vy', float),
+                                   ('size', float)])
+
+
+def cluster_points(x, y, max_gap=CLUSTER_MAX_GAP):
+    """
+    Label points given in scan order: a new cluster starts each time the distance between two consecutive points
+    is greater than max_gap. As a scan is circular, the last cluster is merged with the first one if they touch.
+
+    :param x: x coordinates of the points (mm)
+    :type x: np.ndarray
+    :param y: y coordinates of the points (mm)
+    :type y: np.ndarray
+    :param max_gap: maximum distance between two consecutive points of the same cluster (mm)
+    :type max_gap: float
+    :return: the cluster label of each point (from 0 to number of clusters - 1)
+    :rtype: np.ndarray
+    """
+    if len(x) == 0:
+        return np.zeros(0, dtype=int)
+    gaps = np.hypot(np.diff(x), np.diff(y)) > max_gap
+    labels = np.concatenate(([0], np.cumsum(gaps)))
+    if labels[-1] > 0 and np.hypot(x[0] - x[-1], y[0] - y[-1]) <= max_gap:
+        labels[labels == labels[-1]] = 0
+    return labels
+
+
+def fit_blobs(x, y, labels, observer_x, observer_y):
+    """
+    Compute the center and size of each cluster. The lidar only sees the side of an object facing it, so the
+    centroid of the points is pushed away from the observer by half the cluster size.
+
+    :return: (centers_x, centers_y, sizes, number_of_points), one value per label
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+    """
+    nb_clusters = labels.max() + 1 if len(labels) > 0 else 0
+    counts = np.bincount(labels, minlength=nb_clusters)
+    safe_counts = np.maximum(counts, 1)
+    cx = np.bincount(labels, weights=x, minlength=nb_clusters) / safe_counts
+    cy = np.bincount(labels, weights=y, minlength=nb_clusters) / safe_counts
+    min_x = np.full(nb_clusters, np.inf)
+    max_x = np.full(nb_clusters, -np.inf)
+    min_y = np.full(nb_clusters, np.inf)
+    max_y = np.full(nb_clusters, -np.inf)
+    np.minimum.at(min_x, labels, x)
+    np.maximum.at(max_x, labels, x)
+    np.minimum.at(min_y, labels, y)
+    np.maximum.at(max_y, labels, y)
+    sizes = np.hypot(max_x - min_x, max_y - min_y)
+    dx = cx - observer_x
+    dy = cy - observer_y
+    norms = np.maximum(np.hypot(dx, dy), 1e-9)
+    return cx + dx / norms * sizes / 2, cy + dy / norms * sizes / 2, sizes, counts
+
+
+class OpponentDetector:
+    """
+    Detects and tracks opponent robots. Registers itself on the IO lidar scan callbacks, so
+    IO.check_lidar_scan must be called regularly.
+    """
+
+    def __init__(self, robot):
+        self.robot = robot
+        self._next_id = 0
+        self.reset()
+        self.robot.io.register_lidar_scan_callback(self.handle_new_scan)
+
+    @property
+    def opponents(self):
+        """
+        :return: the confirmed tracked opponents, positions in mm and speeds in mm/s, in table frame
+        :rtype: list[Opponent]
+        """
+        confirmed = np.flatnonzero(self._hits >= TRACK_CONFIRMATION_HITS)
+        return [Opponent(int(self._ids[i]), float(self._positions[i, 0]), float(self._positions[i, 1]),
+                         float(self._speeds[i, 0]), float(self._speeds[i, 1]), float(self._sizes[i]))
+                for i in confirmed]
+
+    def reset(self):
+        self._ids = np.zeros(0, dtype=int)
+        self._positions = np.zeros((0, 2))
+        self._speeds = np.zeros((0, 2))
+        self._sizes = np.zeros(0)
+        self._times = np.zeros(0)
+        self._hits = np.zeros(0, dtype=int)
+        self._misses = np.zeros(0, dtype=int)
+
+    def detect(self, scan):
+        """
+        Find opponent sized blobs in a lidar scan.
+
+        :param scan: deskewed lidar scan
+        :type scan: io_robot.LidarScan
+        :return: (positions [n, 2], sizes [n], timestamps [n]) of the blobs in table frame
+        :rtype: tuple[np.ndarray, np.ndarray, np.ndarray]
+        """
+        selected = np.flatnonzero(scan.usable & ~scan.masked & (scan.distance > 0))
+        x = scan.x[selected]
+        y = scan.y[selected]
+        labels = cluster_points(x, y)
+        cx, cy, sizes, counts = fit_blobs(x, y, labels, self.robot.locomotion.x, self.robot.locomotion.y)
+        timestamps = np.bincount(labels, weights=scan.timestamp[selected], minlength=len(counts)) / \
+            np.maximum(counts, 1)
+        is_opponent = (counts >= CLUSTER_MIN_POINTS) & (sizes >= OPPONENT_MIN_SIZE) & (sizes <= OPPONENT_MAX_SIZE)
+        return np.stack((cx, cy), axis=-1)[is_opponent], sizes[is_opponent], timestamps[is_opponent]
+
+    def handle_new_scan(self, scan):
+        positions, sizes, timestamps = self.detect(scan)
+        self.update(positions, sizes, timestamps)
+
+    def update(self, positions, sizes, timestamps):
+        """
+        Update the tracks with new detections: predict every track at the detection time, associate each detection
+        with the closest predicted track (greedy, gated by TRACK_GATE), then correct the associated tracks with an
+        alpha-beta filter. Non associated detections create new tracks, tracks not seen for too long are dropped.
+        """
+        nb_tracks = len(self._ids)
+        assigned_tracks = np.full(len(positions), -1)
+        if nb_tracks > 0 and len(positions) > 0:
+            dt = timestamps[np.newaxis, :] - self._times[:, np.newaxis]
+            predicted = self._positions[:, np.newaxis, :] + self._speeds[:, np.newaxis, :] * dt[..., np.newaxis]
+            distances = np.linalg.norm(predicted - positions[np.newaxis, :, :], axis=-1)
+            for flat_index in np.argsort(distances, axis=None):
+                track, detection = np.unravel_index(flat_index, distances.shape)
+                if distances[track, detection] > TRACK_GATE:
+                    break
+                if assigned_tracks[detection] == -1 and track not in assigned_tracks:
+                    assigned_tracks[detection] = track
+
+        detections = np.flatnonzero(assigned_tracks >= 0)
+        tracks = assigned_tracks[detections]
+        if len(tracks) > 0:
+            dt = np.maximum(timestamps[detections] - self._times[tracks], 1e-3)[:, np.newaxis]
+            predicted = self._positions[tracks] + self._speeds[tracks] * dt
+            residuals = positions[detections] - predicted
+            self._positions[tracks] = predicted + TRACK_ALPHA * residuals
+            self._speeds[tracks] += TRACK_BETA / dt * residuals
+            self._sizes[tracks] = sizes[detections]
+            self._times[tracks] = timestamps[detections]
+            self._hits[tracks] += 1
+        missed = np.ones(nb_tracks, dtype=bool)
+        missed[tracks] = False
+        self._misses[missed] += 1
+        self._misses[tracks] = 0
+
+        new = np.flatnonzero(assigned_tracks < 0)
+        kept = self._misses <= TRACK_MAX_MISSES
+        self._ids = np.concatenate((self._ids[kept], np.arange(self._next_id, self._next_id + len(new))))
+        self._next_id += len(new)
+        self._positions = np.concatenate((self._positions[kept], positions[new]))
+        self._speeds = np.concatenate((self._speeds[kept], np.zeros((len(new), 2))))
+        self._sizes = np.concatenate((self._sizes[kept], sizes[new]))
+        self._times = np.concatenate((self._times[kept], timestamps[new]))
+        self._hits = np.concatenate((self._hits[kept], np.ones(len(new), dtype=int)))
+        self._misses = np.concatenate((self._misses[kept], np.zeros(len(new), dtype=int)))
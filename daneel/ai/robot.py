@@ -11,6 +11,8 @@ from locomotion.locomotion import *
 from behavior import Behaviors
 from table.table import Table
 from robot_parts import AtomStorage
+from opponent_detection import OpponentDetector
+from scheduler import Scheduler
 
 TRACE_FILE = "/home/pi/code/primary_robot/ai/log/log_"+str(datetime.datetime.now()).replace(' ', '_')
 
@@ -22,19 +24,28 @@ LIDAR_MASK_FILE = "data/obstacles_lidar_mask.yaml"
 STATIC_OBSTACLES_FILE = "data/obstacles_2019.yaml"
 TEENSY_SERIAL_PATH_DEFAULT = "/dev/ttyAMA0"
 
+COMMUNICATION_PERIOD = 0.01  # s, reception of the Teensy messages and of the lidar scans
+COMMUNICATION_MAX_READ = 50  # Teensy messages handled at most per communication period
+LOCOMOTION_PERIOD = 0.05  # s
+BEHAVIOR_PERIOD = 0.2  # s, behavior and lidar speed control
+TELEMETRY_PERIOD = 10  # s, printing of the scheduler statistics
+
 
 class Robot(object):
     def __init__(self, behavior=BEHAVIOR_DEFAULT, ivy_address=IVY_ADDRESS_DEFAULT,
                  static_obstacles_file=STATIC_OBSTACLES_FILE, lidar_mask_file=LIDAR_MASK_FILE,
-                 teensy_serial_path=TEENSY_SERIAL_PATH_DEFAULT):
+                 teensy_serial_path=TEENSY_SERIAL_PATH_DEFAULT, teensy_journal=None, teensy_batching=False):
         self.map = map.Map(self, static_obstacles_file, lidar_mask_file)
         self.table = Table(self)
         self.storages = {AtomStorage.Side.RIGHT: AtomStorage(robot, AtomStorage.Side.RIGHT),
                          AtomStorage.Side.LEFT: AtomStorage(robot, AtomStorage.Side.LEFT)}
-        self.communication = communication.Communication(teensy_serial_path)
+        self.communication = communication.Communication(teensy_serial_path, journal_path=teensy_journal,
+                                                         batching=teensy_batching)
         self.communication.start()
         self.io = IO(self)
+        self.io.register_lidar_scan_callback(self.map.occupancy.handle_new_scan)
         self.locomotion = Locomotion(self)
+        self.opponent_detector = OpponentDetector(self)
         self.ivy = ivy_robot.Ivy(self, ivy_address)
         if behavior == Behaviors.FSMMatch.value:
             from behavior.fsmmatch import FSMMatch
@@ -59,7 +70,8 @@ class Robot(object):
 def main():
     global robot
     robot = Robot(behavior=parsed_args.behavior, ivy_address=parsed_args.ivy, lidar_mask_file=parsed_args.mask,
-                  teensy_serial_path=parsed_args.teensy_serial)
+                  teensy_serial_path=parsed_args.teensy_serial, teensy_journal=parsed_args.journal,
+                  teensy_batching=parsed_args.batching)
     # Arguments parsing
     robot.communication.mock_communication = parsed_args.no_teensy
     robot.communication.register_callback(communication.eTypeUp.ODOM_REPORT,
@@ -72,15 +84,22 @@ def main():
     #                                       robot.locomotion.handle_new_odometry_report)
     # robot.communication.register_callback(communication.eTypeUp.ODOM_REPORT, lambda o, n, x, y, t: print(
     #     "X : {}, Y : {}, Theta : {}".format(robot.locomotion.x, robot.locomotion.y, robot.locomotion.theta)))
-    last_behavior_time = time.time()
-    last_locomotion_time = time.time()
-    while True:
-        robot.communication.check_message(10)
-        if time.time() - last_locomotion_time >= 0.05:
-            robot.locomotion.locomotion_loop(obstacle_detection=True)
-        if time.time() - last_behavior_time >= 0.2:
-            robot.behavior.loop()
-            last_behavior_time = time.time()
+    scheduler = Scheduler()
+
+    def communication_task():
+        robot.communication.check_message(COMMUNICATION_MAX_READ)
+        robot.io.check_lidar_scan()
+
+    def behavior_task():
+        robot.io.lidar_speed_control_loop()
+        robot.behavior.loop()
+
+    scheduler.add_task("communication", COMMUNICATION_PERIOD, communication_task)
+    scheduler.add_task("locomotion", LOCOMOTION_PERIOD,
+                       lambda: robot.locomotion.locomotion_loop(obstacle_detection=True))
+    scheduler.add_task("behavior", BEHAVIOR_PERIOD, behavior_task)
+    scheduler.add_task("telemetry", TELEMETRY_PERIOD, scheduler.print_statistics, phase=TELEMETRY_PERIOD)
+    scheduler.run()
 
 
 if __name__ == '__main__':
@@ -96,6 +115,12 @@ if __name__ == '__main__':
                         help="Path to YAML file containing obstacle detection lidar masks")
     parser.add_argument('-t', '--teensy_serial', type=str, default=TEENSY_SERIAL_PATH_DEFAULT,
                         help="Path to serial plugged to Teensy.")
+    parser.add_argument('-j', '--journal', type=str, default=None,
+                        help="Record the frames exchanged with the Teensy in this file (see communication.journal).")
+    parser.add_argument('--batching', action='store_true', default=False,
+                        help="Send several messages per frame to the Teensy if its firmware supports it. After each "
+                             "reset, the messages wait for the protocol negotiation (up to 150 ms with a firmware "
+                             "which does not support it).")
     parsed_args = parser.parse_args()
     # if __debug__:
     #     with open(TRACE_FILE, 'w') as sys.stdout:
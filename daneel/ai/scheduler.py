@@ -0,0 +1,154 @@
+"""
+Fixed rate scheduler of the periodic tasks of the main loop of the robot.
+
+Each task has a deadline on the monotonic clock, incremented by its period after each run (so the rate does not drift
+with the execution times). Between two deadlines the scheduler sleeps, then waits actively for the last
+SPIN_DURATION to start the tasks on time. A task still running at its next deadline has overrun: the ticks missed are
+skipped instead of being run late in a burst. Example:
+
+    scheduler = Scheduler()
+    scheduler.add_task("locomotion", 0.05, robot.locomotion.locomotion_loop)
+    scheduler.run()
+"""
+import time
+from collections import deque
+
+SPIN_DURATION = 0.0005  # s, active waiting before a deadline, as time.sleep may wake up late
+JITTER_HISTORY_SIZE = 1000  # runs of a task whose start jitter is kept for the percentiles
+
+
+class TaskStatistics:
+    def __init__(self):
+        self.runs = 0
+        self.overruns = 0  # runs ending after the next deadline of the task (too long, or started late)
+        self.skipped_ticks = 0  # deadlines missed because of the overruns
+        self.total_duration = 0.  # s
+        self.max_duration = 0.  # s
+        self.max_jitter = 0.  # s
+        self.jitters = deque(maxlen=JITTER_HISTORY_SIZE)  # s, delay between the deadline and the start of each run
+
+    def record(self, jitter, duration):
+        self.runs += 1
+        self.jitters.append(jitter)
+        self.max_jitter = max(self.max_jitter, jitter)
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+
+    def jitter_percentile(self, ratio):
+        """
+        :param ratio: percentile (0 to 1) of the start jitter of the last JITTER_HISTORY_SIZE runs
+        :type ratio: float
+        :return: start jitter (s)
+        :rtype: float
+        """
+        if not self.jitters:
+            return 0.
+        ordered = sorted(self.jitters)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+    def __str__(self):
+        return "{} runs, {} overruns ({} ticks skipped), duration mean {:.2f} ms max {:.2f} ms, jitter p50 {:.2f} ms " \
+               "p99 {:.2f} ms max {:.2f} ms".format(self.runs, self.overruns, self.skipped_ticks,
+                                                   self.total_duration / self.runs * 1000 if self.runs else 0.,
+                                                   self.max_duration * 1000, self.jitter_percentile(0.5) * 1000,
+                                                   self.jitter_percentile(0.99) * 1000, self.max_jitter * 1000)
+
+
+class PeriodicTask:
+    def __init__(self, name, period, function, deadline):
+        """
+        :param name: name of the task in the statistics
+        :type name: str
+        :param period: time between two runs (s)
+        :type period: float
+        :param function: called without argument at each run
+        :type function: function
+        :param deadline: time of the first run (s, time.monotonic)
+        :type deadline: float
+        """
+        self.name = name
+        self.period = period
+        self.function = function
+        self.deadline = deadline
+        self.statistics = TaskStatistics()
+
+
+class Scheduler:
+    def __init__(self):
+        self.tasks = []  # PeriodicTask, in their registration order, which is their run order at the same deadline
+        self._running = False
+
+    def add_task(self, name, period, function, phase=0.):
+        """
+        Register a function called every period, from the first call of run (or now if it is running).
+
+        :param name: name of the task in the statistics
+        :type name: str
+        :param period: time between two calls (s)
+        :type period: float
+        :param function: called without argument
+        :type function: function
+        :param phase: delay of the first call (s), to spread the tasks of the same period
+        :type phase: float
+        :rtype: PeriodicTask
+        """
+        task = PeriodicTask(name, period, function, time.monotonic() + phase)
+        self.tasks.append(task)
+        return task
+
+    def stop(self):
+        """
+        Make run return after the current tick.
+        """
+        self._running = False
+
+    def run(self, duration=None):
+        """
+        Run the tasks at their deadlines, until stop is called.
+
+        :param duration: if given, return after this time (s)
+        :type duration: float|None
+        """
+        self._running = True
+        start = time.monotonic()
+        if self.tasks:  # The first runs are moved to now, keeping the phases between the tasks
+            origin = min(task.deadline for task in self.tasks)
+            for task in self.tasks:
+                task.deadline += start - origin
+        end = None if duration is None else start + duration
+        while self._running and self.tasks:
+            next_deadline = min(task.deadline for task in self.tasks)
+            if end is not None and next_deadline >= end:
+                return
+            self._wait_until(next_deadline)
+            self.tick()
+
+    def tick(self):
+        """
+        Run the tasks whose deadline has passed, once each.
+        """
+        for task in self.tasks:
+            start = time.monotonic()
+            if start < task.deadline:
+                continue
+            task.function()
+            end = time.monotonic()
+            task.statistics.record(start - task.deadline, end - start)
+            task.deadline += task.period
+            if end >= task.deadline:
+                task.statistics.overruns += 1
+                missed = int((end - task.deadline) // task.period) + 1
+                task.statistics.skipped_ticks += missed
+                task.deadline += missed * task.period
+
+    def print_statistics(self):
+        print("[Scheduler] Statistics :\n{}".format("\n".join("{} ({:.0f} ms): {}".format(
+            task.name, task.period * 1000, task.statistics) for task in self.tasks)))
+
+    @staticmethod
+    def _wait_until(deadline):
+        remaining = deadline - time.monotonic()
+        if remaining > SPIN_DURATION:
+            time.sleep(remaining - SPIN_DURATION)
+        while time.monotonic() < deadline:
+            pass
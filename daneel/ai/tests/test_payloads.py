@@ -0,0 +1,448 @@
+"""
+Byte for byte comparison of the payload classes of communication.message_definition (generated from
+communication.protocol_schema) with the classes of the baseline implementation, frozen below.
+
+The reference classes are those of the baseline message_definition, with their raw "_x" attributes and conversion
+properties, and with struct instead of bitstring (which is no longer a dependency). Their converters are frozen
+copies: a wrong width, order, scale or offset in the schema makes the comparison fail. As in the current classes, the
+values set on the odometry and PID payloads are rounded (bitstring rejected the float raw values).
+
+From the ai directory:
+    python3 -m unittest tests.test_payloads
+"""
+import struct
+import unittest
+
+from communication import message_definition
+from communication.protocol_schema import UP_PAYLOADS, DOWN_PAYLOADS
+
+# Frozen converters of the baseline message_definition
+LINEAR_POSITION_TO_MSG_FACTOR = 4
+LINEAR_POSITION_TO_MSG_ADDER = 8192
+RADIAN_TO_MSG_FACTOR = 10430.378350470453
+RADIAN_TO_MSG_ADDER = 3.14159265358979323846
+LINEAR_SPEED_TO_MSG_FACTOR = 32.768
+LINEAR_SPEED_TO_MSG_ADDER = 1000
+ANGULAR_SPEED_TO_MSG_FACTOR = 2607.5945876176133
+ANGULAR_SPEED_TO_MSG_ADDER = 4 * 3.14159265358979323846
+
+# Raw value of field k of sample i: (i * FIELD_STRIDES[k] + k) modulo the range of the field. The strides are odd, so
+# the RAW_SAMPLES samples go through every raw value of every field, with different combinations of the fields.
+FIELD_STRIDES = (1, 40503, 9973, 2053, 31, 257)
+RAW_SAMPLES = 0x10000
+
+
+class RefAckDown:
+    FORMAT = struct.Struct('<B')
+    FIELDS = ('ack_down_id',)
+
+    def __init__(self):
+        self.ack_down_id = None
+
+    def deserialize(self, bytes_packed):
+        self.ack_down_id, = self.FORMAT.unpack(bytes_packed)
+
+    def serialize(self):
+        return self.FORMAT.pack(self.ack_down_id)
+
+
+class RefOdomReport:
+    FORMAT = struct.Struct('<HHH')
+    FIELDS = ('x', 'y', 'theta')
+
+    def __init__(self):
+        self._x = None
+        self._y = None
+        self._theta = None
+
+    @property
+    def x(self):
+        return self._x / LINEAR_POSITION_TO_MSG_FACTOR - LINEAR_POSITION_TO_MSG_ADDER
+
+    @x.setter
+    def x(self, x):
+        self._x = round((x + LINEAR_POSITION_TO_MSG_ADDER) * LINEAR_POSITION_TO_MSG_FACTOR)
+
+    @property
+    def y(self):
+        return self._y / LINEAR_POSITION_TO_MSG_FACTOR - LINEAR_POSITION_TO_MSG_ADDER
+
+    @y.setter
+    def y(self, y):
+        self._y = round((y + LINEAR_POSITION_TO_MSG_ADDER) * LINEAR_POSITION_TO_MSG_FACTOR)
+
+    @property
+    def theta(self):
+        return self._theta / RADIAN_TO_MSG_FACTOR - RADIAN_TO_MSG_ADDER
+
+    @theta.setter
+    def theta(self, theta):
+        self._theta = round((theta + RADIAN_TO_MSG_ADDER) * RADIAN_TO_MSG_FACTOR)
+
+    def deserialize(self, bytes_packed):
+        self._x, self._y, self._theta = self.FORMAT.unpack(bytes_packed)
+
+    def serialize(self):
+        return self.FORMAT.pack(self._x, self._y, self._theta)
+
+
+class RefHMIState:
+    FORMAT = struct.Struct('<B')
+    FIELDS = ('hmi_state',)
+
+    def __init__(self):
+        self.hmi_state = None
+
+    def deserialize(self, bytes_packed):
+        self.hmi_state, = self.FORMAT.unpack(bytes_packed)
+
+    def serialize(self):
+        return self.FORMAT.pack(self.hmi_state)
+
+
+class RefSpeedReport:
+    FORMAT = struct.Struct('<HHHB')
+    FIELDS = ('vx', 'vy', 'vtheta', 'drifting_flags')
+
+    def __init__(self):
+        self._vx = None
+        self._vy = None
+        self._vtheta = None
+        self._drifting = None
+
+    @property
+    def vx(self):
+        return self._vx / LINEAR_SPEED_TO_MSG_FACTOR - LINEAR_SPEED_TO_MSG_ADDER
+
+    @vx.setter
+    def vx(self, value):
+        self._vx = round((value + LINEAR_SPEED_TO_MSG_ADDER) * LINEAR_SPEED_TO_MSG_FACTOR)
+
+    @property
+    def vy(self):
+        return self._vy / LINEAR_SPEED_TO_MSG_FACTOR - LINEAR_SPEED_TO_MSG_ADDER
+
+    @vy.setter
+    def vy(self, value):
+        self._vy = round((value + LINEAR_SPEED_TO_MSG_ADDER) * LINEAR_SPEED_TO_MSG_FACTOR)
+
+    @property
+    def vtheta(self):
+        return self._vtheta / ANGULAR_SPEED_TO_MSG_FACTOR - ANGULAR_SPEED_TO_MSG_ADDER
+
+    @vtheta.setter
+    def vtheta(self, value):
+        self._vtheta = round((value + ANGULAR_SPEED_TO_MSG_ADDER) * ANGULAR_SPEED_TO_MSG_FACTOR)
+
+    @property
+    def drifting_flags(self):
+        return self._drifting
+
+    @drifting_flags.setter
+    def drifting_flags(self, value):
+        self._drifting = value
+
+    @property
+    def drifting(self):
+        return (bool(self._drifting & 0b01), bool(self._drifting & 0b10))
+
+    def deserialize(self, bytes_packed):
+        self._vx, self._vy, self._vtheta, self._drifting = self.FORMAT.unpack(bytes_packed)
+
+    def serialize(self):
+        return self.FORMAT.pack(self._vx, self._vy, self._vtheta, self._drifting)
+
+
+class RefSensorValue:
+    FORMAT = struct.Struct('<BH')
+    FIELDS = ('sensor_id', 'sensor_value')
+
+    def __init__(self):
+        self.sensor_id = None
+        self.sensor_value = None
+
+    def deserialize(self, bytes_packed):
+        self.sensor_id, self.sensor_value = self.FORMAT.unpack(bytes_packed)
+
+    def serialize(self):
+        return self.FORMAT.pack(self.sensor_id, self.sensor_value)
+
+
+class RefAckUp:
+    FORMAT = struct.Struct('<B')
+    FIELDS = ('ack_up_id',)
+
+    def __init__(self):
+        self.ack_up_id = None
+
+    def deserialize(self, bytes_packed):
+        self.ack_up_id, = self.FORMAT.unpack(bytes_packed)
+
+    def serialize(self):
+        return self.FORMAT.pack(self.ack_up_id)
+
+
+class RefSpeedCommand:
+    FORMAT = struct.Struct('<HHH')
+    FIELDS = ('vx', 'vy', 'vtheta')
+
+    def __init__(self):
+        self._vx = None
+        self._vy = None
+        self._vtheta = None
+
+    @property
+    def vx(self):
+        return self._vx / LINEAR_SPEED_TO_MSG_FACTOR - LINEAR_SPEED_TO_MSG_ADDER
+
+    @vx.setter
+    def vx(self, vx):
+        self._vx = round((vx + LINEAR_SPEED_TO_MSG_ADDER) * LINEAR_SPEED_TO_MSG_FACTOR)
+
+    @property
+    def vy(self):
+        return self._vy / LINEAR_SPEED_TO_MSG_FACTOR - LINEAR_SPEED_TO_MSG_ADDER
+
+    @vy.setter
+    def vy(self, vy):
+        self._vy = round((vy + LINEAR_SPEED_TO_MSG_ADDER) * LINEAR_SPEED_TO_MSG_FACTOR)
+
+    @property
+    def vtheta(self):
+        return self._vtheta / ANGULAR_SPEED_TO_MSG_FACTOR - ANGULAR_SPEED_TO_MSG_ADDER
+
+    @vtheta.setter
+    def vtheta(self, vtheta):
+        self._vtheta = round((vtheta + ANGULAR_SPEED_TO_MSG_ADDER) * ANGULAR_SPEED_TO_MSG_FACTOR)
+
+    def deserialize(self, bytes_packed):
+        self._vx, self._vy, self._vtheta = self.FORMAT.unpack(bytes_packed)
+
+    def serialize(self):
+        return self.FORMAT.pack(self._vx, self._vy, self._vtheta)
+
+
+class RefActuatorCommand:
+    FORMAT = struct.Struct('<BH')
+    FIELDS = ('actuator_id', 'actuator_command')
+
+    def __init__(self):
+        self.actuator_id = None
+        self.actuator_command = None
+
+    def deserialize(self, bytes_packed):
+        self.actuator_id, self.actuator_command = self.FORMAT.unpack(bytes_packed)
+
+    def serialize(self):
+        return self.FORMAT.pack(self.actuator_id, self.actuator_command)
+
+
+class RefHMICommand:
+    FORMAT = struct.Struct('<B')
+    FIELDS = ('hmi_command',)
+
+    def __init__(self):
+        self.hmi_command = None
+
+    def deserialize(self, bytes_packed):
+        self.hmi_command, = self.FORMAT.unpack(bytes_packed)
+
+    def serialize(self):
+        return self.FORMAT.pack(self.hmi_command)
+
+
+class RefRepositioning:
+    FORMAT = struct.Struct('<HHH')
+    FIELDS = ('x_repositioning', 'y_repositioning', 'theta_repositioning')
+
+    def __init__(self):
+        self._x_repositioning = None
+        self._y_repositioning = None
+        self._theta_repositioning = None
+
+    @property
+    def x_repositioning(self):
+        return self._x_repositioning / LINEAR_POSITION_TO_MSG_FACTOR - LINEAR_POSITION_TO_MSG_ADDER
+
+    @x_repositioning.setter
+    def x_repositioning(self, value):
+        self._x_repositioning = min(round((value + LINEAR_POSITION_TO_MSG_ADDER) * LINEAR_POSITION_TO_MSG_FACTOR),
+                                    65535)
+
+    @property
+    def y_repositioning(self):
+        return self._y_repositioning / LINEAR_POSITION_TO_MSG_FACTOR - LINEAR_POSITION_TO_MSG_ADDER
+
+    @y_repositioning.setter
+    def y_repositioning(self, value):
+        self._y_repositioning = min(round((value + LINEAR_POSITION_TO_MSG_ADDER) * LINEAR_POSITION_TO_MSG_FACTOR),
+                                    65535)
+
+    @property
+    def theta_repositioning(self):
+        return self._theta_repositioning / RADIAN_TO_MSG_FACTOR - RADIAN_TO_MSG_ADDER
+
+    @theta_repositioning.setter
+    def theta_repositioning(self, value):
+        self._theta_repositioning = min(round((value + RADIAN_TO_MSG_ADDER) * RADIAN_TO_MSG_FACTOR), 65535)
+
+    def deserialize(self, bytes_packed):
+        self._x_repositioning, self._y_repositioning, self._theta_repositioning = self.FORMAT.unpack(bytes_packed)
+
+    def serialize(self):
+        return self.FORMAT.pack(self._x_repositioning, self._y_repositioning, self._theta_repositioning)
+
+
+def _pid_gain(name):
+    def getter(self):
+        return getattr(self, name) / 1000
+
+    def setter(self, value):
+        setattr(self, name, round(value * 1000))
+    return property(getter, setter)
+
+
+class RefPIDTuning:
+    FORMAT = struct.Struct('<HHHHHH')
+    FIELDS = ('kp_linear', 'ki_linear', 'kd_linear', 'kp_angular', 'ki_angular', 'kd_angular')
+
+    kp_linear = _pid_gain('_kp_linear')
+    ki_linear = _pid_gain('_ki_linear')
+    kd_linear = _pid_gain('_kd_linear')
+    kp_angular = _pid_gain('_kp_angular')
+    ki_angular = _pid_gain('_ki_angular')
+    kd_angular = _pid_gain('_kd_angular')
+
+    def __init__(self):
+        self._kp_linear = None
+        self._ki_linear = None
+        self._kd_linear = None
+        self._kp_angular = None
+        self._ki_angular = None
+        self._kd_angular = None
+
+    def deserialize(self, bytes_packed):
+        self._kp_linear, self._ki_linear, self._kd_linear, self._kp_angular, self._ki_angular, \
+            self._kd_angular = self.FORMAT.unpack(bytes_packed)
+
+    def serialize(self):
+        return self.FORMAT.pack(self._kp_linear, self._ki_linear, self._kd_linear, self._kp_angular, self._ki_angular,
+                                self._kd_angular)
+
+
+class RefSensorCommand:
+    FORMAT = struct.Struct('<BB')
+    FIELDS = ('sensor_id', 'sensor_state')
+
+    def __init__(self):
+        self.sensor_id = None
+        self.sensor_state = None
+
+    def deserialize(self, bytes_packed):
+        self.sensor_id, self.sensor_state = self.FORMAT.unpack(bytes_packed)
+
+    def serialize(self):
+        return self.FORMAT.pack(self.sensor_id, self.sensor_state)
+
+
+class RefProtocolVersion:
+    """
+    Not in the baseline: class of the protocol version 2 before the payloads were generated.
+    """
+    FORMAT = struct.Struct('<B')
+    FIELDS = ('version',)
+
+    def __init__(self):
+        self.version = None
+
+    def deserialize(self, bytes_packed):
+        self.version, = self.FORMAT.unpack(bytes_packed)
+
+    def serialize(self):
+        return self.FORMAT.pack(self.version)
+
+
+REFERENCE_CLASSES = {
+    'sAckDown': RefAckDown,
+    'sOdomReport': RefOdomReport,
+    'sHMIState': RefHMIState,
+    'sSpeedReport': RefSpeedReport,
+    'sSensorValue': RefSensorValue,
+    'sAckUp': RefAckUp,
+    'sSpeedCommand': RefSpeedCommand,
+    'sActuatorCommand': RefActuatorCommand,
+    'sHMICommand': RefHMICommand,
+    'sRepositioning': RefRepositioning,
+    'sPIDTuning': RefPIDTuning,
+    'sSensorCommand': RefSensorCommand,
+    'sProtocolVersion': RefProtocolVersion,
+}
+
+
+def raw_samples(fmt):
+    """
+    :param fmt: struct format of a payload
+    :type fmt: struct.Struct
+    :return: raw values of the fields of RAW_SAMPLES payloads (every raw value of each field is in at least one)
+    :rtype: collections.Iterator[tuple[int, ...]]
+    """
+    ranges = [1 << 8 * struct.calcsize(width) for width in fmt.format.lstrip('<')]
+    for i in range(RAW_SAMPLES if max(ranges) > RAW_SAMPLES else max(ranges)):
+        yield tuple((i * FIELD_STRIDES[k] + k) % size for k, size in enumerate(ranges))
+
+
+class TestPayloads(unittest.TestCase):
+    def test_every_payload_has_a_reference(self):
+        self.assertEqual(set(REFERENCE_CLASSES),
+                         {payload.class_name for payload in UP_PAYLOADS + DOWN_PAYLOADS})
+
+    def _check_payload(self, payload):
+        cls = getattr(message_definition, payload.class_name)
+        reference_cls = REFERENCE_CLASSES[payload.class_name]
+        self.assertEqual(tuple(field.name for field in payload.fields), reference_cls.FIELDS)
+        self.assertEqual(cls.FORMAT.format.lstrip('<'), reference_cls.FORMAT.format.lstrip('<'))
+        for raw in raw_samples(reference_cls.FORMAT):
+            packed = reference_cls.FORMAT.pack(*raw)
+            reference = reference_cls()
+            reference.deserialize(packed)
+            decoded = cls()
+            decoded.deserialize(packed)
+            values = [getattr(reference, name) for name in reference_cls.FIELDS]
+            self.assertEqual([getattr(decoded, name) for name in reference_cls.FIELDS], values,
+                             "{} deserialized from {}".format(payload.class_name, packed))
+            self.assertEqual(decoded.serialize(), reference.serialize(),
+                             "{} serialized back from {}".format(payload.class_name, packed))
+
+            # Encoding of the values, as set by the ai
+            reference = reference_cls()
+            encoded = cls()
+            for name, value in zip(reference_cls.FIELDS, values):
+                setattr(reference, name, value)
+                setattr(encoded, name, value)
+            expected = reference.serialize()
+            self.assertEqual(encoded.serialize(), expected, "{} serialized from {}".format(payload.class_name, values))
+            buffer = bytearray(len(expected) + 1)
+            encoded.pack_into(buffer, 1)
+            self.assertEqual(bytes(buffer[1:]), expected, "{} packed from {}".format(payload.class_name, values))
+
+    def test_up_payloads(self):
+        for payload in UP_PAYLOADS:
+            with self.subTest(payload.class_name):
+                self._check_payload(payload)
+
+    def test_down_payloads(self):
+        for payload in DOWN_PAYLOADS:
+            with self.subTest(payload.class_name):
+                self._check_payload(payload)
+
+    def test_speed_report_drifting(self):
+        for flags in range(0x100):
+            reference = RefSpeedReport()
+            reference.deserialize(RefSpeedReport.FORMAT.pack(0, 0, 0, flags))
+            report = message_definition.sSpeedReport()
+            report.deserialize(RefSpeedReport.FORMAT.pack(0, 0, 0, flags))
+            self.assertEqual(report.drifting, reference.drifting)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -201,6 +201,29 @@ uint8_t Communication::getMessageSize(const sMessageUp& msg){
 	}
 }
 
+uint8_t Communication::getDownDataSize(const eDownMessageType type){
+	switch(type){
+	case ACK_UP:
+		return sizeof(sAckUp);
+	case SPEED_CMD:
+		return sizeof(sSpeedCmd);
+	case ACTUATOR_CMD:
+		return sizeof(sActuatorCmd);
+	case HMI_CMD:
+		return sizeof(sHMICmd);
+	case REPOSITIONING:
+		return sizeof(sRepositioning);
+	case PID_TUNING:
+		return sizeof(sPIDTuning);
+	case SENSOR_CMD:
+		return sizeof(sSensorCmd);
+	case PROTOCOL_VERSION:
+		return sizeof(sProtocolVersion);
+	default:
+		return 0;
+	}
+}
+
 uint8_t Communication::computeUpChecksum(const sMessageUp& msg){
 	uRawMessageUp rawMessage;
 	unsigned char checksum = 0;
@@ -338,6 +361,23 @@ void Communication::recieveMessage(const sMessageDown& msg){
 			sensorMsgCallbacks.cb[i](sensorCommand);
 		}
 		break;
+	case BATCH:
+		for (int i = 0; i < msg.dataSize;){
+			sMessageDown batchedMsg;
+			batchedMsg.downMsgId = msg.downMsgId;
+			batchedMsg.downMsgType = (eDownMessageType)msg.downData.batchData[i];
+			batchedMsg.dataSize = getDownDataSize(batchedMsg.downMsgType);
+			if (batchedMsg.downMsgType == ACK_UP || batchedMsg.downMsgType == RESET || batchedMsg.downMsgType >= BATCH ||
+					i + 1 + batchedMsg.dataSize > msg.dataSize){
+				break;  // Not a message which can be batched, or truncated : ignore the end of the batch
+			}
+			memcpy(&batchedMsg.downData, &msg.downData.batchData[i + 1], batchedMsg.dataSize);
+			recieveMessage(batchedMsg);
+			i += 1 + batchedMsg.dataSize;
+		}
+		break;
+	case PROTOCOL_VERSION:
+		break;  // The acknowledgement is the answer
 	}
 }
 
@@ -356,7 +396,7 @@ void Communication::checkMessages(){
 #endif
 				}
 				//Serial.println();
-				if (receivingMsg.messageDown.downMsgType > SENSOR_CMD){
+				if (receivingMsg.messageDown.downMsgType > PROTOCOL_VERSION){
 #if DEBUG_COMM
 					Serial.print("Invalid down message type: ");
 					Serial.println(receivingMsg.messageDown.downMsgType);
@@ -115,7 +115,9 @@ private:
 	static constexpr double angularSpeedToMsgAdder = 4 * M_PI;
 	static constexpr int upMsgMaxSize = 11;
 	static constexpr int upMsgHeaderSize = 4;  // Number of bytes discarded for checksum computation
-	static constexpr int downMsgMaxSize = 16;
+	static constexpr int batchMaxDataSize = 32;  // Maximum size of the data of a BATCH message
+	static constexpr int downMsgMaxSize = 4 + batchMaxDataSize;
+	static constexpr uint8_t protocolVersion = 2;  // 2 : BATCH and PROTOCOL_VERSION messages
 	static constexpr int downMsgHeaderSize = 4; // Number of bytes discarded for checksum computation
 	static constexpr unsigned char hmiCommandRedMask = 7 << 5;
 	static constexpr unsigned char hmiCommandGreenMask = 7 << 2;
@@ -181,7 +183,9 @@ private:
 		RESET,
 		REPOSITIONING,
 		PID_TUNING,
-		SENSOR_CMD
+		SENSOR_CMD,
+		BATCH,  // Several messages (type on 1 byte, then data) acknowledged and executed at once
+		PROTOCOL_VERSION  // Only acknowledged, to tell the raspi that the version 2 is supported
 	}eDownMessageType;
 	typedef struct __attribute__((packed)){
 		uint8_t ackUpMsgId;
@@ -215,6 +219,9 @@ private:
 		uint8_t sensorId;
 		uint8_t sensorState;
 	}sSensorCmd;
+	typedef struct __attribute__((packed)){
+		uint8_t version;
+	}sProtocolVersion;
 	typedef union __attribute__((packed)){
 		sAckUp ackMsg;
 		sSpeedCmd speedCmdMsg;
@@ -223,6 +230,8 @@ private:
 		sRepositioning repositioningMsg;
 		sPIDTuning pidTuningMsg;
 		sSensorCmd sensorCmdMsg;
+		sProtocolVersion protocolVersionMsg;
+		uint8_t batchData[batchMaxDataSize];
 	}uMessageDownData;
 	typedef struct __attribute__((packed)){
 		uint8_t downMsgId;
@@ -307,6 +316,7 @@ private:
 	int storeNewSentMessage(unsigned long time, const uRawMessageUp msg);
 	int removeAcknowledgedMessage(uint8_t acknowledgedId);
 	uint8_t getMessageSize(const sMessageUp& msg);
+	uint8_t getDownDataSize(const eDownMessageType type);
 	sUpMessageStorage toBeAcknowledged[maxNonAckMessageStored];
 	eState state;
 	uRawMessageDown receivingMsg;